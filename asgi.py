@@ -0,0 +1,16 @@
+"""
+Asynchronous Server Gateway Interface (ASGI) entry point
+
+Serve it with an ASGI server, e.g. uvicorn asgi:app
+"""
+import os
+import uvicorn
+from service.asgi import create_asgi_app
+from wsgi import app as wsgi_app
+
+PORT = int(os.getenv("PORT", "8000"))
+
+app = create_asgi_app(wsgi_app)
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="0.0.0.0", port=PORT)
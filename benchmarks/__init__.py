@@ -0,0 +1,6 @@
+"""
+Benchmarks for the Payments service
+
+Each module runs against the database in DATABASE_URI and prints its results
+as JSON. Run them from the project root, e.g. `python -m benchmarks.set_default`
+"""
@@ -0,0 +1,63 @@
+"""
+WSGI versus ASGI benchmark
+
+Starts the service twice on the same CPU cores, once with gunicorn sync workers
+(wsgi:app) and once with uvicorn workers (asgi:app), and sends both the same
+closed-loop mix of reads: single payment methods by id and a page of a user's
+payment methods. Reports requests per second and latency percentiles.
+
+Usage:
+    python -m benchmarks.asgi_vs_wsgi --workers 2 --concurrency 64 --seconds 10
+"""
+import argparse
+import os
+import sys
+from wsgi import app
+from benchmarks.http_load import (
+    add_load_arguments,
+    report,
+    run_load,
+    seeded_endpoints,
+    server_cores,
+    start_server,
+    stop_server,
+)
+
+SERVERS = {
+    "wsgi": ["gunicorn", "--workers", "{workers}", "--bind", "127.0.0.1:{port}", "wsgi:app"],
+    "asgi": ["uvicorn", "--workers", "{workers}", "--port", "{port}", "--log-level", "warning", "asgi:app"],
+}
+
+
+def run(args, paths, cores):
+    """Benchmarks each server in turn and returns the results"""
+    env = {**os.environ, "CACHE_BACKEND": args.cache}
+    results = []
+    for kind in ("wsgi", "asgi"):
+        command = [part.format(workers=args.workers, port=args.port) for part in SERVERS[kind]]
+        server = start_server(command, args.port, cores, env)
+        try:
+            summary = run_load(args.port, paths, args.concurrency, args.seconds)
+        finally:
+            stop_server(server)
+        results.append({"server": kind, **summary})
+    return results
+
+
+def main():
+    """Parses the command line and prints the results as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=2, help="worker processes and CPU cores of each server")
+    add_load_arguments(parser)
+    args = parser.parse_args()
+
+    with seeded_endpoints(app, args) as endpoints:
+        # pin the servers to their own cores, away from the load generator, when there are enough
+        cores, pinned = server_cores(args.workers)
+        results = run(args, endpoints["get"] + endpoints["list"], cores)
+    report("asgi_vs_wsgi", args, results, workers=args.workers, pinned=pinned)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
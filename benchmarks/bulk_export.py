@@ -0,0 +1,84 @@
+"""
+Bulk export benchmark
+
+Loads --rows credit cards and PayPal accounts made by the test factories for
+one user, then exports them with bulk_export.export(), as the payments-export
+command does, to each format, once to a single file and once in shards of
+--shard-rows written by --workers threads. Prints the rows per second and the
+bytes written of each as JSON, then removes the rows.
+
+Usage:
+    python -m benchmarks.bulk_export --rows 100000 --shard-rows 25000 --workers 4
+"""
+import argparse
+import json
+import logging
+import random
+import tempfile
+import os
+from flask_migrate import upgrade
+from wsgi import app
+from service.common import bulk_export
+from service.models import db, PaymentMethod
+from tests.factories import CreditCardFactory, PayPalFactory
+
+# The user of the exported rows
+USER_ID = 2820025
+
+
+def seed(rows, batch_size=10000):
+    """Loads rows PaymentMethods of the benchmark user"""
+    for start in range(0, rows, batch_size):
+        bodies = []
+        for _ in range(min(batch_size, rows - start)):
+            body = random.choice([CreditCardFactory, PayPalFactory])(user_id=USER_ID).serialize()
+            del body["id"]
+            bodies.append(body)
+        PaymentMethod.import_batch(bodies)
+
+
+def clean_up():
+    """Removes the rows, delete_matching() takes their subclass rows with them"""
+    PaymentMethod.delete_matching(PaymentMethod.find_by_user_id(USER_ID))
+
+
+def run(rows, shard_rows, workers):
+    """Runs the benchmark and returns its results"""
+    results = {}
+    with app.app_context():
+        upgrade()
+        clean_up()
+        seed(rows)
+        conditions = bulk_export.criteria(user_id=USER_ID)
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                for format_name in bulk_export.FORMATS:
+                    path = os.path.join(directory, f"payments.{format_name}")
+                    for name, shards in (("file", None), ("shards", shard_rows)):
+                        report = bulk_export.export(db.engine, path, format_name, conditions, shards, workers)
+                        results[f"{format_name}-{name}"] = {
+                            "files": len(report["files"]),
+                            "bytes": sum(file["bytes"] for file in report["files"]),
+                            "rows_per_second": round(report["rows_per_second"]),
+                        }
+        finally:
+            clean_up()
+        database = db.engine.dialect.name
+    return {"benchmark": "bulk_export", "database": database, "rows": rows, "workers": workers, "results": results}
+
+
+def main():
+    """Parses the command line and prints the results as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--shard-rows", type=int, default=25000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=2820)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    logging.getLogger("flask.app").setLevel(logging.WARNING)
+    print(json.dumps(run(args.rows, args.shard_rows, args.workers), indent=2))
+
+
+if __name__ == "__main__":
+    main()
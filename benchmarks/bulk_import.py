@@ -0,0 +1,94 @@
+"""
+Bulk import benchmark
+
+Writes --rows credit cards and PayPal accounts made by the test factories to
+an NDJSON file, then imports it with bulk_import.import_file(), as the
+payments-import command does, and loads the same rows in chunks with
+PaymentMethod.import_batch() using COPY and using multi-row INSERTs. Prints
+the rows per second of each as JSON. COPY needs PostgreSQL, on another
+database only the INSERTs are timed. The rows are made for one user and
+removed after each run.
+
+Usage:
+    python -m benchmarks.bulk_import --rows 100000 --chunk-size 10000
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+from flask_migrate import upgrade
+from wsgi import app
+from service.common import bulk_import
+from service.models import db, PaymentMethod
+from tests.factories import CreditCardFactory, PayPalFactory
+
+# The user of the imported rows
+USER_ID = 2820024
+
+
+def write_file(path, rows):
+    """Writes rows bodies to an NDJSON file"""
+    with open(path, "w", encoding="utf-8") as stream:
+        for _ in range(rows):
+            body = random.choice([CreditCardFactory, PayPalFactory])(user_id=USER_ID).serialize()
+            del body["id"]
+            stream.write(json.dumps(body) + "\n")
+
+
+def clean_up():
+    """Removes the imported rows, delete_matching() takes their subclass rows with them"""
+    PaymentMethod.delete_matching(PaymentMethod.find_by_user_id(USER_ID))
+
+
+def time_file(path, chunk_size):
+    """Returns the rows per second of importing the whole file"""
+    report = bulk_import.import_file(path, "ndjson", chunk_size)
+    clean_up()
+    return round(report["rows_per_second"])
+
+
+def time_batches(path, chunk_size, use_copy):
+    """Returns the rows per second of loading the bodies of the file in chunks"""
+    with open(path, encoding="utf-8") as stream:
+        bodies = list(bulk_import.read_ndjson(stream))
+    start = time.perf_counter()
+    for position in range(0, len(bodies), chunk_size):
+        PaymentMethod.import_batch(bodies[position:position + chunk_size], use_copy=use_copy)
+    seconds = time.perf_counter() - start
+    clean_up()
+    return round(len(bodies) / seconds)
+
+
+def run(rows, chunk_size):
+    """Runs the benchmark and returns its results"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "payments.ndjson")
+        write_file(path, rows)
+        with app.app_context():
+            upgrade()
+            clean_up()
+            dialect = db.engine.dialect.name
+            results = {"file_rows_per_second": time_file(path, chunk_size)}
+            if dialect == "postgresql":
+                results["copy_rows_per_second"] = time_batches(path, chunk_size, True)
+            results["insert_rows_per_second"] = time_batches(path, chunk_size, False)
+    return {"benchmark": "bulk_import", "database": dialect, "rows": rows, "chunk_size": chunk_size, "results": results}
+
+
+def main():
+    """Parses the command line and prints the results as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=2820)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    logging.getLogger("flask.app").setLevel(logging.WARNING)
+    print(json.dumps(run(args.rows, args.chunk_size), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Compression benchmark
+
+Writes lists of credit cards and PayPal accounts made by the test factories
+the way the list endpoint does, then times compressing them with each
+encoding at several levels. For every list size it prints the bytes sent, the
+compression ratio and the CPU time per response as JSON, which is the trade-off
+behind COMPRESSION_LEVEL, COMPRESSION_BROTLI_LEVEL and COMPRESSION_ZSTD_LEVEL.
+Needs no database.
+
+Usage:
+    python -m benchmarks.compression --rows 10,100,1000,5000 --repeat 20
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+from wsgi import app
+from service.common import compression
+from tests.factories import CreditCardFactory, PayPalFactory
+
+# The levels timed for each encoding, the defaults among them
+LEVELS = {"gzip": (1, 6, 9), "br": (1, 4, 9), "zstd": (1, 3, 10)}
+
+
+def make_list(rows):
+    """Returns the JSON body of a list of rows payment methods"""
+    with app.app_context():
+        from service import routes  # pylint: disable=import-outside-toplevel
+
+        payment_methods = [random.choice([CreditCardFactory, PayPalFactory])() for _ in range(rows)]
+        return routes.payment_method_json.dumps(payment_methods)
+
+
+def timings(data, encoding, level, repeat):
+    """Returns the times in ms of compressing data repeat times, and the compressed size"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        compressed = compression.compress(data, encoding, level)
+        times.append((time.perf_counter() - start) * 1000)
+    return times, len(compressed)
+
+
+def run(sizes, repeat):
+    """Runs the benchmark and returns its results"""
+    installed = [encoding for encoding in LEVELS if compression.INSTALLED[encoding]]
+    results = {}
+    for rows in sizes:
+        data = make_list(rows)
+        result = {"bytes": len(data)}
+        for encoding in installed:
+            for level in LEVELS[encoding]:
+                times, size = timings(data, encoding, level, repeat)
+                result[f"{encoding}-{level}"] = {
+                    "bytes": size,
+                    "ratio": round(len(data) / size, 2),
+                    "median_ms": round(statistics.median(times), 3),
+                    "mb_per_second": round(len(data) / 1e6 / (statistics.median(times) / 1000), 1),
+                }
+        results[str(rows)] = result
+    return {"benchmark": "compression", "repeat": repeat, "results": results}
+
+
+def main():
+    """Parses the command line and prints the results as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", default="10,100,1000,5000", help="sizes of the lists")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=2820)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    print(json.dumps(run([int(rows) for rows in args.rows.split(",")], args.repeat), indent=2))
+
+
+if __name__ == "__main__":
+    main()
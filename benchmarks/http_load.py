@@ -0,0 +1,205 @@
+"""
+HTTP load helpers shared by the server benchmarks
+
+Seeds payment methods for a range of benchmark users, starts a server process
+pinned to some CPU cores and drives it with a closed loop of keep-alive clients.
+"""
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import random
+import subprocess
+import time
+import urllib.request
+from flask_migrate import upgrade
+from service.models import PaymentMethod
+from tests.factories import CreditCardFactory, PayPalFactory
+
+
+def add_load_arguments(parser):
+    """Adds the options of the load and of the seeded data to a command line parser"""
+    parser.add_argument("--concurrency", type=int, default=64, help="requests in flight")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--methods", type=int, default=5, help="payment methods per user")
+    parser.add_argument("--first-user", type=int, default=900000)
+    parser.add_argument("--cache", default="none", help="CACHE_BACKEND of the servers")
+
+
+def percentile(latencies, fraction):
+    """Returns the latency in ms below which the given fraction of requests finished"""
+    if not latencies:
+        return None
+    ordered = sorted(latencies)
+    return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000, 3)
+
+
+def summarize(latencies, errors, seconds):
+    """Returns the request rate and latency percentiles of a run"""
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "requests_per_second": round(len(latencies) / seconds, 1),
+        "latency_ms": {
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+        },
+    }
+
+
+def benchmark_users(users, first_user):
+    """Returns a query of the payment methods of the benchmark users"""
+    user_ids = range(first_user, first_user + users)
+    return PaymentMethod.query.filter(PaymentMethod.user_id.in_(user_ids))
+
+
+def seed(users, methods, first_user):
+    """Creates the payment methods to read, returns their ids"""
+    PaymentMethod.delete_matching(benchmark_users(users, first_user))
+    user_ids = range(first_user, first_user + users)
+    payment_methods = [
+        random.choice([CreditCardFactory, PayPalFactory])(user_id=user_id)
+        for user_id in user_ids
+        for _ in range(methods)
+    ]
+    PaymentMethod.create_batch(payment_methods)
+    return [payment_method.id for payment_method in payment_methods]
+
+
+@contextlib.contextmanager
+def seeded_endpoints(app, args):
+    """Seeds the benchmark users, yields the paths of each endpoint, then removes them"""
+    app.logger.setLevel(logging.WARNING)
+    with app.app_context():
+        upgrade()
+        ids = seed(args.users, args.methods, args.first_user)
+    try:
+        yield {
+            "get": [f"/api/payments/{payment_method_id}" for payment_method_id in ids],
+            "list": [f"/api/payments?user_id={args.first_user + user}" for user in range(args.users)],
+        }
+    finally:
+        with app.app_context():
+            PaymentMethod.delete_matching(benchmark_users(args.users, args.first_user))
+
+
+def report(benchmark, args, results, **settings):
+    """Prints the settings and results of a benchmark as JSON"""
+    summary = {
+        "benchmark": benchmark,
+        **settings,
+        "concurrency": args.concurrency,
+        "seconds": args.seconds,
+        "results": results,
+    }
+    print(json.dumps(summary, indent=2))
+
+
+async def send(reader, writer, method, path, body=None, host="localhost"):  # pylint: disable=too-many-arguments
+    """Sends a request on a kept alive connection
+
+    Returns the status, the response body and whether the connection stays open.
+    """
+    data = b"" if body is None else json.dumps(body).encode()
+    head = f"{method} {path} HTTP/1.1\r\nHost: {host}\r\n"
+    if body is not None:
+        head += "Content-Type: application/json\r\n"
+    if body is not None or method != "GET":
+        head += f"Content-Length: {len(data)}\r\n"
+    writer.write(f"{head}\r\n".encode() + data)
+    await writer.drain()
+    status_code = int((await reader.readline()).split()[1])
+    length, keep_alive = 0, True
+    while (line := await reader.readline()) not in (b"\r\n", b""):
+        name, _, value = line.decode().partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+        elif name.lower() == "connection" and value.strip().lower() == "close":
+            keep_alive = False
+    return status_code, await reader.readexactly(length), keep_alive
+
+
+async def get(reader, writer, path):
+    """Sends a GET on a kept alive connection, returns the status and whether it stays open"""
+    status_code, _, keep_alive = await send(reader, writer, "GET", path)
+    return status_code, keep_alive
+
+
+async def client(port, paths, deadline, latencies, errors):
+    """Sends requests one after the other until the deadline"""
+    connection = None
+    while time.perf_counter() < deadline:
+        if connection is None:
+            connection = await asyncio.open_connection("127.0.0.1", port)
+        start = time.perf_counter()
+        try:
+            status_code, keep_alive = await get(*connection, random.choice(paths))
+        except (OSError, asyncio.IncompleteReadError, IndexError, ValueError):
+            status_code, keep_alive = None, False
+        if status_code == 200:
+            latencies.append(time.perf_counter() - start)
+        else:
+            errors.append(status_code)
+        if not keep_alive:
+            connection[1].close()
+            connection = None
+    if connection is not None:
+        connection[1].close()
+
+
+async def load(port, paths, concurrency, seconds):
+    """Runs the closed-loop clients, returns the latencies and errors"""
+    latencies, errors = [], []
+    deadline = time.perf_counter() + seconds
+    await asyncio.gather(
+        *(client(port, paths, deadline, latencies, errors) for _ in range(concurrency))
+    )
+    return latencies, errors
+
+
+def run_load(port, paths, concurrency, seconds):
+    """Warms the server up for a second, then returns the summary of a timed run"""
+    asyncio.run(load(port, paths, concurrency, 1))
+    latencies, errors = asyncio.run(load(port, paths, concurrency, seconds))
+    return summarize(latencies, errors, seconds)
+
+
+def server_cores(workers):
+    """Returns the cores for the servers, keeping the others for the load generator
+
+    The servers share every core when there are not more cores than workers.
+    """
+    if workers < os.cpu_count():
+        os.sched_setaffinity(0, set(range(workers, os.cpu_count())))
+        return set(range(workers)), True
+    return os.sched_getaffinity(0), False
+
+
+def start_server(command, port, cores, env):
+    """Starts a server pinned to the given cores and waits until it answers"""
+    # pylint: disable=consider-using-with, subprocess-popen-preexec-fn
+    server = subprocess.Popen(
+        command,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        preexec_fn=lambda: os.sched_setaffinity(0, cores),
+    )
+    for _ in range(100):
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1):
+                return server
+        except OSError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError(f"server did not start: {' '.join(command)}")
+
+
+def stop_server(server):
+    """Stops a server and waits for it to exit"""
+    server.terminate()
+    server.wait()
@@ -0,0 +1,299 @@
+"""
+Load test of a running instance
+
+Drives the service at --url with a mix of requests, e.g. 80% get by id, 15%
+list by user_id, 4% create and 1% set-default, and prints the throughput and
+the p50, p95 and p99 latency of every endpoint as JSON.
+
+The payment methods of --users benchmark users are made by the test factories
+and created through the batch endpoint before the run, then deleted after it,
+so the instance needs no other setup.
+
+In a closed loop --concurrency clients send requests one after the other, so
+the load follows the latency of the service. In an open loop requests arrive
+at each of the --rates per second, at random (Poisson) intervals, whatever the
+latency, on up to --connections connections. Their latency counts from their
+arrival, so the time a request waits for a connection is not hidden. A rate
+that the service does not keep up with is reported as saturated.
+
+Usage:
+    python -m benchmarks.load_test --url http://127.0.0.1:8080 --concurrency 32 --seconds 30
+    python -m benchmarks.load_test --mix get=80,list=15,create=4,set_default=1 --mode open --rates 100,200,400,800
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import urllib.parse
+import urllib.request
+from benchmarks.http_load import send, summarize
+from tests.factories import CreditCardFactory, PayPalFactory
+
+DEFAULT_MIX = "get=80,list=15,create=4,set_default=1"
+# an open loop rate is saturated when less than this share of the arrivals per second is served
+SATURATED_BELOW = 0.95
+SEED_BATCH = 1000
+
+
+######################################################################
+# Traffic
+######################################################################
+class Traffic:  # pylint: disable=too-few-public-methods
+    """Picks the endpoint and request of each call of a mix, over the seeded data"""
+
+    ENDPOINTS = ("get", "list", "create", "update", "set_default")
+
+    def __init__(self, mix, seeded, args):
+        self.names = list(mix)
+        self.weights = list(mix.values())
+        self.seeded = seeded  # created bodies, keyed by id
+        self.ids = list(seeded)
+        self.users = range(args.first_user, args.first_user + args.users)
+        self.bodies = [new_body(random.choice(self.users)) for _ in range(1000)]
+
+    def next(self):
+        """Returns the endpoint, method, path and body of the next request"""
+        endpoint = random.choices(self.names, self.weights)[0]
+        payment_method_id = random.choice(self.ids)
+        if endpoint == "get":
+            return endpoint, "GET", f"/api/payments/{payment_method_id}", None
+        if endpoint == "list":
+            return endpoint, "GET", f"/api/payments?user_id={random.choice(self.users)}", None
+        if endpoint == "create":
+            return endpoint, "POST", "/api/payments", random.choice(self.bodies)
+        if endpoint == "update":
+            body = {**self.seeded[payment_method_id], "name": random.choice(self.bodies)["name"]}
+            return endpoint, "PUT", f"/api/payments/{payment_method_id}", body
+        return endpoint, "PUT", f"/api/payments/{payment_method_id}/set-default", None
+
+
+def parse_mix(text):
+    """Returns the weight of each endpoint of a mix like get=80,list=20"""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in Traffic.ENDPOINTS:
+            raise ValueError(f"unknown endpoint '{name}', the endpoints are {', '.join(Traffic.ENDPOINTS)}")
+        mix[name] = float(weight)
+    if sum(mix.values()) <= 0:
+        raise ValueError("the mix has no weight")
+    return mix
+
+
+def new_body(user_id):
+    """Returns the body of a new payment method of a user, made by the factories"""
+    body = random.choice([CreditCardFactory, PayPalFactory])(user_id=user_id).serialize()
+    del body["id"]
+    return body
+
+
+######################################################################
+# Seeding through the API
+######################################################################
+def call(url, method, path, body=None):
+    """Sends one request with urllib, returns the decoded JSON response"""
+    data = None if body is None else json.dumps(body).encode()
+    request = urllib.request.Request(
+        url + path, data=data, method=method, headers={"Content-Type": "application/json"}
+    )
+    with urllib.request.urlopen(request, timeout=120) as response:
+        content = response.read()
+    return json.loads(content) if content else None
+
+
+def delete_users(url, users):
+    """Deletes the payment methods of the benchmark users"""
+    for user_id in users:
+        call(url, "DELETE", f"/api/payments?user_id={user_id}")
+
+
+def seed(url, args):
+    """Creates the payment methods of the benchmark users, returns their bodies keyed by id"""
+    users = range(args.first_user, args.first_user + args.users)
+    delete_users(url, users)
+    bodies = [new_body(user_id) for user_id in users for _ in range(args.methods)]
+    seeded = {}
+    for start in range(0, len(bodies), SEED_BATCH):
+        for result in call(url, "POST", "/api/payments:batch", bodies[start:start + SEED_BATCH]):
+            if result["status"] == 201:
+                seeded[result["data"]["id"]] = result["data"]
+    if not seeded:
+        raise RuntimeError("no payment method could be seeded")
+    return seeded
+
+
+######################################################################
+# Load
+######################################################################
+class Connections:
+    """Keeps alive up to a number of connections to the instance and sends requests on them"""
+
+    def __init__(self, url, limit):
+        parsed = urllib.parse.urlsplit(url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.free = []
+        self.slots = asyncio.Semaphore(limit)
+
+    async def send(self, method, path, body):
+        """Sends a request on a free connection, returns its status or None if it failed"""
+        async with self.slots:
+            try:
+                connection = self.free.pop() if self.free else await asyncio.open_connection(self.host, self.port)
+            except OSError:
+                return None
+            try:
+                status_code, _, keep_alive = await send(*connection, method, path, body, self.host)
+            except (OSError, asyncio.IncompleteReadError, IndexError, ValueError):
+                status_code, keep_alive = None, False
+            if keep_alive:
+                self.free.append(connection)
+            else:
+                connection[1].close()
+            return status_code
+
+    def close(self):
+        """Closes the kept alive connections"""
+        for _, writer in self.free:
+            writer.close()
+        self.free.clear()
+
+
+class Recorder:
+    """The latencies and errors of each endpoint of a run"""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, endpoint, status_code, seconds):
+        """Adds a finished request, any status above 399 is an error"""
+        if status_code is not None and status_code < 400:
+            self.latencies.setdefault(endpoint, []).append(seconds)
+        else:
+            self.errors.setdefault(endpoint, []).append(status_code)
+
+    def summary(self, seconds):
+        """Returns the throughput and latency of all requests and of each endpoint"""
+        everything = [latency for latencies in self.latencies.values() for latency in latencies]
+        errors = [error for endpoint_errors in self.errors.values() for error in endpoint_errors]
+        endpoints = sorted(self.latencies.keys() | self.errors.keys())
+        return {
+            "all": summarize(everything, errors, seconds),
+            **{
+                endpoint: summarize(self.latencies.get(endpoint, []), self.errors.get(endpoint, []), seconds)
+                for endpoint in endpoints
+            },
+        }
+
+
+async def timed(connections, recorder, traffic, start):
+    """Sends the next request of the traffic, recording its latency from start"""
+    endpoint, method, path, body = traffic.next()
+    status_code = await connections.send(method, path, body)
+    recorder.record(endpoint, status_code, time.perf_counter() - start)
+
+
+async def closed_loop(url, traffic, concurrency, seconds):
+    """Runs clients that each send their next request once the last one is answered"""
+    connections, recorder = Connections(url, concurrency), Recorder()
+    deadline = time.perf_counter() + seconds
+
+    async def client():
+        while time.perf_counter() < deadline:
+            await timed(connections, recorder, traffic, time.perf_counter())
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    connections.close()
+    return recorder
+
+
+async def open_loop(url, traffic, rate, seconds, limit):
+    """Starts requests at random intervals averaging rate per second, whatever the latency
+
+    Returns the recorder and the number of requests that arrived.
+    """
+    connections, recorder = Connections(url, limit), Recorder()
+    tasks, arrivals = set(), 0
+    arrival = time.perf_counter()
+    deadline = arrival + seconds
+    while arrival < deadline:
+        await asyncio.sleep(max(0.0, arrival - time.perf_counter()))
+        task = asyncio.create_task(timed(connections, recorder, traffic, arrival))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        arrivals += 1
+        arrival += random.expovariate(rate)
+    if tasks:
+        await asyncio.wait(tasks)
+    connections.close()
+    return recorder, arrivals
+
+
+def run(url, traffic, args):
+    """Runs the load of the mode and returns the results"""
+    if args.mode == "closed":
+        asyncio.run(closed_loop(url, traffic, args.concurrency, args.warmup))
+        recorder = asyncio.run(closed_loop(url, traffic, args.concurrency, args.seconds))
+        return recorder.summary(args.seconds)
+
+    results = []
+    for rate in args.rates:
+        asyncio.run(open_loop(url, traffic, rate, args.warmup, args.connections))
+        start = time.perf_counter()
+        recorder, arrivals = asyncio.run(open_loop(url, traffic, rate, args.seconds, args.connections))
+        # the requests still queued when the arrivals stop take longer to finish
+        summary = recorder.summary(max(args.seconds, time.perf_counter() - start))
+        arrived = arrivals / args.seconds
+        results.append(
+            {
+                "offered_per_second": rate,
+                "arrived_per_second": round(arrived, 1),
+                "saturated": summary["all"]["requests_per_second"] < SATURATED_BELOW * arrived,
+                "endpoints": summary,
+            }
+        )
+    return results
+
+
+def main():
+    """Parses the command line, seeds the data, runs the load and prints the results as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8080", help="base URL of the running instance")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"weight of each endpoint of {', '.join(Traffic.ENDPOINTS)}")
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed")
+    parser.add_argument("--concurrency", type=int, default=32, help="clients of a closed loop")
+    parser.add_argument("--rates", default="50,100,200,400", help="requests per second of each open loop step")
+    parser.add_argument("--connections", type=int, default=256, help="most connections of an open loop")
+    parser.add_argument("--seconds", type=float, default=10, help="length of the run, or of each open loop step")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds of unrecorded load before each run")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--methods", type=int, default=5, help="payment methods per user")
+    parser.add_argument("--first-user", type=int, default=900000)
+    parser.add_argument("--seed", type=int, default=2820)
+    args = parser.parse_args()
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as error:
+        parser.error(str(error))
+    args.rates = [float(rate) for rate in args.rates.split(",")]
+    url = args.url.rstrip("/")
+
+    random.seed(args.seed)
+    seeded = seed(url, args)
+    try:
+        results = run(url, Traffic(mix, seeded, args), args)
+    finally:
+        delete_users(url, range(args.first_user, args.first_user + args.users))
+
+    summary = {"benchmark": "load_test", "url": url, "mode": args.mode, "mix": mix, "seconds": args.seconds}
+    if args.mode == "closed":
+        summary.update(concurrency=args.concurrency, results=results)
+    else:
+        saturated = [step["offered_per_second"] for step in results if step["saturated"]]
+        summary.update(connections=args.connections, results=results, saturation_rate=min(saturated, default=None))
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Serializer microbenchmark
+
+Loads a list of payment methods of both types from the database, then times
+writing it to JSON the old way, serialize() then marshal() then json.dumps(),
+against the ModelSerializer the routes use now.
+
+Usage:
+    python -m benchmarks.serializer --rows 1000 --repeat 50
+"""
+import argparse
+import json
+import logging
+import random
+import statistics
+import time
+from flask_migrate import upgrade
+from flask_restx import marshal
+from wsgi import app
+from service import routes
+from service.models import db, PaymentMethod
+from tests.factories import CreditCardFactory, PayPalFactory
+
+
+def marshal_dumps(payment_methods):
+    """Writes the list the way the routes did before the ModelSerializer"""
+    data = marshal([payment_method.serialize() for payment_method in payment_methods],
+                   routes.payment_method_model, skip_none=True)
+    return (json.dumps(data) + "\n").encode()
+
+
+def serializer_dumps(payment_methods):
+    """Writes the list with the ModelSerializer of the routes"""
+    return routes.payment_method_json.dumps(payment_methods)
+
+
+def timings(encode, payment_methods, repeat):
+    """Returns the times in ms of encoding the list repeat times"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        encode(payment_methods)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def run(rows, repeat, user_id):
+    """Runs the benchmark and returns its results"""
+    q = PaymentMethod.query.filter(PaymentMethod.user_id == user_id)
+    PaymentMethod.delete_matching(q)
+    PaymentMethod.create_batch(
+        [random.choice([CreditCardFactory, PayPalFactory])(user_id=user_id) for _ in range(rows)]
+    )
+    db.session.expunge_all()
+    payment_methods = q.order_by(PaymentMethod.id).all()  # loaded like a listed page
+    if json.loads(marshal_dumps(payment_methods)) != json.loads(serializer_dumps(payment_methods)):
+        raise RuntimeError("the serializers wrote different JSON")
+
+    results = {}
+    for name, encode in (("marshal", marshal_dumps), ("serializer", serializer_dumps)):
+        times = timings(encode, payment_methods, repeat)
+        results[name] = {
+            "mean_ms": round(statistics.fmean(times), 3),
+            "min_ms": round(min(times), 3),
+            "rows_per_second": round(rows / (statistics.fmean(times) / 1000)),
+            "bytes": len(encode(payment_methods)),
+        }
+    PaymentMethod.delete_matching(q)
+    return {
+        "benchmark": "serializer",
+        "rows": rows,
+        "repeat": repeat,
+        "results": results,
+        "speedup": round(results["marshal"]["mean_ms"] / results["serializer"]["mean_ms"], 1),
+    }
+
+
+def main():
+    """Parses the command line and prints the results as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--user-id", type=int, default=900000)
+    args = parser.parse_args()
+
+    app.logger.setLevel(logging.WARNING)
+    with app.app_context():
+        upgrade()
+        results = run(args.rows, args.repeat, args.user_id)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
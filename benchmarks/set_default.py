@@ -0,0 +1,127 @@
+"""
+Set-default stress benchmark
+
+Calls PaymentMethod.set_default_for_user() from many threads at once for a few
+users, so most calls contend for the same rows, then checks that every user
+still has exactly one default payment method.
+
+Usage:
+    python -m benchmarks.set_default --threads 8 --seconds 5 --users 1 --methods 5
+"""
+import argparse
+import json
+import logging
+import random
+import statistics
+import threading
+import time
+from flask_migrate import upgrade
+from sqlalchemy import func
+from wsgi import app
+from service.models import db, PaymentMethod, DataValidationError
+from tests.factories import CreditCardFactory, PayPalFactory
+
+
+def percentile(latencies, fraction):
+    """Returns the latency in ms below which the given fraction of calls finished"""
+    if not latencies:
+        return None
+    ordered = sorted(latencies)
+    return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000, 3)
+
+
+def seed(user_ids, methods):
+    """Creates the payment methods of the benchmark users, returns their ids"""
+    PaymentMethod.delete_matching(PaymentMethod.query.filter(PaymentMethod.user_id.in_(user_ids)))
+    payment_methods = [
+        random.choice([CreditCardFactory, PayPalFactory])(user_id=user_id, is_default=False)
+        for user_id in user_ids
+        for _ in range(methods)
+    ]
+    PaymentMethod.create_batch(payment_methods)
+    return [payment_method.id for payment_method in payment_methods]
+
+
+def worker(ids, deadline, latencies, errors):
+    """Sets random payment methods as default until the deadline"""
+    with app.app_context():
+        while time.perf_counter() < deadline:
+            payment_method = PaymentMethod.find(random.choice(ids))
+            start = time.perf_counter()
+            try:
+                payment_method.set_default_for_user()
+                latencies.append(time.perf_counter() - start)
+            except DataValidationError:
+                errors.append(1)
+            db.session.remove()
+
+
+def defaults_per_user(user_ids):
+    """Returns the number of default payment methods of each benchmark user"""
+    counts = dict.fromkeys(user_ids, 0)
+    rows = (
+        db.session.query(PaymentMethod.user_id, func.count())  # pylint: disable=not-callable
+        .filter(PaymentMethod.user_id.in_(user_ids), PaymentMethod.is_default)
+        .group_by(PaymentMethod.user_id)
+    )
+    counts.update(dict(rows.all()))
+    return counts
+
+
+def run(threads, seconds, users, methods, first_user):
+    """Runs the benchmark and returns its results"""
+    user_ids = list(range(first_user, first_user + users))
+    ids = seed(user_ids, methods)
+    latencies, errors = [], []
+    deadline = time.perf_counter() + seconds
+    workers = [
+        threading.Thread(target=worker, args=(ids, deadline, latencies, errors))
+        for _ in range(threads)
+    ]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    counts = defaults_per_user(user_ids)
+    PaymentMethod.delete_matching(PaymentMethod.query.filter(PaymentMethod.user_id.in_(user_ids)))
+    return {
+        "benchmark": "set_default",
+        "dialect": db.engine.dialect.name,
+        "threads": threads,
+        "users": users,
+        "methods_per_user": methods,
+        "seconds": seconds,
+        "calls": len(latencies),
+        "errors": len(errors),
+        "calls_per_second": round(len(latencies) / seconds, 1),
+        "latency_ms": {
+            "mean": round(statistics.fmean(latencies) * 1000, 3) if latencies else None,
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+        },
+        "users_without_one_default": sum(1 for count in counts.values() if count != 1),
+    }
+
+
+def main():
+    """Parses the command line and prints the results as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--users", type=int, default=1, help="fewer users means more contention")
+    parser.add_argument("--methods", type=int, default=5, help="payment methods per user")
+    parser.add_argument("--first-user", type=int, default=900000)
+    args = parser.parse_args()
+
+    app.logger.setLevel(logging.WARNING)
+    with app.app_context():
+        upgrade()
+        results = run(args.threads, args.seconds, args.users, args.methods, args.first_user)
+    print(json.dumps(results, indent=2))
+    return 0 if results["users_without_one_default"] == 0 else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,64 @@
+"""
+Startup benchmark
+
+Starts the app --runs times in fresh Python processes, as a worker does
+without a preloaded app, once with the default start and once with
+FAST_STARTUP, and prints the median time of each phase of create_app() and of
+the whole process, from the start of the interpreter to a ready app, as JSON.
+
+Usage:
+    python -m benchmarks.startup --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# prints the startup report of the app of the worker once it is created
+READY = "import json, wsgi; print(json.dumps(wsgi.app.extensions['startup']))"
+
+
+def start(fast):
+    """Starts the app in a new process, returns its startup report and the process time"""
+    env = {**os.environ, "FAST_STARTUP": "true" if fast else "false"}
+    begin = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", READY], env=env, capture_output=True, text=True, check=True
+    )
+    process_ms = (time.perf_counter() - begin) * 1000
+    return json.loads(result.stdout.strip().splitlines()[-1]), process_ms
+
+
+def run(runs):
+    """Runs the benchmark and returns its results"""
+    results = {}
+    for name, fast in (("default", False), ("fast", True)):
+        reports, process = [], []
+        for _ in range(runs):
+            report, process_ms = start(fast)
+            reports.append(report)
+            process.append(process_ms)
+        results[name] = {
+            "process_ms": round(statistics.median(process), 1),
+            "create_app_ms": round(statistics.median(report["total_ms"] for report in reports), 1),
+            "phases_ms": {
+                phase: round(statistics.median(report["phases_ms"][phase] for report in reports), 1)
+                for phase in reports[0]["phases_ms"]
+            },
+        }
+    return {"benchmark": "startup", "runs": runs, "results": results}
+
+
+def main():
+    """Parses the command line and prints the results as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+    print(json.dumps(run(args.runs), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,370 @@
+"""
+Benchmark suite of the models and routes
+
+Times the models and routes against the database in DATABASE_URI, SQLite or a
+local PostgreSQL, and prints the results as JSON with sorted keys and no
+timestamps, so the files of two commits can be diffed or compared with
+--compare. The data is generated from a fixed --seed.
+
+Groups:
+    models    serialize() and deserialize() of both subclasses, find()
+    queries   filtered list queries on tables of each of the --sizes
+    writes    create, update, delete and set-default
+    requests  full request cycles through the Flask test client
+
+Usage:
+    python -m benchmarks.suite --sizes 1000,100000,1000000 --output head.json
+    python -m benchmarks.suite --only models,requests --repeat 3
+    python -m benchmarks.suite --compare base.json head.json --fail-above 20
+"""
+import argparse
+import collections
+import json
+import logging
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import timeit
+import factory.random
+import sqlalchemy
+from flask_migrate import upgrade
+from sqlalchemy import insert
+from wsgi import app
+from service.common.cache import get_cache
+from service.models import db, CreditCard, PayPal, PaymentMethod, PaymentMethodType
+from tests.factories import CreditCardFactory, PayPalFactory
+
+GROUPS = ("models", "queries", "writes", "requests")
+# the suite owns the payment methods of this many users from --first-user on
+USER_SPAN = 1_000_000
+METHODS_PER_USER = 10
+SEED_CHUNK = 10_000
+
+
+######################################################################
+# Timing
+######################################################################
+def measure(func, repeat, number=None):
+    """Returns the time of one call of func, the median of repeat samples
+
+    Without a number of calls per sample, it is raised until a sample takes 0.2 s.
+    """
+    timer = timeit.Timer(func)
+    if number is None:
+        number, _ = timer.autorange()
+    per_call = [seconds / number for seconds in timer.repeat(repeat, number)]
+    median = statistics.median(per_call)
+    return {
+        "calls": number * repeat,
+        "median_us": round(median * 1e6, 1),
+        "min_us": round(min(per_call) * 1e6, 1),
+        "ops_per_second": round(1 / median, 1),
+    }
+
+
+######################################################################
+# Data
+######################################################################
+class Dataset:
+    """The payment methods of the benchmark users, grown to each table size"""
+
+    def __init__(self, first_user, templates=500):
+        self.first_user = first_user
+        self.rows = 0
+        self.templates = [
+            factory(is_default=False).to_row()
+            for factory in (CreditCardFactory, PayPalFactory)
+            for _ in range(templates)
+        ]
+        self.names = [template["name"] for template in self.templates]
+
+    @property
+    def users(self):
+        """Returns the number of benchmark users that have payment methods"""
+        return max(1, self.rows // METHODS_PER_USER)
+
+    def user_query(self):
+        """Returns a query of every payment method of the benchmark users"""
+        return PaymentMethod.query.filter(
+            PaymentMethod.user_id.between(self.first_user, self.first_user + USER_SPAN - 1)
+        )
+
+    def random_user(self):
+        """Returns the id of a benchmark user with payment methods"""
+        return self.first_user + random.randrange(self.users)
+
+    def spare_user(self):
+        """Returns the id of the benchmark user that the write benchmarks use"""
+        return self.first_user + USER_SPAN - 1
+
+    def grow(self, size):
+        """Inserts rows of the templates until the benchmark users have size rows"""
+        while self.rows < size:
+            count = min(SEED_CHUNK, size - self.rows)
+            by_class = {CreditCard: [], PayPal: []}
+            for index in range(self.rows, self.rows + count):
+                row = {**self.templates[index % len(self.templates)]}
+                row["user_id"] = self.first_user + index // METHODS_PER_USER
+                subclass = CreditCard if row["type"] == PaymentMethodType.CREDIT_CARD else PayPal
+                by_class[subclass].append(row)
+            for subclass, rows in by_class.items():
+                # an empty list would be an INSERT of one row of DEFAULT VALUES
+                if rows:
+                    db.session.execute(insert(subclass), rows)
+            db.session.commit()
+            self.rows += count
+
+    def random_ids(self, count):
+        """Returns the ids of count random payment methods of the benchmark users"""
+        ids = [row.id for row in self.user_query().with_entities(PaymentMethod.id).limit(10_000)]
+        return [random.choice(ids) for _ in range(count)]
+
+    def drop(self):
+        """Deletes every payment method of the benchmark users"""
+        PaymentMethod.delete_matching(self.user_query())
+        self.rows = 0
+
+
+def fresh_session(func):
+    """Runs func with an empty session, like each request has"""
+
+    def call():
+        func()
+        db.session.expunge_all()
+
+    return call
+
+
+######################################################################
+# Benchmarks
+######################################################################
+def bench_models(dataset, args):
+    """Times serialize(), deserialize() and find()"""
+    results = {}
+    for label, factory_class, model in (
+        ("credit_card", CreditCardFactory, CreditCard),
+        ("paypal", PayPalFactory, PayPal),
+    ):
+        payment_method = factory_class()
+        body = payment_method.serialize()
+        results[f"serialize.{label}"] = measure(payment_method.serialize, args.repeat)
+        results[f"deserialize.{label}"] = measure(lambda model=model, body=body: model().deserialize(body), args.repeat)
+
+    ids = collections.deque(dataset.random_ids(1000))
+    results["find.cached"] = measure(fresh_session(lambda: PaymentMethod.find(ids[0])), args.repeat)
+
+    def find_uncached():
+        ids.rotate()
+        get_cache().clear()
+        PaymentMethod.find(ids[0])
+
+    results["find.uncached"] = measure(fresh_session(find_uncached), args.repeat)
+    return results
+
+
+def bench_queries(dataset, args):
+    """Times the filtered list queries of the routes at the current table size"""
+    limit = app.config["DEFAULT_PAGE_SIZE"]
+    ids = dataset.random_ids(1000)
+
+    def page(make_query):
+        return fresh_session(lambda: PaymentMethod.find_page(limit, None, make_query()).all())
+
+    queries = {
+        "user_id": lambda: PaymentMethod.find_by_user_id(dataset.random_user()),
+        "user_id_type": lambda: PaymentMethod.find_by_type(
+            random.choice(["CREDIT_CARD", "PAYPAL"]), PaymentMethod.find_by_user_id(dataset.random_user())
+        ),
+        "name": lambda: PaymentMethod.find_by_name(random.choice(dataset.names)),
+    }
+    results = {
+        f"list.{name}@{dataset.rows}": measure(page(make_query), args.repeat)
+        for name, make_query in queries.items()
+    }
+    results[f"list.next_page@{dataset.rows}"] = measure(
+        fresh_session(lambda: PaymentMethod.find_page(limit, random.choice(ids)).all()), args.repeat
+    )
+    return results
+
+
+def bench_writes(dataset, args):
+    """Times create, update, delete and set-default of single payment methods"""
+    user_id = dataset.spare_user()
+    created = [PayPalFactory(user_id=user_id) for _ in range(args.writes * args.repeat)]
+    results = {"create": measure(fresh_session(lambda: created.pop().create()), args.repeat, args.writes)}
+
+    payment_method = PaymentMethod.query.filter_by(user_id=user_id).first()
+
+    def update():
+        payment_method.name = random.choice(dataset.names)
+        payment_method.update()
+
+    results["update"] = measure(update, args.repeat)
+
+    # find and delete, like the route does
+    methods = [PayPalFactory(user_id=user_id) for _ in range(args.writes * args.repeat)]
+    PaymentMethod.create_batch(methods)
+    ids = [payment_method.id for payment_method in methods]
+    results["delete"] = measure(lambda: PaymentMethod.find(ids.pop()).delete(), args.repeat, args.writes)
+
+    defaults = PaymentMethod.query.filter_by(user_id=dataset.random_user()).all()
+    results["set_default"] = measure(lambda: random.choice(defaults).set_default_for_user(), args.repeat)
+    return results
+
+
+def bench_requests(dataset, args):
+    """Times full request cycles, each in its own app context, through the test client"""
+    client = app.test_client()
+    user_id = dataset.spare_user()
+    with app.app_context():
+        ids = dataset.random_ids(1000)
+        updated = PayPalFactory(user_id=user_id)
+        PaymentMethod.create_batch([updated])
+        updated = updated.id
+        defaults = [row.id for row in PaymentMethod.query.filter_by(user_id=dataset.random_user())]
+        body = PayPalFactory(user_id=user_id).serialize()
+        doomed = [PayPalFactory(user_id=user_id) for _ in range(args.writes * args.repeat)]
+        PaymentMethod.create_batch(doomed)
+        doomed = [payment_method.id for payment_method in doomed]
+
+    def request(method, path, **kwargs):
+        response = client.open(path, method=method, **kwargs)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{method} {path} returned {response.status_code}")
+
+    return {
+        "GET /api/payments/<id>": measure(
+            lambda: request("GET", f"/api/payments/{random.choice(ids)}"), args.repeat
+        ),
+        "GET /api/payments?user_id": measure(
+            lambda: request("GET", f"/api/payments?user_id={dataset.random_user()}"), args.repeat
+        ),
+        "GET /api/payments?limit=1000": measure(
+            lambda: request("GET", "/api/payments?limit=1000"), args.repeat
+        ),
+        "GET /api/payments?limit=1000&fields": measure(
+            lambda: request("GET", "/api/payments?limit=1000&fields=id,name,type,is_default"), args.repeat
+        ),
+        "POST /api/payments": measure(lambda: request("POST", "/api/payments", json=body), args.repeat),
+        "PUT /api/payments/<id>": measure(
+            lambda: request("PUT", f"/api/payments/{updated}", json=body), args.repeat
+        ),
+        "PUT /api/payments/<id>/set-default": measure(
+            lambda: request("PUT", f"/api/payments/{random.choice(defaults)}/set-default"), args.repeat
+        ),
+        "DELETE /api/payments/<id>": measure(
+            lambda: request("DELETE", f"/api/payments/{doomed.pop()}"), args.repeat, args.writes
+        ),
+    }
+
+
+######################################################################
+# Suite
+######################################################################
+def git_commit():
+    """Returns the commit of the working tree, or None outside of git"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    """Runs the groups of the suite and returns their results"""
+    random.seed(args.seed)
+    factory.random.reseed_random(args.seed)
+    results = {}
+    with app.app_context():
+        upgrade()
+        dataset = Dataset(args.first_user)
+        dataset.drop()
+        try:
+            for position, size in enumerate(sorted(args.sizes)):
+                dataset.grow(size)
+                if "queries" in args.only:
+                    results.update(bench_queries(dataset, args))
+                if position == 0:
+                    if "models" in args.only:
+                        results.update(bench_models(dataset, args))
+                    if "writes" in args.only:
+                        results.update(bench_writes(dataset, args))
+                    if "requests" in args.only:
+                        results.update(bench_requests(dataset, args))
+        finally:
+            db.session.rollback()
+            dataset.drop()
+        dialect = db.engine.dialect.name
+    return {
+        "suite": "payments",
+        "environment": {
+            "commit": git_commit(),
+            "dialect": dialect,
+            "cache": app.config["CACHE_BACKEND"],
+            "python": platform.python_version(),
+            "sqlalchemy": sqlalchemy.__version__,
+        },
+        "settings": {"repeat": args.repeat, "seed": args.seed, "sizes": sorted(args.sizes), "writes": args.writes},
+        "results": results,
+    }
+
+
+def compare(base_file, head_file, fail_above=None):
+    """Prints the change of the median time of every benchmark, returns the exit status"""
+    with open(base_file, encoding="utf-8") as file:
+        base = json.load(file)["results"]
+    with open(head_file, encoding="utf-8") as file:
+        head = json.load(file)["results"]
+    regressions = []
+    print(f"{'benchmark':48} {'base us':>12} {'head us':>12} {'change':>8}")
+    for name in sorted(base.keys() & head.keys()):
+        before, after = base[name]["median_us"], head[name]["median_us"]
+        change = (after - before) / before * 100 if before else 0.0
+        print(f"{name:48} {before:12.1f} {after:12.1f} {change:+7.1f}%")
+        if fail_above is not None and change > fail_above:
+            regressions.append(name)
+    for name in sorted(base.keys() ^ head.keys()):
+        print(f"{name:48} only in {'base' if name in base else 'head'}")
+    if regressions:
+        print(f"{len(regressions)} benchmarks are more than {fail_above}% slower", file=sys.stderr)
+        return 1
+    return 0
+
+
+def main():
+    """Parses the command line and prints the results as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="1000,100000", help="comma separated table sizes, e.g. 1000,100000,1000000")
+    parser.add_argument("--only", default=",".join(GROUPS), help=f"comma separated groups of {', '.join(GROUPS)}")
+    parser.add_argument("--repeat", type=int, default=5, help="samples of each benchmark")
+    parser.add_argument("--writes", type=int, default=100, help="creates and deletes per sample")
+    parser.add_argument("--seed", type=int, default=2820)
+    parser.add_argument("--first-user", type=int, default=900000)
+    parser.add_argument("--output", help="file to write the results to instead of stdout")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "HEAD"), help="compare two result files")
+    parser.add_argument("--fail-above", type=float, help="with --compare, fail on a slowdown above this percent")
+    args = parser.parse_args()
+    if args.compare:
+        return compare(*args.compare, args.fail_above)
+
+    args.sizes = [int(size) for size in args.sizes.split(",")]
+    args.only = set(args.only.split(","))
+    if not args.only <= set(GROUPS):
+        parser.error(f"unknown groups: {', '.join(sorted(args.only - set(GROUPS)))}")
+    app.logger.setLevel(logging.WARNING)
+    # seeding the large tables is slow on purpose
+    logging.getLogger("service.slow_queries").setLevel(logging.ERROR)
+    output = json.dumps(run(args), indent=2, sort_keys=True) + "\n"
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output)
+    else:
+        sys.stdout.write(output)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,90 @@
+"""
+Validation microbenchmark
+
+Times checking a batch of payment method bodies field by field, through the
+@validates hooks that deserialize() sets off on a new model, against checking
+them in one pass per body with body_errors(). Half of the invalid bodies are
+credit cards with three bad fields, half PayPal accounts with a bad email.
+
+Usage:
+    python -m benchmarks.validation --bodies 1000 --repeat 20
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+from service.models import CreditCard, PayPal, DataValidationError, body_errors
+from tests.factories import CreditCardFactory, PayPalFactory
+
+
+def make_bodies(count, invalid):
+    """Returns count bodies of both types, invalid ones with bad fields"""
+    bodies = []
+    for _ in range(count):
+        body = random.choice([CreditCardFactory, PayPalFactory])().serialize()
+        if invalid and body["type"] == "PAYPAL":
+            body["email"] = "not an email"
+        elif invalid:
+            body.update(first_name="R2D2", card_number="1234", expiry_month=13)
+        bodies.append(body)
+    return bodies
+
+
+def per_attribute(bodies):
+    """Validates each body by deserializing it, stops at the first error of a body"""
+    errors = 0
+    for body in bodies:
+        try:
+            (CreditCard() if body["type"] == "CREDIT_CARD" else PayPal()).deserialize(body)
+        except DataValidationError:
+            errors += 1
+    return errors
+
+
+def whole_body(bodies):
+    """Validates each body in one pass, collects every error of a body"""
+    return sum(len(body_errors(body)) for body in bodies)
+
+
+def timings(validate, bodies, repeat):
+    """Returns the times in ms of validating the bodies repeat times, and the errors found"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        errors = validate(bodies)
+        times.append((time.perf_counter() - start) * 1000)
+    return times, errors
+
+
+def run(count, repeat):
+    """Runs the benchmark and returns its results"""
+    results = {}
+    for kind, invalid in (("valid", False), ("invalid", True)):
+        bodies = make_bodies(count, invalid)
+        results[kind] = {}
+        for name, validate in (("per_attribute", per_attribute), ("whole_body", whole_body)):
+            times, errors = timings(validate, bodies, repeat)
+            results[kind][name] = {
+                "mean_ms": round(statistics.fmean(times), 3),
+                "min_ms": round(min(times), 3),
+                "bodies_per_second": round(count / (statistics.fmean(times) / 1000)),
+                "errors_reported": errors,
+            }
+        results[kind]["speedup"] = round(
+            results[kind]["per_attribute"]["mean_ms"] / results[kind]["whole_body"]["mean_ms"], 1
+        )
+    return {"benchmark": "validation", "bodies": count, "repeat": repeat, "results": results}
+
+
+def main():
+    """Parses the command line and prints the results as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--bodies", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    print(json.dumps(run(args.bodies, args.repeat), indent=2))
+
+
+if __name__ == "__main__":
+    main()
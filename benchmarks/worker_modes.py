@@ -0,0 +1,80 @@
+"""
+Gunicorn worker mode benchmark
+
+Starts the service with gunicorn.conf.py once per worker class (sync, gthread
+and gevent) on the same CPU cores and sends each the same closed loop of
+requests, first to the get endpoint, then to the list endpoint. Reports
+requests per second and latency percentiles for every worker class and
+endpoint.
+
+Usage:
+    python -m benchmarks.worker_modes --cores 2 --concurrency 64 --seconds 10
+"""
+import argparse
+import importlib.util
+import os
+import sys
+from wsgi import app
+from benchmarks.http_load import (
+    add_load_arguments,
+    report,
+    run_load,
+    seeded_endpoints,
+    server_cores,
+    start_server,
+    stop_server,
+)
+
+COMMAND = ["gunicorn", "--config", "gunicorn.conf.py", "wsgi:app"]
+
+
+def worker_classes(requested):
+    """Returns the requested worker classes whose packages are installed"""
+    return [
+        kind for kind in requested
+        if kind != "gevent" or importlib.util.find_spec("gevent") is not None
+    ]
+
+
+def run(args, endpoints, cores):
+    """Benchmarks every worker class on every endpoint and returns the results"""
+    results = []
+    for kind in worker_classes(args.worker_classes):
+        env = {
+            **os.environ,
+            "CACHE_BACKEND": args.cache,
+            "GUNICORN_WORKER_CLASS": kind,
+            "GUNICORN_BIND": f"127.0.0.1:{args.port}",
+            "GUNICORN_LOG_LEVEL": "warning",
+        }
+        if args.workers:
+            env["GUNICORN_WORKERS"] = str(args.workers)
+        server = start_server(COMMAND, args.port, cores, env)
+        try:
+            for endpoint, paths in endpoints.items():
+                summary = run_load(args.port, paths, args.concurrency, args.seconds)
+                results.append({"worker_class": kind, "endpoint": endpoint, **summary})
+        finally:
+            stop_server(server)
+    return results
+
+
+def main():
+    """Parses the command line and prints the results as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cores", type=int, default=2, help="CPU cores of the server")
+    parser.add_argument("--workers", type=int, help="worker processes, derived from the cores when not set")
+    parser.add_argument("--worker-classes", nargs="+", default=["sync", "gthread", "gevent"])
+    add_load_arguments(parser)
+    args = parser.parse_args()
+
+    with seeded_endpoints(app, args) as endpoints:
+        # pin the server to its own cores, away from the load generator, when there are enough
+        cores, pinned = server_cores(args.cores)
+        results = run(args, endpoints, cores)
+    report("worker_modes", args, results, cores=len(cores), pinned=pinned)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
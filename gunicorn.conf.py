@@ -0,0 +1,127 @@
+"""
+Gunicorn configuration
+
+Loaded by gunicorn from the working directory, or with --config gunicorn.conf.py.
+Every setting can be changed from the environment:
+
+    GUNICORN_WORKER_CLASS  sync (default), gthread or gevent
+    GUNICORN_WORKERS       worker processes, derived from the CPUs when not set
+    GUNICORN_THREADS       threads of each gthread worker (default 4)
+    GUNICORN_CONNECTIONS   concurrent requests of each gevent worker (default 100)
+    GUNICORN_MAX_REQUESTS  requests served before a worker is replaced (default 1000, 0: never)
+    GUNICORN_MAX_REQUESTS_JITTER  random extra requests, so workers are not all replaced at once
+    GUNICORN_PRELOAD       load the app once in the master and fork it (default true)
+    GUNICORN_BIND          address to listen on (default 0.0.0.0:$PORT)
+    PROMETHEUS_MULTIPROC_DIR  where the workers share their metrics (default payments-metrics
+                           in /dev/shm or the temporary directory), emptied when gunicorn starts
+"""
+# gunicorn reads its settings from lowercase module globals
+# pylint: disable=invalid-name
+import glob
+import math
+import os
+import tempfile
+
+WORKER_CLASSES = ("sync", "gthread", "gevent")
+
+
+def env_flag(name, default):
+    """Returns an environment variable as a boolean"""
+    return os.getenv(name, default).lower() in ("true", "1", "yes")
+
+
+def cgroup_cpu_limit(root="/sys/fs/cgroup"):
+    """Returns the CPU quota of the container in CPUs, or None when it has none"""
+    try:  # cgroup v2
+        with open(os.path.join(root, "cpu.max"), encoding="utf-8") as cpu_max:
+            quota, period = cpu_max.read().split()
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:  # cgroup v1
+        with open(os.path.join(root, "cpu", "cpu.cfs_quota_us"), encoding="utf-8") as quota_file:
+            quota = int(quota_file.read())
+        with open(os.path.join(root, "cpu", "cpu.cfs_period_us"), encoding="utf-8") as period_file:
+            period = int(period_file.read())
+        return None if quota <= 0 else quota / period
+    except (OSError, ValueError):
+        return None
+
+
+def available_cpus(root="/sys/fs/cgroup"):
+    """Returns the whole CPUs this process may use, from its affinity and cgroup quota"""
+    cpus = len(os.sched_getaffinity(0))
+    limit = cgroup_cpu_limit(root)
+    if limit is not None:
+        cpus = min(cpus, math.ceil(limit))
+    return max(cpus, 1)
+
+
+def default_workers(kind, cpus):
+    """Returns the number of workers that keeps the CPUs busy for a worker class
+
+    Sync workers block on the database, so there are more of them than CPUs.
+    Threaded and gevent workers overlap their waits inside one process, so one
+    per CPU, plus a spare for gthread whose threads still share the GIL.
+    """
+    if kind == "sync":
+        return 2 * cpus + 1
+    if kind == "gthread":
+        return cpus + 1
+    return cpus
+
+
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "sync")
+if worker_class not in WORKER_CLASSES:
+    raise RuntimeError(f"GUNICORN_WORKER_CLASS must be one of {', '.join(WORKER_CLASSES)}")
+if worker_class == "gevent":
+    # patch before the app, and psycopg with it, is preloaded so the database waits yield
+    from gevent import monkey  # pylint: disable=wrong-import-position
+
+    monkey.patch_all()
+
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '8000')}")
+workers = int(
+    os.getenv("GUNICORN_WORKERS")
+    or os.getenv("WEB_CONCURRENCY")
+    or default_workers(worker_class, available_cpus())
+)
+threads = int(os.getenv("GUNICORN_THREADS", "4")) if worker_class == "gthread" else 1
+worker_connections = int(os.getenv("GUNICORN_CONNECTIONS", "100"))
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", str(max_requests // 10)))
+preload_app = env_flag("GUNICORN_PRELOAD", "true")
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+# heartbeat files on tmpfs, a disk backed /tmp can stall workers in containers
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+# set before the app imports prometheus_client, so every worker shares its metrics
+metrics_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(worker_tmp_dir or tempfile.gettempdir(), "payments-metrics")
+)
+os.makedirs(metrics_dir, exist_ok=True)
+
+
+def on_starting(_server):
+    """Drops the metrics of an earlier run"""
+    for path in glob.glob(os.path.join(metrics_dir, "*.db")):
+        os.remove(path)
+
+
+def post_fork(_server, worker):
+    """Drops the database connections inherited from the master"""
+    app = worker.app.callable  # the Flask app when it was preloaded, None otherwise
+    if app is not None:
+        # pylint: disable=import-outside-toplevel
+        from service.common.pool import reset_pools
+
+        reset_pools(app)
+
+
+def child_exit(_server, worker):
+    """Stops counting the gauges of a worker that exited"""
+    from prometheus_client import multiprocess  # pylint: disable=import-outside-toplevel
+
+    multiprocess.mark_process_dead(worker.pid)
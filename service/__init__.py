@@ -18,14 +18,30 @@ Package for the application models and service routes
 This module creates and configures the Flask app and sets up the logging
 and SQL database
 """
-import sys
-from flask import Flask
-from flask_restx import Api
-from service import config
-from service.common import log_handlers
+import time
+
+IMPORTS_STARTED = time.perf_counter()
+
+# pylint: disable=wrong-import-position
+import os  # noqa: E402
+from flask import Flask  # noqa: E402
+from flask_restx import Api  # noqa: E402
+from service import config  # noqa: E402
+from service.common import log_handlers  # noqa: E402
+from service.common.cache import init_cache  # noqa: E402
+from service.common.compression import init_compression  # noqa: E402
+from service.common.metrics import init_metrics  # noqa: E402
+from service.common.pool import engine_options, register_engine  # noqa: E402
+from service.common.query_log import init_query_log  # noqa: E402
+from service.common.startup import StartupTimer, running_cli  # noqa: E402
 
 # Will be initialize when app is created
 api = None  # pylint: disable=invalid-name
+# Only the first app created pays for the imports
+imports_started = IMPORTS_STARTED  # pylint: disable=invalid-name
+
+# Versioned schema migrations live inside the package so they ship with it
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "migrations")
 
 
 ############################################################
@@ -33,16 +49,40 @@ api = None  # pylint: disable=invalid-name
 ############################################################
 def create_app():
     """Initialize the core application."""
+    global api, imports_started
+    timer = StartupTimer(imports_started)
+    imports_started = None
+    timer.mark("imports")
+
     # Create Flask application
     app = Flask(__name__)
     app.config.from_object(config)
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", engine_options(app.config))
+    timer.mark("app")
 
     # Initialize Plugins
     # pylint: disable=import-outside-toplevel
     from service.models import db
 
     db.init_app(app)
-    global api
+    with app.app_context():
+        register_engine(app, "sync", db.engine)
+    # The schema is managed by migrations (flask db upgrade), not at boot.
+    # A fast start leaves out the migration commands, and Alembic with them,
+    # unless the app is loaded by the flask command. Nothing else is skipped.
+    with_cli = not app.config["FAST_STARTUP"] or running_cli()
+    if with_cli:
+        from flask_migrate import Migrate
+
+        Migrate(app, db, directory=MIGRATIONS_DIR)
+    timer.mark("db")
+
+    init_cache(app)
+    init_metrics(app)
+    init_query_log(app)
+    init_compression(app)
+    timer.mark("app")
+
     api = Api(
         app,
         version="1.0.0",
@@ -59,14 +99,11 @@ def create_app():
         # Dependencies require we import the routes AFTER the Flask app is created
         # pylint: disable=wrong-import-position, wrong-import-order, unused-import
         from service import routes, models  # noqa: F401 E402
-        from service.common import error_handlers, cli_commands  # noqa: F401, E402
+        from service.common import error_handlers  # noqa: F401, E402
 
-        try:
-            db.create_all()
-        except Exception as error:  # pylint: disable=broad-except
-            app.logger.critical("%s: Cannot continue", error)
-            # gunicorn requires exit code 4 to stop spawning workers when they die
-            sys.exit(4)
+        if with_cli:
+            from service.common import cli_commands  # noqa: F401, E402
+        timer.mark("routes")
 
         # Set up logging for production
         log_handlers.init_logging(app, "gunicorn.error")
@@ -74,6 +111,9 @@ def create_app():
         app.logger.info(70 * "*")
         app.logger.info("  S E R V I C E   R U N N I N G  ".center(70, "*"))
         app.logger.info(70 * "*")
+        timer.mark("logging")
+        app.extensions["startup"] = timer.report()
+        app.logger.info(timer.summary())
         app.logger.info("Service initialized!")
 
         return app
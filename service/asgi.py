@@ -0,0 +1,343 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Payments ASGI Service
+
+Serves the Payments REST API from an ASGI server such as uvicorn. The busiest
+endpoints, reading, listing, creating and deleting PaymentMethods, run natively
+on an asyncio SQLAlchemy engine, so a worker keeps serving other requests while
+it waits on the database. They reuse the models, the request parsers and the
+helpers of service/routes.py. Every other request is passed to the Flask app.
+"""
+import contextlib
+import functools
+import importlib
+from types import SimpleNamespace
+from a2wsgi import WSGIMiddleware
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.middleware import Middleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.datastructures import MIMEAccept, MultiDict
+from werkzeug.exceptions import BadRequest, HTTPException, NotFound, UnsupportedMediaType
+from werkzeug.http import parse_accept_header, parse_etags, quote_etag
+from service.common import metrics, query_log, status
+from service.common.compression import weak_etag
+from service.models import PaymentMethod, DataValidationError, ValidationErrors, validate
+from service.common.pool import engine_options, register_engine
+from service.models.payment_method import cache_key
+
+# The Flask app and its routes module, set by create_asgi_app()
+flask_app = None  # pylint: disable=invalid-name
+routes = None  # pylint: disable=invalid-name
+
+
+######################################################################
+# GET A PAYMENT METHOD
+######################################################################
+async def get_payment(request):
+    """Retrieve a single PaymentMethod"""
+    payment_method_id = request.path_params["payment_method_id"]
+    flask_app.logger.info("Request for payment with id: %s", payment_method_id)
+
+    async with request.app.state.sessions() as session:
+        payment_method = await find(session, payment_method_id)
+    if not payment_method:
+        raise NotFound(f"PaymentMethod with id '{payment_method_id}' was not found.")
+
+    etag = routes.payment_method_etag(payment_method)
+    headers = {"ETag": quote_etag(etag)}
+    if parse_etags(request.headers.get("If-None-Match")).contains_weak(etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return json_response(payment_method, status.HTTP_200_OK, headers)
+
+
+######################################################################
+# DELETE A PAYMENT METHOD
+######################################################################
+async def delete_payment(request):
+    """Delete a PaymentMethod, its credit_card or pay_pal row goes with it"""
+    payment_method_id = request.path_params["payment_method_id"]
+    flask_app.logger.info("Request to delete payment with id: %s", payment_method_id)
+
+    try:
+        key = cache_key(payment_method_id)
+    except ValueError:
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+    statement = delete(PaymentMethod).where(PaymentMethod.id == int(payment_method_id))
+    async with request.app.state.sessions() as session:
+        await session.execute(statement, execution_options={"synchronize_session": False})
+        await session.commit()
+    flask_app.extensions["cache"].delete(key)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+######################################################################
+# LIST PAYMENT METHODS
+######################################################################
+async def list_payments(request):
+    """Returns a page of PaymentMethods, or streams all of them as NDJSON"""
+    flask_app.logger.info("Request for payment method list")
+    q, after_id, limit, streamed, fields = parse_list_args(request)
+    q, serializer = routes.select_fields(q, fields)
+
+    if streamed:
+        statement = PaymentMethod.find_page(limit, after_id, q).execution_options(
+            yield_per=flask_app.config["STREAM_BATCH_SIZE"]
+        )
+        flask_app.logger.info("Streaming payment methods")
+        return StreamingResponse(
+            ndjson_lines(request.app.state.sessions, statement, serializer), media_type=routes.NDJSON
+        )
+
+    # Fetch one extra row to learn whether there is a next page
+    async with request.app.state.sessions() as session:
+        statement = PaymentMethod.find_page(limit + 1, after_id, q)
+        rows = payment_methods(await session.execute(statement), statement).all()
+
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = routes.encode_cursor(rows[-1].id)
+        next_url = request.url.include_query_params(limit=limit, cursor=next_cursor)
+        headers = {"Link": f'<{next_url}>; rel="next"', "X-Next-Cursor": next_cursor}
+
+    etag = routes.list_etag(rows, headers.get("X-Next-Cursor"), fields)
+    headers["ETag"] = quote_etag(etag)
+    if parse_etags(request.headers.get("If-None-Match")).contains_weak(etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    flask_app.logger.info("Returning %d payment methods", len(rows))
+    return json_response(rows, status.HTTP_200_OK, headers, serializer)
+
+
+######################################################################
+# CREATE A PAYMENT METHOD
+######################################################################
+async def create_payment(request):
+    """Creates a PaymentMethod from the posted JSON"""
+    flask_app.logger.info("Request to create a PaymentMethod")
+    if request.headers.get("Content-Type") != "application/json":
+        raise UnsupportedMediaType("Content-Type must be application/json")
+    try:
+        body = await request.json()
+    except ValueError as error:
+        raise BadRequest("Failed to decode JSON object") from error
+
+    payment_method = routes.new_payment_method(validate(body))
+    payment_method.deserialize(body)
+
+    async with request.app.state.sessions() as session:
+        session.add(payment_method)
+        try:
+            await session.commit()
+        except Exception as error:
+            await session.rollback()
+            flask_app.logger.error("Error creating PaymentMethod record: %s", payment_method)
+            raise DataValidationError(error) from error
+
+    location_url = request.url_for("get_payment", payment_method_id=payment_method.id)
+    headers = {"Location": str(location_url)}
+    return json_response(payment_method, status.HTTP_201_CREATED, headers)
+
+
+######################################################################
+#  U T I L I T Y   F U N C T I O N S
+######################################################################
+async def find(session, payment_method_id):
+    """Finds a PaymentMethod by its ID, reading through the cache of the Flask app"""
+    try:
+        key = cache_key(payment_method_id)
+    except ValueError:
+        return None
+    cache = flask_app.extensions["cache"]
+    cached = cache.get(key)
+    if cached is not None:
+        return PaymentMethod.detached_from_cache(cached)
+    payment_method = await session.get(PaymentMethod, int(payment_method_id))
+    if payment_method is not None:
+        cache.set(key, payment_method.to_cache())
+    return payment_method
+
+
+def parse_list_args(request):
+    """Parses the query string of a list request like the Flask route does
+
+    Returns the filtered query, the id of the last row seen, the page limit,
+    whether the list is streamed as NDJSON and the fields to return.
+    """
+    with flask_app.app_context():
+        query_args = SimpleNamespace(args=MultiDict(request.query_params.multi_items()))
+        args = routes.payment_args.parse_args(req=query_args)
+        q = routes.filter_payment_methods(args, select(PaymentMethod))
+        after_id = routes.decode_cursor(args["cursor"]) if args["cursor"] else None
+        accept = parse_accept_header(request.headers.get("Accept"), MIMEAccept)
+        streamed = accept.best_match(["application/json", routes.NDJSON]) == routes.NDJSON
+        limit = routes.get_page_limit(args["limit"], streamed)
+        fields = routes.parse_fields(args["fields"])
+    return q, after_id, limit, streamed, fields
+
+
+def payment_methods(result, statement):
+    """Returns the PaymentMethods of a result, or its rows when the statement selects some columns"""
+    return result.scalars() if len(statement.column_descriptions) == 1 else result
+
+
+def json_response(data, status_code, headers, serializer=None):
+    """Returns PaymentMethods in the same format as the Flask routes"""
+    serializer = serializer or routes.payment_method_json
+    return Response(serializer.dumps(data), status_code, headers, "application/json")
+
+
+async def ndjson_lines(sessions, statement, serializer):
+    """Yields each PaymentMethod as one line of newline delimited JSON"""
+    async with sessions() as session:
+        async for payment_method in payment_methods(await session.stream(statement), statement):
+            yield serializer.dumps(payment_method)
+
+
+async def http_error(_request, error):
+    """Returns the same body as flask-restx for an HTTP error"""
+    data = getattr(error, "data", None) or {"message": error.description}
+    return JSONResponse(data, error.code)
+
+
+async def bad_request(_request, error):
+    """Handles Value Errors from bad data"""
+    message = str(error)
+    flask_app.logger.warning(message)
+    data = {"status": status.HTTP_400_BAD_REQUEST, "error": "Bad Request", "message": message}
+    if isinstance(error, ValidationErrors):
+        data["errors"] = error.errors
+    return JSONResponse(data, status.HTTP_400_BAD_REQUEST)
+
+
+def instrumented(resource, handler):
+    """Records the metrics and statements of the requests served by a handler"""
+
+    @functools.wraps(handler)
+    async def endpoint(request):
+        start = metrics.request_started()
+        stats, token = query_log.track_queries()
+        status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+        try:
+            response = await handler(request)
+            status_code = response.status_code
+            if flask_app.debug:
+                response.headers["Server-Timing"] = stats.server_timing()
+            return response
+        except HTTPException as error:
+            status_code = error.code
+            raise
+        except DataValidationError:
+            status_code = status.HTTP_400_BAD_REQUEST
+            raise
+        finally:
+            query_log.current_queries.reset(token)
+            metrics.request_finished(start, resource, request.method, status_code)
+
+    return endpoint
+
+
+class WeakETagMiddleware:  # pylint: disable=too-few-public-methods
+    """Makes the ETag of a response weak when the client accepts gzip, as the Flask app does
+
+    GZipMiddleware only compresses the larger bodies, but the ETag depends on
+    Accept-Encoding alone, so a 304 carries the ETag and Vary of its 200.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or "gzip" not in Headers(scope=scope).get("accept-encoding", ""):
+            await self.app(scope, receive, send)
+            return
+
+        async def send_weak_etag(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                if "etag" in headers:
+                    headers["etag"] = weak_etag(headers["etag"])
+                    if "accept-encoding" not in headers.get("vary", "").lower():
+                        headers.add_vary_header("Accept-Encoding")
+            await send(message)
+
+        await self.app(scope, receive, send_weak_etag)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """Opens the async database engine for as long as the server runs"""
+    engine = create_async_engine(
+        flask_app.config["SQLALCHEMY_DATABASE_URI"], **engine_options(flask_app.config, asyncio=True)
+    )
+    register_engine(flask_app, "async", engine.sync_engine)
+    app.state.sessions = async_sessionmaker(engine, expire_on_commit=False)
+    yield
+    flask_app.extensions["engines"].pop("async", None)
+    await engine.dispose()
+
+
+######################################################################
+#  A P P L I C A T I O N   F A C T O R Y
+######################################################################
+def create_asgi_app(app):
+    """Returns an ASGI application serving the Payments API of a Flask app"""
+    global flask_app, routes  # pylint: disable=global-statement
+    flask_app = app
+    with app.app_context():
+        # the routes can only be imported once the Flask app exists
+        routes = importlib.import_module("service.routes")
+
+    # The native routes are gzipped like the Flask responses, which come compressed already
+    middleware = []
+    if "gzip" in app.extensions["compression"]["encodings"]:
+        middleware.append(Middleware(WeakETagMiddleware))
+        middleware.append(
+            Middleware(
+                GZipMiddleware,
+                minimum_size=app.config["COMPRESSION_MIN_SIZE"],
+                compresslevel=app.config["COMPRESSION_LEVEL"],
+            )
+        )
+
+    payment_url = "/api/payments/{payment_method_id}"
+    flask = WSGIMiddleware(app)
+    return Starlette(
+        routes=[
+            # not a payment method id
+            Route("/api/payments/stats", flask),
+            # named like the flask-restx Resources that serve them under WSGI
+            Route("/api/payments", instrumented("PaymentCollection", list_payments), methods=["GET"]),
+            Route("/api/payments", instrumented("PaymentCollection", create_payment), methods=["POST"]),
+            Route(payment_url, instrumented("PaymentResource", get_payment), methods=["GET"]),
+            Route(payment_url, instrumented("PaymentResource", delete_payment), methods=["DELETE"]),
+            # Everything else is served by the Flask app
+            Mount("/", flask),
+        ],
+        exception_handlers={
+            HTTPException: http_error,
+            DataValidationError: bad_request,
+        },
+        middleware=middleware,
+        lifespan=lifespan,
+    )
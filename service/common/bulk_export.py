@@ -0,0 +1,213 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Bulk Export
+
+This module writes the PaymentMethods matching optional user_id and type
+filters to NDJSON, CSV or Parquet files, one flat row per PaymentMethod with
+the columns of every type, from PaymentMethod.flat_select(). The rows are read
+in id order through a server-side cursor, batch_size at a time, so the memory
+used does not grow with the table. Parquet needs the pyarrow package, installed
+with the parquet extra.
+
+With shard_rows the rows are split into ranges of id holding at most that many
+rows each, found by walking the primary key, and each range is written to a
+file of its own by a pool of threads, each on a connection of its own.
+"""
+import csv
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import orjson
+from sqlalchemy import func, select
+from service.models import PaymentMethod, PaymentMethodType
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover
+    pyarrow = None  # pylint: disable=invalid-name
+
+FORMATS = ("ndjson", "csv", "parquet")
+EXTENSIONS = {".ndjson": "ndjson", ".jsonl": "ndjson", ".csv": "csv", ".parquet": "parquet"}
+
+
+def file_format(path):
+    """Returns the format of a file named by its extension"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in EXTENSIONS:
+        raise ValueError(f"Cannot tell the format of '{path}', name it with --format")
+    return EXTENSIONS[extension]
+
+
+######################################################################
+# Writers
+######################################################################
+class NdjsonWriter:
+    """Writes rows as one JSON object per line"""
+
+    def __init__(self, path, columns):
+        self.names = [column.key for column in columns]
+        self.file = open(path, "wb")  # pylint: disable=consider-using-with
+
+    def write(self, rows):
+        """Writes a batch of rows"""
+        option = orjson.OPT_APPEND_NEWLINE
+        self.file.write(b"".join(orjson.dumps(dict(zip(self.names, row)), option=option) for row in rows))
+
+    def close(self):
+        """Closes the file"""
+        self.file.close()
+
+
+class CsvWriter:
+    """Writes rows as CSV with a header row, NULL as an empty field"""
+
+    def __init__(self, path, columns):
+        self.file = open(path, "w", newline="", encoding="utf-8")  # pylint: disable=consider-using-with
+        self.csv = csv.writer(self.file)
+        self.csv.writerow([column.key for column in columns])
+
+    def write(self, rows):
+        """Writes a batch of rows"""
+        self.csv.writerows(rows)
+
+    def close(self):
+        """Closes the file"""
+        self.file.close()
+
+
+class ParquetWriter:
+    """Writes rows as Parquet, one row group per batch"""
+
+    def __init__(self, path, columns):
+        arrow_types = {int: pyarrow.int64(), str: pyarrow.string(), bool: pyarrow.bool_()}
+        self.schema = pyarrow.schema(
+            [(column.key, arrow_types[column.type.python_type]) for column in columns]
+        )
+        self.parquet = pyarrow.parquet.ParquetWriter(path, self.schema, compression="zstd")
+
+    def write(self, rows):
+        """Writes a batch of rows"""
+        arrays = [
+            pyarrow.array(values, type=field.type) for values, field in zip(zip(*rows), self.schema)
+        ]
+        self.parquet.write_batch(pyarrow.record_batch(arrays, schema=self.schema))
+
+    def close(self):
+        """Closes the file"""
+        self.parquet.close()
+
+
+WRITERS = {"ndjson": NdjsonWriter, "csv": CsvWriter, "parquet": ParquetWriter}
+
+
+######################################################################
+# Export
+######################################################################
+def criteria(user_id=None, payment_type=None):
+    """Returns the conditions of the PaymentMethods of a user and of a type"""
+    conditions = []
+    if user_id is not None:
+        conditions.append(PaymentMethod.user_id == user_id)
+    if payment_type:
+        conditions.append(PaymentMethod.type == PaymentMethodType(payment_type))
+    return conditions
+
+
+def shard_ranges(connection, conditions, shard_rows):
+    """Returns the (first id, next id) ranges holding at most shard_rows matching rows each
+
+    The next id of the last range is None. Each first id is found by skipping
+    shard_rows entries of the primary key from the one before.
+    """
+    first_id = connection.scalar(select(func.min(PaymentMethod.id)).where(*conditions))
+    firsts = []
+    while first_id is not None:
+        firsts.append(first_id)
+        first_id = connection.scalar(
+            select(PaymentMethod.id)
+            .where(*conditions, PaymentMethod.id >= first_id)
+            .order_by(PaymentMethod.id)
+            .offset(shard_rows)
+            .limit(1)
+        )
+    return list(zip(firsts, firsts[1:] + [None]))
+
+
+def shard_path(path, number):
+    """Returns the path of a shard file, numbered before the extension"""
+    base, extension = os.path.splitext(path)
+    return f"{base}-{number:05d}{extension}"
+
+
+def write_range(engine, statement, path, format_name, batch_size):
+    """Writes the rows of a statement to a file, streaming them through a server-side cursor"""
+    writer = WRITERS[format_name](path, statement.selected_columns)
+    rows = 0
+    try:
+        with engine.connect() as connection:
+            result = connection.execution_options(stream_results=True, yield_per=batch_size).execute(statement)
+            for batch in result.partitions():
+                writer.write(batch)
+                rows += len(batch)
+    finally:
+        writer.close()
+    return {"path": path, "rows": rows, "bytes": os.path.getsize(path)}
+
+
+def export(engine, path, format_name=None, conditions=(), shard_rows=None, workers=4, batch_size=10000,
+           progress=None):  # pylint: disable=too-many-arguments
+    """Exports the PaymentMethods matching conditions, returns the files written and the rate
+
+    Without shard_rows every row goes to path. Otherwise the shards are named
+    after path and written by workers threads, and progress is called with the
+    report of each shard as it is done.
+    """
+    format_name = format_name or file_format(path)
+    if format_name == "parquet" and pyarrow is None:  # pragma: no cover
+        raise ValueError("Writing Parquet needs pyarrow, install the parquet extra")
+    started = time.perf_counter()
+    statement = PaymentMethod.flat_select().where(*conditions).order_by(PaymentMethod.id)
+    if shard_rows:
+        with engine.connect() as connection:
+            ranges = shard_ranges(connection, conditions, shard_rows)
+    else:
+        ranges = [(None, None)]
+
+    def write_shard(number, first_id, next_id):
+        shard = statement
+        if first_id is not None:
+            shard = shard.where(PaymentMethod.id >= first_id)
+        if next_id is not None:
+            shard = shard.where(PaymentMethod.id < next_id)
+        report = write_range(engine, shard, shard_path(path, number) if shard_rows else path, format_name, batch_size)
+        if progress:
+            progress(report)
+        return report
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="export") as executor:
+        futures = [executor.submit(write_shard, number, *bounds) for number, bounds in enumerate(ranges)]
+        files = [future.result() for future in futures]
+    seconds = time.perf_counter() - started
+    rows = sum(report["rows"] for report in files)
+    return {
+        "rows": rows,
+        "files": files,
+        "seconds": seconds,
+        "rows_per_second": rows / seconds if seconds else 0.0,
+    }
@@ -0,0 +1,176 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Bulk Import
+
+This module streams PaymentMethod bodies out of an NDJSON or CSV file, checks
+each one with the rules of the REST API and loads the valid ones in chunks
+with PaymentMethod.import_batch(), COPY on PostgreSQL. A CSV file has a header
+row naming the fields, its numbers are read as ints.
+
+After every chunk is committed the number of rows read so far is written to a
+checkpoint file, so an import that stops part way resumes after the last
+chunk that was loaded. The checkpoint is written after the commit: if the
+process dies between the two, that one chunk is loaded again.
+"""
+import csv
+import json
+import os
+import time
+from service.models import PaymentMethod, body_errors, error_message
+
+FORMATS = ("ndjson", "csv")
+# The CSV fields read as ints
+INT_FIELDS = ("user_id", "expiry_month", "expiry_year")
+
+
+######################################################################
+# Readers
+######################################################################
+def file_format(path):
+    """Returns the format of a file named by its extension"""
+    extension = os.path.splitext(path)[1].lower().lstrip(".")
+    if extension in ("ndjson", "jsonl"):
+        return "ndjson"
+    if extension == "csv":
+        return "csv"
+    raise ValueError(f"Cannot tell the format of '{path}', name it with --format")
+
+
+def read_ndjson(stream):
+    """Yields the body of each line of an NDJSON stream, or None for a line that is not JSON"""
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+def read_csv(stream):
+    """Yields the body of each row of a CSV stream, leaving out empty fields"""
+    for row in csv.DictReader(stream):
+        body = {field: value for field, value in row.items() if field and value not in ("", None)}
+        for field in INT_FIELDS:
+            if field in body and body[field].lstrip("-").isdigit():
+                body[field] = int(body[field])
+        yield body
+
+
+READERS = {"ndjson": read_ndjson, "csv": read_csv}
+
+
+######################################################################
+# Checkpoints
+######################################################################
+class Checkpoint:
+    """The progress of the import of a file, kept in a JSON file
+
+    The checkpoint records the size and modification time of the file, so one
+    that changed since is not resumed at a row that now means something else.
+    """
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = os.path.abspath(source)
+        stat = os.stat(self.source)
+        self.state = {
+            "source": self.source,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "rows": 0,
+            "imported": 0,
+            "rejected": 0,
+        }
+
+    def load(self):
+        """Reads the saved progress, returns the number of rows already read"""
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, encoding="utf-8") as checkpoint:
+            state = json.load(checkpoint)
+        if state.get("source") != self.source:
+            raise ValueError(f"Checkpoint '{self.path}' is for another file: {state.get('source')}")
+        if (state.get("size"), state.get("mtime")) != (self.state["size"], self.state["mtime"]):
+            raise ValueError(f"Checkpoint '{self.path}' is for an older version of {self.source}, restart the import")
+        self.state = state
+        return state["rows"]
+
+    def save(self, rows, imported, rejected):
+        """Writes the progress, replacing the last checkpoint in one step"""
+        self.state.update(rows=rows, imported=imported, rejected=rejected)
+        partial = f"{self.path}.tmp"
+        with open(partial, "w", encoding="utf-8") as checkpoint:
+            json.dump(self.state, checkpoint)
+        os.replace(partial, self.path)
+
+    def clear(self):
+        """Removes the checkpoint once the file is imported"""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+######################################################################
+# Import
+######################################################################
+def import_file(path, format_name=None, chunk_size=10000, checkpoint=None, progress=None, rejects=None):
+    """Imports the PaymentMethods of a file, returns the counts and the rate of the import
+
+    progress is called with the report after every chunk, rejects with the row
+    number, body and errors of every invalid row.
+    """
+    format_name = format_name or file_format(path)
+    checkpoint = checkpoint or Checkpoint(f"{path}.checkpoint", path)
+    skip = checkpoint.load()
+    totals = {"imported": checkpoint.state["imported"], "rejected": checkpoint.state["rejected"]}
+    started = time.perf_counter()
+    report = {"rows": skip, "resumed_at": skip, "imported": 0, "rejected": 0}
+
+    def load(chunk, rows):
+        if chunk:
+            PaymentMethod.import_batch(chunk)
+        report["imported"] += len(chunk)
+        report["rows"] = rows
+        checkpoint.save(rows, totals["imported"] + report["imported"], totals["rejected"] + report["rejected"])
+        report["seconds"] = time.perf_counter() - started
+        report["rows_per_second"] = report["imported"] / report["seconds"] if report["seconds"] else 0.0
+        if progress:
+            progress(report)
+
+    chunk = []
+    rows = skip
+    with open(path, newline="", encoding="utf-8") as stream:
+        for number, body in enumerate(READERS[format_name](stream), start=1):
+            if number <= skip:
+                continue
+            rows = number
+            errors = {"body": "Row is not valid JSON"} if body is None else body_errors(body)
+            if errors:
+                report["rejected"] += 1
+                if rejects:
+                    rejects(number, body, error_message(errors))
+                continue
+            chunk.append(body)
+            if len(chunk) >= chunk_size:
+                load(chunk, rows)
+                chunk = []
+    load(chunk, rows)
+    checkpoint.clear()
+    report["total_imported"] = totals["imported"] + report["imported"]
+    report["total_rejected"] = totals["rejected"] + report["rejected"]
+    return report
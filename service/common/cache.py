@@ -0,0 +1,172 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Cache
+
+This module contains the read-through cache used by PaymentMethod.find.
+The backend is chosen with the CACHE_BACKEND setting: "memory" (the default)
+keeps a bounded LRU cache with TTL eviction in each process, "none" disables
+caching, and "package.module:ClassName" loads any CacheBackend subclass, such
+as one backed by a cache shared between replicas.
+
+The results of GET /api/payments/stats are kept for STATS_CACHE_TTL seconds
+in a small MemoryCache of their own, if it is set.
+"""
+import importlib
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from flask import current_app
+
+
+class CacheBackend(ABC):
+    """Interface that every cache backend implements
+
+    Values are plain dictionaries of JSON types, so a backend is free to
+    serialize them to share them between processes.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """Creates the backend from the Flask app configuration"""
+        return cls()
+
+    @abstractmethod
+    def get(self, key):
+        """Returns the value cached for key, or None"""
+
+    @abstractmethod
+    def set(self, key, value):
+        """Caches value for key"""
+
+    @abstractmethod
+    def delete(self, key):
+        """Removes key from the cache if it is there"""
+
+    @abstractmethod
+    def clear(self):
+        """Removes everything from the cache"""
+
+    def stats(self) -> dict:
+        """Returns the counters used to size the cache"""
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class NullCache(CacheBackend):
+    """A cache that never holds anything"""
+
+    def get(self, key):
+        self.misses += 1
+
+    def set(self, key, value):
+        """Nothing is cached"""
+
+    def delete(self, key):
+        """Nothing is cached"""
+
+    def clear(self):
+        """Nothing is cached"""
+
+
+class MemoryCache(CacheBackend):
+    """An in-process cache with bounded size (LRU) and time to live eviction"""
+
+    def __init__(self, max_size=10000, ttl=60.0, timer=time.monotonic):
+        super().__init__()
+        self.max_size = max_size
+        self.ttl = ttl
+        self.timer = timer
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config["CACHE_MAX_SIZE"], config["CACHE_TTL"])
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= self.timer():
+                if entry is not None:
+                    del self._entries[key]
+                    self.evictions += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (self.timer() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._entries)
+        return {
+            **super().stats(),
+            "evictions": self.evictions,
+            "size": size,
+            "max_size": self.max_size,
+        }
+
+
+BACKENDS = {"memory": MemoryCache, "none": NullCache}
+
+# Most results of the stats endpoint kept, one per combination of filters
+STATS_CACHE_MAX_SIZE = 1000
+
+
+def init_cache(app):
+    """Creates the cache backend named by CACHE_BACKEND for the app"""
+    name = app.config["CACHE_BACKEND"]
+    backend = BACKENDS.get(name)
+    if backend is None:
+        module_name, _, class_name = name.partition(":")
+        backend = getattr(importlib.import_module(module_name), class_name)
+    app.extensions["cache"] = backend.from_config(app.config)
+    ttl = app.config["STATS_CACHE_TTL"]
+    app.extensions["stats_cache"] = MemoryCache(STATS_CACHE_MAX_SIZE, ttl) if ttl > 0 else NullCache()
+    return app.extensions["cache"]
+
+
+def get_cache() -> CacheBackend:
+    """Returns the cache of the current app"""
+    return current_app.extensions["cache"]
+
+
+def get_stats_cache() -> CacheBackend:
+    """Returns the cache of the stats results of the current app"""
+    return current_app.extensions["stats_cache"]
@@ -16,8 +16,13 @@
 """
 Flask CLI Command Extensions
 """
+import contextlib
+import json
+import click
 from flask import current_app as app  # Import Flask application
-from service.models import db
+from flask_migrate import stamp
+from service.common import bulk_export, bulk_import
+from service.models import DataValidationError, db
 
 
 ######################################################################
@@ -29,8 +34,134 @@ from service.models import db
 def db_create():
     """
     Recreates a local database. You probably should not use this on
-    production. ;-)
+    production. ;-) Use `flask db upgrade` to apply migrations instead.
     """
     db.drop_all()
     db.create_all()
     db.session.commit()
+    # The tables now match the latest migration, record that for Alembic
+    stamp()
+
+
+######################################################################
+# Command to import PaymentMethods from a file
+# Usage:
+#   flask payments-import payments.ndjson
+######################################################################
+@app.cli.command("payments-import")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--format", "format_name", type=click.Choice(bulk_import.FORMATS), help="Format of the file, by default from its extension"
+)
+@click.option("--chunk-size", default=10000, show_default=True, type=click.IntRange(min=1), help="Rows per transaction")
+@click.option("--checkpoint", type=click.Path(dir_okay=False), help="Checkpoint file  [default: PATH.checkpoint]")
+@click.option("--restart", is_flag=True, help="Start from the first row, ignoring the checkpoint")
+@click.option(
+    "--rejects",
+    type=click.Path(dir_okay=False, writable=True),
+    help="NDJSON file for the invalid rows and their errors, added to when resuming",
+)
+def payments_import(path, format_name, chunk_size, checkpoint, restart, rejects):  # pylint: disable=too-many-arguments
+    """
+    Imports PaymentMethods from an NDJSON or CSV file, resuming from the
+    checkpoint of an import that stopped part way
+    """
+    checkpoint = bulk_import.Checkpoint(checkpoint or f"{path}.checkpoint", path)
+    if restart:
+        checkpoint.clear()
+
+    def progress(report):
+        click.echo(
+            f"Row {report['rows']}: imported {report['imported']}, rejected {report['rejected']}, "
+            f"{report['rows_per_second']:.0f} rows/s",
+            err=True,
+        )
+
+    try:
+        format_name = format_name or bulk_import.file_format(path)
+        with open_rejects(rejects, checkpoint.load()) as stream:
+
+            def reject(number, body, message):
+                stream.write(json.dumps({"row": number, "error": message, "body": body}) + "\n")
+
+            report = bulk_import.import_file(
+                path, format_name, chunk_size, checkpoint, progress, reject if stream else None
+            )
+    except ValueError as error:
+        raise click.ClickException(str(error)) from error
+    except DataValidationError as error:
+        raise click.ClickException(f"{error}\nRun the command again to resume from {checkpoint.path}") from error
+    resumed = f" after row {report['resumed_at']}" if report["resumed_at"] else ""
+    click.echo(
+        f"Imported {report['imported']} PaymentMethods{resumed} in {report['seconds']:.1f} s "
+        f"({report['rows_per_second']:.0f} rows/s), rejected {report['rejected']}"
+    )
+
+
+def open_rejects(path, resumed_at):
+    """Opens the rejects file of an import, appending to it when resuming
+
+    A resumed import reads again the rows after its checkpoint, so the rejects
+    the stopped run wrote for them are cut off instead of repeated.
+    """
+    if not path:
+        return contextlib.nullcontext()
+    if not resumed_at:
+        return open(path, "w", encoding="utf-8")  # pylint: disable=consider-using-with
+    stream = open(path, "a+", encoding="utf-8")  # pylint: disable=consider-using-with
+    stream.seek(0)
+    end = 0
+    for line in iter(stream.readline, ""):
+        if json.loads(line)["row"] > resumed_at:
+            break
+        end = stream.tell()
+    stream.truncate(end)
+    return stream
+
+
+######################################################################
+# Command to export PaymentMethods to files
+# Usage:
+#   flask payments-export payments.parquet --shard-rows 1000000
+######################################################################
+@app.cli.command("payments-export")
+@click.argument("path", type=click.Path(dir_okay=False, writable=True))
+@click.option(
+    "--format",
+    "format_name",
+    type=click.Choice(bulk_export.FORMATS),
+    help="Format of the files, by default from the extension",
+)
+@click.option("--user-id", type=int, help="Export the PaymentMethods of one user")
+@click.option("--type", "payment_type", type=click.Choice(["CREDIT_CARD", "PAYPAL"]), help="Export one type only")
+@click.option("--shard-rows", type=click.IntRange(min=1), help="Split into files of at most this many rows, named PATH-00000")
+@click.option("--workers", default=4, show_default=True, type=click.IntRange(min=1), help="Shards written at once")
+@click.option("--batch-size", default=10000, show_default=True, type=click.IntRange(min=1), help="Rows fetched at a time")
+def payments_export(  # pylint: disable=too-many-arguments
+    path, format_name, user_id, payment_type, shard_rows, workers, batch_size
+):
+    """
+    Exports PaymentMethods to NDJSON, CSV or Parquet, one row per PaymentMethod
+    with the fields of every type
+    """
+
+    def progress(report):
+        click.echo(f"Wrote {report['path']}: {report['rows']} rows, {report['bytes']} bytes", err=True)
+
+    try:
+        report = bulk_export.export(
+            db.engine,
+            path,
+            format_name,
+            bulk_export.criteria(user_id, payment_type),
+            shard_rows,
+            workers,
+            batch_size,
+            progress if shard_rows else None,
+        )
+    except ValueError as error:
+        raise click.ClickException(str(error)) from error
+    click.echo(
+        f"Exported {report['rows']} PaymentMethods to {len(report['files'])} files in {report['seconds']:.1f} s "
+        f"({report['rows_per_second']:.0f} rows/s)"
+    )
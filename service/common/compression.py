@@ -0,0 +1,219 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Response Compression
+
+This module compresses the JSON and text responses of the app with the
+content coding the client prefers in Accept-Encoding among those listed in
+COMPRESSION_ENCODINGS: gzip, and br or zstd when the brotli or zstandard
+package is installed. Responses smaller than COMPRESSION_MIN_SIZE are sent as
+they are. Streamed responses, such as the NDJSON list, are compressed as they
+are written and flushed every FLUSH_BYTES, so rows still reach the client
+while the stream runs.
+
+A response to a client that accepts one of the encodings gets the weak form
+of its ETag, W/"...", as its bytes may differ from those of the same rows sent
+in another encoding, and a strong ETag promises the same bytes. This depends
+only on Accept-Encoding, not on whether the body turned out big enough to
+compress, so a 304 carries the same ETag and Vary header as the 200 it
+revalidates. If-None-Match compares ETags weakly, so a client sending back
+either form still gets a 304, and the Vary header keeps caches from mixing up
+the encodings.
+"""
+import zlib
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None  # pylint: disable=invalid-name
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None  # pylint: disable=invalid-name
+
+# Media types worth compressing besides text/*
+COMPRESSIBLE = {"application/json", "application/x-ndjson", "application/javascript"}
+# Bytes of a streamed response compressed before they are flushed to the client
+FLUSH_BYTES = 64 * 1024
+
+
+######################################################################
+# Compressors
+######################################################################
+class GzipCompressor:
+    """Compresses a body or a stream with gzip"""
+
+    def __init__(self, level):
+        self.zlib = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        """Returns the compressed data it has ready"""
+        return self.zlib.compress(data)
+
+    def flush(self):
+        """Returns all the compressed data so far, leaving the stream open"""
+        return self.zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        """Returns the end of the compressed stream"""
+        return self.zlib.flush()
+
+
+class BrotliCompressor:
+    """Compresses a body or a stream with brotli"""
+
+    def __init__(self, level):
+        self.brotli = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        """Returns the compressed data it has ready"""
+        return self.brotli.process(data)
+
+    def flush(self):
+        """Returns all the compressed data so far, leaving the stream open"""
+        return self.brotli.flush()
+
+    def finish(self):
+        """Returns the end of the compressed stream"""
+        return self.brotli.finish()
+
+
+class ZstdCompressor:
+    """Compresses a body or a stream with zstd"""
+
+    def __init__(self, level):
+        self.zstd = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        """Returns the compressed data it has ready"""
+        return self.zstd.compress(data)
+
+    def flush(self):
+        """Returns all the compressed data so far, leaving the stream open"""
+        return self.zstd.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        """Returns the end of the compressed stream"""
+        return self.zstd.flush()
+
+
+# The compressor and the level setting of each content coding
+COMPRESSORS = {
+    "gzip": (GzipCompressor, "COMPRESSION_LEVEL"),
+    "br": (BrotliCompressor, "COMPRESSION_BROTLI_LEVEL"),
+    "zstd": (ZstdCompressor, "COMPRESSION_ZSTD_LEVEL"),
+}
+INSTALLED = {"gzip": True, "br": brotli is not None, "zstd": zstandard is not None}
+
+
+def encodings(config) -> dict:
+    """Returns the level of each installed encoding of COMPRESSION_ENCODINGS, in order of preference"""
+    levels = {}
+    for name in filter(None, (name.strip() for name in config["COMPRESSION_ENCODINGS"].split(","))):
+        if name not in COMPRESSORS:
+            raise ValueError(f"Unknown compression encoding '{name}'")
+        if INSTALLED[name]:
+            levels[name] = config[COMPRESSORS[name][1]]
+    return levels
+
+
+def compress(data, encoding, level):
+    """Returns a whole body compressed with an encoding"""
+    compressor = COMPRESSORS[encoding][0](level)
+    return compressor.compress(data) + compressor.finish()
+
+
+def compress_stream(chunks, encoding, level):
+    """Yields the chunks of a stream compressed, flushed every FLUSH_BYTES"""
+    compressor = COMPRESSORS[encoding][0](level)
+    pending = 0
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            data = compressor.compress(chunk)
+            pending += len(chunk)
+            if pending >= FLUSH_BYTES:
+                data += compressor.flush()
+                pending = 0
+            if data:
+                yield data
+        yield compressor.finish()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+######################################################################
+# Response hook
+######################################################################
+def weak_etag(value):
+    """Returns the weak form of an ETag header"""
+    return value if value.startswith("W/") else f"W/{value}"
+
+
+def compressible(response):
+    """Returns whether a response has a body worth compressing"""
+    return (
+        response.status_code >= 200
+        and response.status_code not in (204, 206, 304)
+        and not response.direct_passthrough
+        and "Content-Encoding" not in response.headers
+        and (response.mimetype.startswith("text/") or response.mimetype in COMPRESSIBLE)
+    )
+
+
+def after_request(response):
+    """Compresses the response with the encoding the client prefers"""
+    settings = current_app.extensions["compression"]
+    not_modified = response.status_code == 304
+    if not settings["encodings"] or not (not_modified or compressible(response)):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = request.accept_encodings.best_match(list(settings["encodings"]))
+    if encoding is None:
+        return response
+    if "ETag" in response.headers:
+        response.headers["ETag"] = weak_etag(response.headers["ETag"])
+    if not_modified:
+        return response
+    level = settings["encodings"][encoding]
+
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding, level)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < settings["min_size"]:
+            return response
+        compressed = compress(data, encoding, level)
+        if len(compressed) >= len(data):
+            return response
+        response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def init_compression(app):
+    """Compresses the responses of the app"""
+    app.extensions["compression"] = {
+        "encodings": encodings(app.config),
+        "min_size": app.config["COMPRESSION_MIN_SIZE"],
+    }
+    app.after_request(after_request)
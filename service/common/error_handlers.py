@@ -18,7 +18,7 @@ Module: error_handlers
 """
 from flask import jsonify
 from flask import current_app as app  # Import Flask application
-from service.models import DataValidationError
+from service.models import DataConflictError, DataValidationError, ValidationErrors
 from . import status
 
 
@@ -30,9 +30,17 @@ def bad_request(error):
     """Handles Value Errors from bad data"""
     message = str(error)
     app.logger.warning(message)
-    return (
-        jsonify(
-            status=status.HTTP_400_BAD_REQUEST, error="Bad Request", message=message
-        ),
-        status.HTTP_400_BAD_REQUEST,
-    )
+    data = {"status": status.HTTP_400_BAD_REQUEST, "error": "Bad Request", "message": message}
+    if isinstance(error, ValidationErrors):
+        # every invalid field of the body, keyed by field name
+        data["errors"] = error.errors
+    return jsonify(data), status.HTTP_400_BAD_REQUEST
+
+
+@app.errorhandler(DataConflictError)
+def conflict(error):
+    """Handles changes that kept losing to concurrent changes"""
+    message = str(error)
+    app.logger.warning(message)
+    data = {"status": status.HTTP_409_CONFLICT, "error": "Conflict", "message": message}
+    return jsonify(data), status.HTTP_409_CONFLICT
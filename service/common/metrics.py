@@ -0,0 +1,194 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Metrics
+
+This module collects the Prometheus metrics served on /metrics: the count and
+latency of the requests of each resource and method, the requests in flight,
+the count and time of the database queries and the connections of the pools.
+
+Under gunicorn every worker writes its values to files in the directory named
+by PROMETHEUS_MULTIPROC_DIR (set up by gunicorn.conf.py) and /metrics adds up
+the values of all workers. Without it the values of the process are served.
+"""
+import os
+import time
+from flask import current_app, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+
+# from 1 ms to 10 s, the range of the service's requests and queries
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REQUESTS = Counter(
+    "payments_http_requests",
+    "HTTP requests served, by resource, method and status",
+    ["resource", "method", "status"],
+)
+REQUEST_LATENCY = Histogram(
+    "payments_http_request_duration_seconds",
+    "Time to handle an HTTP request, by resource and method",
+    ["resource", "method"],
+    buckets=LATENCY_BUCKETS,
+)
+IN_FLIGHT = Gauge(
+    "payments_http_requests_in_flight",
+    "HTTP requests being handled",
+    multiprocess_mode="livesum",
+)
+DB_QUERY_LATENCY = Histogram(
+    "payments_db_query_duration_seconds",
+    "Time to run a database statement, its count is the number of statements",
+    buckets=LATENCY_BUCKETS,
+)
+DB_CONNECTIONS = Gauge(
+    "payments_db_pool_connections",
+    "Database connections opened by the pools",
+    multiprocess_mode="livesum",
+)
+DB_CHECKED_OUT = Gauge(
+    "payments_db_pool_checked_out",
+    "Database connections checked out of the pools",
+    multiprocess_mode="livesum",
+)
+
+
+######################################################################
+# Requests
+######################################################################
+def request_started():
+    """Counts a request in flight, returns its start time"""
+    IN_FLIGHT.inc()
+    return time.perf_counter()
+
+
+def request_finished(start, resource, method, status_code):
+    """Records a finished request"""
+    REQUEST_LATENCY.labels(resource, method).observe(time.perf_counter() - start)
+    REQUESTS.labels(resource, method, status_code).inc()
+    IN_FLIGHT.dec()
+
+
+def resource_name(app, endpoint):
+    """Returns the flask-restx Resource class serving an endpoint, or the endpoint"""
+    view = app.view_functions.get(endpoint)
+    view_class = getattr(view, "view_class", None)
+    if view_class is not None:
+        return view_class.__name__
+    return endpoint or "unmatched"
+
+
+def before_request():
+    """Starts timing a request"""
+    g.metrics_start = request_started()
+
+
+def after_request(response):
+    """Records the latency and status of a request"""
+    start = g.pop("metrics_start", None)
+    if start is not None:
+        resource = resource_name(current_app, request.endpoint)
+        request_finished(start, resource, request.method, response.status_code)
+    return response
+
+
+def teardown_request(_error):
+    """Stops counting a request that ended without a response"""
+    if g.pop("metrics_start", None) is not None:
+        IN_FLIGHT.dec()
+
+
+######################################################################
+# Database
+######################################################################
+def before_cursor_execute(_conn, _cursor, _statement, _parameters, context, _executemany):
+    """Notes when a statement starts"""
+    context.metrics_start = time.perf_counter()
+
+
+def after_cursor_execute(_conn, _cursor, _statement, _parameters, context, _executemany):
+    """Records how long a statement ran"""
+    DB_QUERY_LATENCY.observe(time.perf_counter() - context.metrics_start)
+
+
+def pool_connect(_dbapi_connection, _connection_record):
+    """Counts a connection opened by a pool"""
+    DB_CONNECTIONS.inc()
+
+
+def pool_close(_dbapi_connection, _connection_record=None):
+    """Counts a connection closed by a pool"""
+    DB_CONNECTIONS.dec()
+
+
+def pool_checkout(_dbapi_connection, _connection_record, _connection_proxy):
+    """Counts a connection checked out of a pool"""
+    DB_CHECKED_OUT.inc()
+
+
+def pool_checkin(_dbapi_connection, _connection_record):
+    """Counts a connection returned to a pool"""
+    DB_CHECKED_OUT.dec()
+
+
+LISTENERS = (
+    (Engine, "before_cursor_execute", before_cursor_execute),
+    (Engine, "after_cursor_execute", after_cursor_execute),
+    (Pool, "connect", pool_connect),
+    (Pool, "close", pool_close),
+    (Pool, "close_detached", pool_close),
+    (Pool, "checkout", pool_checkout),
+    (Pool, "checkin", pool_checkin),
+)
+
+
+######################################################################
+# Exposition
+######################################################################
+def registry():
+    """Returns the registry to serve, which adds up the workers under gunicorn"""
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return REGISTRY
+    workers = CollectorRegistry()
+    multiprocess.MultiProcessCollector(workers)
+    return workers
+
+
+def latest():
+    """Returns the metrics in the Prometheus text format and its content type"""
+    return generate_latest(registry()), CONTENT_TYPE_LATEST
+
+
+def init_metrics(app):
+    """Times the requests of the app and the statements of every engine"""
+    app.before_request(before_request)
+    app.after_request(after_request)
+    app.teardown_request(teardown_request)
+    for target, name, listener in LISTENERS:
+        if not event.contains(target, name, listener):
+            event.listen(target, name, listener)
@@ -0,0 +1,135 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Connection Pool
+
+This module builds the engine options of the database connection pool from the
+DB_POOL_* and DB_STATEMENT_TIMEOUT settings, and keeps the counters used to
+size the pool of each replica: how many connections were checked out, how long
+requests waited for one and how often they gave up.
+"""
+import threading
+import time
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+
+class TimedPoolMixin:
+    """Counts checkouts and the time spent waiting for a connection"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self._stats_lock = threading.Lock()
+
+    def connect(self):
+        """Returns a connection from the pool, timing how long it took"""
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        waited = time.perf_counter() - start
+        with self._stats_lock:
+            self.checkouts += 1
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        return connection
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    """The QueuePool of the Flask app, with checkout counters"""
+
+
+class TimedAsyncQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    """The QueuePool of the asyncio engine, with checkout counters"""
+
+
+def engine_options(config, asyncio=False) -> dict:
+    """Returns the create_engine() options for the configured database
+
+    The pool is sized only for PostgreSQL, other databases keep the pool that
+    SQLAlchemy and Flask-SQLAlchemy choose for them.
+    """
+    options = {
+        "pool_pre_ping": config["DB_POOL_PRE_PING"],
+        "pool_recycle": config["DB_POOL_RECYCLE"],
+    }
+    if make_url(config["SQLALCHEMY_DATABASE_URI"]).get_backend_name() != "postgresql":
+        return options
+
+    options.update(
+        poolclass=TimedAsyncQueuePool if asyncio else TimedQueuePool,
+        pool_size=config["DB_POOL_SIZE"],
+        max_overflow=config["DB_MAX_OVERFLOW"],
+        pool_timeout=config["DB_POOL_TIMEOUT"],
+    )
+    if config["DB_STATEMENT_TIMEOUT"]:
+        # set once per connection as it is opened, not on every checkout
+        options["connect_args"] = {
+            "options": f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT']}"
+        }
+    return options
+
+
+def pool_stats(engine) -> dict:
+    """Returns the live state and the counters of the pool of an engine"""
+    pool = engine.pool
+    stats = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=max(pool.overflow(), 0),
+            max_overflow=pool._max_overflow,  # pylint: disable=protected-access
+            timeout=pool.timeout(),
+        )
+    if isinstance(pool, TimedPoolMixin):
+        with pool._stats_lock:  # pylint: disable=protected-access
+            stats.update(
+                checkouts=pool.checkouts,
+                timeouts=pool.timeouts,
+                wait_seconds_total=round(pool.wait_seconds, 6),
+                wait_seconds_max=round(pool.max_wait_seconds, 6),
+            )
+    return stats
+
+
+def register_engine(app, name, engine):
+    """Adds an engine to the pools reported by the app"""
+    app.extensions.setdefault("engines", {})[name] = engine
+
+
+def reset_pools(app):
+    """Replaces the pools of the app in a forked process
+
+    The connections of the parent are left open for it, the child opens its own.
+    """
+    for engine in app.extensions.get("engines", {}).values():
+        engine.dispose(close=False)
+
+
+def get_pool_stats(app) -> dict:
+    """Returns the pool statistics of every engine of the app"""
+    return {name: pool_stats(engine) for name, engine in app.extensions.get("engines", {}).items()}
@@ -0,0 +1,200 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Query Log
+
+This module counts the SQL statements of each request and the time they took.
+The counts are added to every log record of the request as sql_count and
+sql_ms, and to a Server-Timing response header in debug mode.
+
+Statements slower than SLOW_QUERY_MS are written to the service.slow_queries
+log, without their parameters. With SLOW_QUERY_EXPLAIN the plan of a slow
+SELECT is captured on a background thread with EXPLAIN (ANALYZE, BUFFERS),
+which runs the statement again in a read-only transaction that is rolled back.
+A SELECT that PostgreSQL refuses to run read-only, because it locks rows with
+FOR UPDATE or draws sequence values with nextval(), is not run again: its
+estimated plan is logged instead, from a plain EXPLAIN.
+"""
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+
+slow_log = logging.getLogger("service.slow_queries")
+
+# the statements of the request being served, None outside of requests
+current_queries = contextvars.ContextVar("current_queries", default=None)
+# set on the thread that captures plans, so EXPLAIN is not explained
+explaining = contextvars.ContextVar("explaining", default=False)
+
+# set from the app configuration by init_query_log()
+settings = {"slow_seconds": 0.0, "explain": False}
+# one thread captures the plans, at most EXPLAIN_BACKLOG of them wait their turn
+EXPLAIN_BACKLOG = 8
+explain_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="explain")
+explain_slots = threading.BoundedSemaphore(EXPLAIN_BACKLOG)
+# SQLSTATE of a statement that changes something in a read-only transaction
+READ_ONLY_SQL_TRANSACTION = "25006"
+
+
+class QueryStats:
+    """The number of statements of a request and the time they took"""
+
+    __slots__ = ("count", "seconds")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    @property
+    def milliseconds(self):
+        """Returns the time of the statements in milliseconds"""
+        return round(self.seconds * 1000, 3)
+
+    def server_timing(self):
+        """Returns the statements as a Server-Timing header value"""
+        return f'db;dur={self.milliseconds};desc="{self.count} statements"'
+
+
+def track_queries():
+    """Starts counting the statements of a request, returns the stats and a reset token"""
+    stats = QueryStats()
+    return stats, current_queries.set(stats)
+
+
+class QueryStatsFilter(logging.Filter):  # pylint: disable=too-few-public-methods
+    """Adds the statements of the current request to log records"""
+
+    def filter(self, record):
+        stats = current_queries.get()
+        record.sql_count = stats.count if stats else 0
+        record.sql_ms = stats.milliseconds if stats else 0.0
+        return True
+
+
+######################################################################
+# Statements
+######################################################################
+def before_cursor_execute(_conn, _cursor, _statement, _parameters, context, _executemany):
+    """Notes when a statement starts"""
+    context.query_log_start = time.perf_counter()
+
+
+def after_cursor_execute(conn, _cursor, statement, parameters, context, executemany):
+    """Adds a statement to the request and logs it when it was slow"""
+    seconds = time.perf_counter() - context.query_log_start
+    stats = current_queries.get()
+    if stats is not None:
+        stats.count += 1
+        stats.seconds += seconds
+    if settings["slow_seconds"] and seconds >= settings["slow_seconds"] and not explaining.get():
+        slow_log.warning("Slow query (%.1f ms): %s", seconds * 1000, statement)
+        if settings["explain"] and not executemany and explainable(conn, statement):
+            explain_later(conn.engine, statement, parameters)
+
+
+def explainable(conn, statement):
+    """Returns whether the plan of a statement can be captured safely"""
+    return (
+        conn.dialect.name == "postgresql"
+        and not conn.dialect.is_async
+        and statement.lstrip().upper().startswith("SELECT")
+    )
+
+
+def explain_later(engine, statement, parameters):
+    """Captures the plan of a statement on the background thread, unless too many wait"""
+    if explain_slots.acquire(blocking=False):  # pylint: disable=consider-using-with
+        future = explain_executor.submit(explain, engine, statement, parameters)
+        future.add_done_callback(lambda _future: explain_slots.release())
+
+
+def explain(engine, statement, parameters):
+    """Logs the plan of a statement with the rows and buffers it really used
+
+    A statement with side effects is not run again, the plan it would use is logged
+    """
+    explaining.set(True)
+    try:
+        with engine.connect() as conn:
+            try:
+                conn.exec_driver_sql("SET TRANSACTION READ ONLY")
+                rows = conn.exec_driver_sql(f"EXPLAIN (ANALYZE, BUFFERS) {statement}", parameters)
+                title = "Plan of slow query"
+            except DBAPIError as error:
+                if getattr(error.orig, "sqlstate", None) != READ_ONLY_SQL_TRANSACTION:
+                    raise
+                conn.rollback()
+                rows = conn.exec_driver_sql(f"EXPLAIN {statement}", parameters)
+                title = "Estimated plan of slow query, not run again as it has side effects"
+            plan = "\n".join(row[0] for row in rows)
+            conn.rollback()
+        slow_log.warning("%s: %s\n%s", title, statement, plan)
+    except Exception as error:  # pylint: disable=broad-except
+        slow_log.warning("Could not explain slow query: %s", error)
+
+
+######################################################################
+# Requests
+######################################################################
+def before_request():
+    """Starts counting the statements of a request"""
+    g.query_stats, g.query_stats_token = track_queries()
+
+
+def after_request(response):
+    """Logs the statements of a request, and returns them in debug mode"""
+    stats = g.get("query_stats")
+    if stats is not None:
+        current_app.logger.info(
+            "%s %s ran %d statements in %.3f ms",
+            request.method,
+            request.path,
+            stats.count,
+            stats.milliseconds,
+        )
+        if current_app.debug:
+            response.headers["Server-Timing"] = stats.server_timing()
+    return response
+
+
+def teardown_request(_error):
+    """Stops counting the statements of a request"""
+    token = g.pop("query_stats_token", None)
+    if token is not None:
+        current_queries.reset(token)
+
+
+def init_query_log(app):
+    """Counts the statements of each request and logs the slow ones"""
+    settings["slow_seconds"] = app.config["SLOW_QUERY_MS"] / 1000
+    settings["explain"] = app.config["SLOW_QUERY_EXPLAIN"]
+    app.before_request(before_request)
+    app.after_request(after_request)
+    app.teardown_request(teardown_request)
+    app.logger.addFilter(QueryStatsFilter())
+    for name, listener in (
+        ("before_cursor_execute", before_cursor_execute),
+        ("after_cursor_execute", after_cursor_execute),
+    ):
+        if not event.contains(Engine, name, listener):
+            event.listen(Engine, name, listener)
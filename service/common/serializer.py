@@ -0,0 +1,105 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Serializer
+
+This module writes ORM objects straight to JSON bytes in the format of a
+flask-restx model, instead of building a dictionary with serialize() and a
+second one with marshal() for the json module to encode.
+
+The first time a class is serialized the fields of the model it maps are
+looked up once. Every object of the class is then read from its loaded state
+with one itemgetter call and encoded by orjson, which writes Enums as their
+values. The JSON has the fields, order and values of marshal(skip_none=True).
+A serializer of some of the fields, made by only(), also writes the rows of a
+query of some columns.
+"""
+from operator import itemgetter
+import orjson
+from flask import current_app
+from flask_restx.mask import Mask
+from sqlalchemy import inspect
+from sqlalchemy.engine import Row
+
+
+class ModelSerializer:
+    """Serializes ORM objects as the fields of a flask-restx model, leaving out None"""
+
+    def __init__(self, model):
+        self.model = model
+        self.fields = [(key, field.attribute or key) for key, field in model.resolved.items()]
+        self.compiled = {}
+        self.subsets = {}
+
+    def only(self, keys):
+        """Returns a serializer of some of the fields, in the order of the model"""
+        keys = frozenset(keys)
+        subset = self.subsets.get(keys)
+        if subset is None:
+            subset = ModelSerializer(self.model)
+            subset.fields = [(key, attribute) for key, attribute in self.fields if key in keys]
+            self.subsets[keys] = subset
+        return subset
+
+    def compile(self, cls):
+        """Returns the keys, attribute names and getter of the fields a class maps"""
+        mapped = inspect(cls).attrs.keys()
+        fields = [(key, attribute) for key, attribute in self.fields if attribute in mapped]
+        keys = tuple(key for key, _ in fields)
+        attributes = tuple(attribute for _, attribute in fields)
+        # a class may map one of the fields or none of them, e.g. only email of a CreditCard
+        getter = itemgetter(*attributes) if len(attributes) > 1 else lambda state: tuple(state[a] for a in attributes)
+        self.compiled[cls] = keys, attributes, getter
+        return self.compiled[cls]
+
+    def to_dict(self, obj):
+        """Returns the fields of an ORM object or a row that are not None"""
+        if isinstance(obj, Row):
+            row = obj._mapping
+            return {key: row[attribute] for key, attribute in self.fields if row.get(attribute) is not None}
+        try:
+            keys, attributes, getter = self.compiled[type(obj)]
+        except KeyError:
+            keys, attributes, getter = self.compile(type(obj))
+        try:
+            values = getter(obj.__dict__)
+        except KeyError:
+            # expired or deferred attributes are loaded through the ORM
+            values = [getattr(obj, attribute) for attribute in attributes]
+        return {key: value for key, value in zip(keys, values) if value is not None}
+
+    def dumps(self, data, indent=False):
+        """Returns an ORM object, or a list or dict holding them, as a line of JSON bytes"""
+        option = orjson.OPT_APPEND_NEWLINE | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(data, default=self.to_dict, option=option)
+
+    def masked(self, data, mask):
+        """Returns only the fields named by an X-Fields mask of an object or a list"""
+        if isinstance(data, list):
+            data = [self.to_dict(obj) for obj in data]
+        else:
+            data = self.to_dict(data)
+        return Mask(mask).apply(data)
+
+    def response(self, data, code=200, headers=None):
+        """Returns a JSON response, indented when the app is in debug mode"""
+        return current_app.response_class(
+            self.dumps(data, indent=current_app.debug),
+            status=code,
+            headers=headers,
+            mimetype="application/json",
+        )
@@ -0,0 +1,65 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Startup Timing
+
+This module times the phases of create_app(): the imports of the service
+package, building the app, setting up the database, registering the routes
+and setting up logging. The report is logged once the app is ready and kept
+in app.extensions["startup"], so a slow start can be traced to its phase.
+"""
+import time
+import click
+
+PHASES = ("imports", "app", "db", "routes", "logging")
+
+
+class StartupTimer:
+    """The time spent in each phase of the start of a worker"""
+
+    def __init__(self, started=None, timer=time.perf_counter):
+        self.timer = timer
+        self.started = timer() if started is None else started
+        self.last = self.started
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+
+    def mark(self, phase):
+        """Ends a phase, which began where the last one ended
+
+        A phase marked more than once adds up the time of each of its parts.
+        """
+        now = self.timer()
+        self.seconds[phase] = self.seconds.get(phase, 0.0) + now - self.last
+        self.last = now
+
+    def report(self) -> dict:
+        """Returns the milliseconds of each phase and of the whole start"""
+        return {
+            "total_ms": round((self.last - self.started) * 1000, 1),
+            "phases_ms": {phase: round(seconds * 1000, 1) for phase, seconds in self.seconds.items()},
+        }
+
+    def summary(self) -> str:
+        """Returns the report as one log line"""
+        report = self.report()
+        phases = ", ".join(f"{phase} {ms} ms" for phase, ms in report["phases_ms"].items())
+        return f"Started in {report['total_ms']} ms: {phases}"
+
+
+def running_cli():
+    """Returns whether the app is being loaded by the flask command"""
+    return click.get_current_context(silent=True) is not None
@@ -13,7 +13,56 @@ DATABASE_URI = os.getenv(
 # Configure SQLAlchemy
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
-# SQLALCHEMY_POOL_SIZE = 2
+
+# Connection pool of each worker process, see service/common/pool.py
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+# Seconds to wait for a free connection before giving up
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Seconds after which a connection is replaced, -1 keeps connections forever
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Test each connection on checkout so a restarted database is not an error
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("true", "1", "yes")
+# Milliseconds a statement may run on PostgreSQL, 0 means no limit
+DB_STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", "0"))
+
+# Statements slower than this are written to the slow query log, 0 turns it off
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))
+# Also log the EXPLAIN (ANALYZE, BUFFERS) plan of slow SELECTs, captured in the background
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "false").lower() in ("true", "1", "yes")
+
+# Keyset pagination for list endpoints
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+# Rows fetched per round trip when a list is streamed as NDJSON
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "1000"))
+
+# Largest number of PaymentMethods accepted by one batch request
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "5000"))
+
+# Read-through cache for PaymentMethod.find: "memory", "none" or "module:Class"
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", "10000"))
+CACHE_TTL = float(os.getenv("CACHE_TTL", "60"))
+
+# Seconds the results of GET /api/payments/stats are reused, 0 computes them every time
+STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", "0"))
+# Users with the most PaymentMethods returned by the stats, unless ?top= asks otherwise
+STATS_TOP_USERS = int(os.getenv("STATS_TOP_USERS", "10"))
+
+# Response compression: content codings in order of preference, "" turns it off.
+# br and zstd are left out when the brotli or zstandard package is not installed
+COMPRESSION_ENCODINGS = os.getenv("COMPRESSION_ENCODINGS", "zstd,br,gzip")
+# Responses smaller than this many bytes are not compressed, streamed ones always are
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+# gzip level 1-9, brotli quality 0-11 and zstd level 1-22
+COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL", "6"))
+COMPRESSION_BROTLI_LEVEL = int(os.getenv("COMPRESSION_BROTLI_LEVEL", "4"))
+COMPRESSION_ZSTD_LEVEL = int(os.getenv("COMPRESSION_ZSTD_LEVEL", "3"))
+
+# Start workers without Flask-Migrate, Alembic and the CLI commands, the flask command still has them.
+# That is all it leaves out: the cache, metrics, query log and compression are set up as usual.
+FAST_STARTUP = os.getenv("FAST_STARTUP", "false").lower() in ("true", "1", "yes")
 
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "sup3r-s3cr3t")
@@ -0,0 +1,46 @@
+"""defer the one default per user check
+
+Revision ID: 1b989abbaf02
+Revises: 93d0e893791f
+Create Date: 2026-10-17 04:18:05.424357
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1b989abbaf02'
+down_revision = '93d0e893791f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Only PostgreSQL can check the constraint at commit, other databases keep
+    # the partial unique index
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('uq_payment_method_default_per_user', table_name='payment_method')
+    op.create_exclude_constraint(
+        'ex_payment_method_default_per_user',
+        'payment_method',
+        ('user_id', '='),
+        using='btree',
+        where=sa.text('is_default'),
+        deferrable=True,
+        initially='DEFERRED',
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_constraint('ex_payment_method_default_per_user', 'payment_method')
+    op.create_index(
+        'uq_payment_method_default_per_user',
+        'payment_method',
+        ['user_id'],
+        unique=True,
+        postgresql_where=sa.text('is_default'),
+    )
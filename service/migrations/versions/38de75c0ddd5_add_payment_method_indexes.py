@@ -0,0 +1,46 @@
+"""add payment method indexes
+
+Revision ID: 38de75c0ddd5
+Revises: 8bf01334b29c
+Create Date: 2026-10-17 03:55:52.087800
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '38de75c0ddd5'
+down_revision = '8bf01334b29c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Older data may have several defaults per user; keep the most recent one
+    # so the partial unique index below can be built.
+    op.execute(
+        "UPDATE payment_method SET is_default = false "
+        "WHERE is_default AND id NOT IN ("
+        "SELECT max(id) FROM payment_method WHERE is_default GROUP BY user_id)"
+    )
+
+    with op.batch_alter_table('payment_method', schema=None) as batch_op:
+        batch_op.create_index('ix_payment_method_user_id_type', ['user_id', 'type'], unique=False)
+        batch_op.create_index('ix_payment_method_user_id_is_default', ['user_id', 'is_default'], unique=False)
+        batch_op.create_index('ix_payment_method_name', ['name'], unique=False)
+        batch_op.create_index(
+            'uq_payment_method_default_per_user',
+            ['user_id'],
+            unique=True,
+            postgresql_where=sa.text('is_default'),
+            sqlite_where=sa.text('is_default'),
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('payment_method', schema=None) as batch_op:
+        batch_op.drop_index('uq_payment_method_default_per_user')
+        batch_op.drop_index('ix_payment_method_name')
+        batch_op.drop_index('ix_payment_method_user_id_is_default')
+        batch_op.drop_index('ix_payment_method_user_id_type')
@@ -0,0 +1,33 @@
+"""add payment stats indexes
+
+Revision ID: 5c7e2a91d4f3
+Revises: 1b989abbaf02
+Create Date: 2026-10-17 05:40:12.418230
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5c7e2a91d4f3'
+down_revision = '1b989abbaf02'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # GROUP BY type, is_default and GROUP BY expiry_year, expiry_month of the
+    # stats endpoint are read from these indexes
+    with op.batch_alter_table('payment_method', schema=None) as batch_op:
+        batch_op.create_index('ix_payment_method_type_is_default', ['type', 'is_default'], unique=False)
+
+    with op.batch_alter_table('credit_card', schema=None) as batch_op:
+        batch_op.create_index('ix_credit_card_expiry', ['expiry_year', 'expiry_month'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('credit_card', schema=None) as batch_op:
+        batch_op.drop_index('ix_credit_card_expiry')
+
+    with op.batch_alter_table('payment_method', schema=None) as batch_op:
+        batch_op.drop_index('ix_payment_method_type_is_default')
@@ -0,0 +1,58 @@
+"""create payment method tables
+
+Revision ID: 8bf01334b29c
+Revises:
+Create Date: 2026-10-17 03:55:49.986892
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8bf01334b29c'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases bootstrapped by the old db.create_all() at boot already have
+    # these tables; adopt them as they are instead of failing.
+    if sa.inspect(op.get_bind()).has_table('payment_method'):
+        return
+
+    op.create_table('payment_method',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('name', sa.String(length=63), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('type', sa.Enum('UNKNOWN', 'CREDIT_CARD', 'PAYPAL', name='paymentmethodtype'), nullable=False),
+    sa.Column('is_default', sa.Boolean(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('credit_card',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('first_name', sa.String(length=32), nullable=False),
+    sa.Column('last_name', sa.String(length=32), nullable=False),
+    sa.Column('card_number', sa.String(length=16), nullable=False),
+    sa.Column('expiry_month', sa.Integer(), nullable=False),
+    sa.Column('expiry_year', sa.Integer(), nullable=False),
+    sa.Column('security_code', sa.String(length=3), nullable=False),
+    sa.Column('billing_address', sa.Text(), nullable=False),
+    sa.Column('zip_code', sa.String(length=5), nullable=False),
+    sa.ForeignKeyConstraint(['id'], ['payment_method.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('pay_pal',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('email', sa.String(), nullable=False),
+    sa.ForeignKeyConstraint(['id'], ['payment_method.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('pay_pal')
+    op.drop_table('credit_card')
+    op.drop_table('payment_method')
+    sa.Enum(name='paymentmethodtype').drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,26 @@
+"""add payment method version
+
+Revision ID: 93d0e893791f
+Revises: 38de75c0ddd5
+Create Date: 2026-10-17 04:10:34.445227
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '93d0e893791f'
+down_revision = '38de75c0ddd5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('payment_method', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('payment_method', schema=None) as batch_op:
+        batch_op.drop_column('version')
@@ -7,7 +7,9 @@ from .payment_method import (
     PaymentMethod,
     PaymentMethodType,
     DataValidationError,
+    DataConflictError,
     db,
 )
 from .credit_card import CreditCard
 from .paypal import PayPal
+from .validation import ValidationErrors, body_errors, error_message, validate
@@ -12,6 +12,7 @@ from .payment_method import (
     convert_str_to_payment_method_type_enum,
     db,
 )
+from .validation import CREDIT_CARD
 
 
 EXPIRY_MONTH_CONSTRAINTS = [1, 12]
@@ -47,7 +48,13 @@ class CreditCard(PaymentMethod):  # pylint: disable=too-many-instance-attributes
     billing_address = db.Column(db.Text, nullable=False)
     zip_code = db.Column(db.String(5), nullable=False)
 
-    __mapper_args__ = {"polymorphic_identity": PaymentMethodType.CREDIT_CARD}
+    # Backs the credit card expiry counts of PaymentMethod.stats(), created by
+    # the migrations in service/migrations
+    __table_args__ = (db.Index("ix_credit_card_expiry", expiry_year, expiry_month),)
+
+    # Load the subclass columns for a whole result set with one extra
+    # SELECT ... WHERE id IN (...) instead of one lazy SELECT per row
+    __mapper_args__ = {"polymorphic_identity": PaymentMethodType.CREDIT_CARD, "polymorphic_load": "selectin"}
 
     def serialize(self):
         """Serializes a CreditCard into a dictionary"""
@@ -103,77 +110,15 @@ class CreditCard(PaymentMethod):  # pylint: disable=too-many-instance-attributes
     # VALIDATIONS
     ##################################################
 
-    @validates("first_name")
-    def validate_first_name(self, _key, first_name):
-        """Validates `first_name` field"""
-        if is_not_str(first_name) or not first_name.isalpha():
-            raise DataValidationError("First name field must contain letters only")
-
-        return first_name
-
-    @validates("last_name")
-    def validate_last_name(self, _key, last_name):
-        """Validates `last_name` field"""
-        if is_not_str(last_name) or not last_name.isalpha():
-            raise DataValidationError("Last name field must contain letters only")
-
-        return last_name
-
-    @validates("card_number")
-    def validate_card_number(self, _key, card_number):
-        """Validates `card_number` field"""
-        if is_not_str(card_number) or not card_number.isdigit():
-            raise DataValidationError("Card number field must be numeric")
-
-        if not len(card_number) == 16:
-            raise DataValidationError("Card number field must be 16 digits")
-
-        return card_number
-
-    @validates("security_code")
-    def validate_security_code(self, _key, security_code):
-        """Validates `security_code` field"""
-        if is_not_str(security_code) or not security_code.isdigit():
-            raise DataValidationError("Security code field must be numeric")
-
-        if not len(security_code) == 3:
-            raise DataValidationError("Security code field must be 3 digits")
-
-        return security_code
-
-    @validates("expiry_year")
-    def validate_expiry_year(self, _key, expiry_year):
-        """Validates `expiry_year` field"""
-        if is_not_int(expiry_year) or expiry_year < 2024 or expiry_year > 2050:
-            raise DataValidationError("Expiry year field is invalid")
-
-        return expiry_year
-
-    @validates("expiry_month")
-    def validate_expiry_month(self, _key, expiry_month):
-        """Validates `expiry_month` field"""
-        if is_not_int(expiry_month) or expiry_month < 1 or expiry_month > 12:
-            raise DataValidationError("Expiry month field is invalid")
-
-        return expiry_month
-
-    @validates("zip_code")
-    def validate_zip_code(self, _key, zip_code):
-        """Validates `zip_code` field"""
-        if is_not_str(zip_code) or not zip_code.isdigit():
-            raise DataValidationError("ZIP code field must be numeric")
-
-        if not len(zip_code) == 5:
-            raise DataValidationError("ZIP code field must be 5 digits")
-
-        return zip_code
-
-
-def is_not_int(value):
-    """Returns whether value is not an int"""
-    return not isinstance(value, int)
-
-
-def is_not_str(value):
-    """Returns whether value is not a str"""
-    return not isinstance(value, str)
+    @validates(
+        "first_name",
+        "last_name",
+        "card_number",
+        "expiry_month",
+        "expiry_year",
+        "security_code",
+        "zip_code",
+    )
+    def validate_field(self, key, value):
+        """Validates a field with the same check as the whole body validation"""
+        return CREDIT_CARD.check(key, value)
@@ -5,9 +5,16 @@ All of the models are stored in this module
 """
 
 import logging
+import random
+import time
 from enum import Enum
 from abc import abstractmethod
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import Select, delete, func, insert, inspect, select, type_coerce, update
+from sqlalchemy.dialects.postgresql import ExcludeConstraint
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import defer, load_only, make_transient_to_detached
+from service.common.cache import get_cache
 
 logger = logging.getLogger("flask.app")
 
@@ -18,6 +25,15 @@ class DataValidationError(Exception):
     """Used for an data validation errors"""
 
 
+class DataConflictError(DataValidationError):
+    """Used when a change kept conflicting with concurrent changes of the same rows"""
+
+
+# SQLSTATEs of a transaction that lost to a concurrent one and can be run again
+RETRIED_SQLSTATES = {"40001", "40P01"}  # serialization_failure, deadlock_detected
+SET_DEFAULT_ATTEMPTS = 3
+
+
 class PaymentMethodType(Enum):
     """Enumeration of valid payment types"""
 
@@ -38,7 +54,51 @@ def convert_str_to_payment_method_type_enum(value):
     return None
 
 
-class PaymentMethod(db.Model):
+def cache_key(payment_method_id) -> str:
+    """Returns the cache key of a PaymentMethod id"""
+    return f"payment_method:{int(payment_method_id)}"
+
+
+# The columns an import does not take from the bodies
+GENERATED_COLUMNS = ("id", "type", "is_default", "version")
+
+
+def import_row(subclass, body) -> dict:
+    """Returns the column values of an imported body, keyed by attribute name"""
+    row = {
+        attr.key: body[attr.key]
+        for attr in inspect(subclass).column_attrs
+        if attr.key not in GENERATED_COLUMNS
+    }
+    row["type"] = PaymentMethodType(body["type"])
+    row["is_default"] = False
+    return row
+
+
+def copy_rows(by_class, count) -> None:
+    """Writes the bodies of each subclass with COPY, under ids taken from the id sequence"""
+    ids = db.session.scalars(
+        select(func.nextval(func.pg_get_serial_sequence("payment_method", "id"))).select_from(
+            func.generate_series(1, count)
+        )
+    ).all()
+    ids = iter(ids)
+    rows = {subclass: [(next(ids), body) for body in bodies] for subclass, bodies in by_class.items()}
+    connection = db.session.connection().connection.driver_connection
+    with connection.cursor() as cursor:
+        with cursor.copy("COPY payment_method (id, name, user_id, type, is_default) FROM STDIN") as copy:
+            for subclass_rows in rows.values():
+                for new_id, body in subclass_rows:
+                    copy.write_row((new_id, body["name"], body["user_id"], body["type"], False))
+        for subclass, subclass_rows in rows.items():
+            columns = [column.name for column in subclass.__table__.columns if column.name != "id"]
+            statement = f"COPY {subclass.__tablename__} (id, {', '.join(columns)}) FROM STDIN"
+            with cursor.copy(statement) as copy:
+                for new_id, body in subclass_rows:
+                    copy.write_row((new_id, *(body[column] for column in columns)))
+
+
+class PaymentMethod(db.Model):  # pylint: disable=too-many-public-methods
     """Class that represents Payment Method resource"""
 
     ##################################################
@@ -51,6 +111,33 @@ class PaymentMethod(db.Model):
     user_id = db.Column(db.Integer, nullable=False)
     type = db.Column(db.Enum(PaymentMethodType), nullable=False)
     is_default = db.Column(db.Boolean(), default=False, nullable=False)
+    # Bumped on every change to the row, used for ETags and optimistic locking
+    version = db.Column(db.Integer, nullable=False, server_default="1")
+
+    # Indexes backing the find_by_* filters and set_default_for_user(). These
+    # are created by the migrations in service/migrations, keep both in sync.
+    __table_args__ = (
+        db.Index("ix_payment_method_user_id_type", user_id, type),
+        db.Index("ix_payment_method_user_id_is_default", user_id, is_default),
+        db.Index("ix_payment_method_name", name),
+        db.Index("ix_payment_method_type_is_default", type, is_default),
+        # A user can have at most one default payment method. PostgreSQL checks
+        # it at commit, so set_default_for_user() can move it in one UPDATE.
+        ExcludeConstraint(
+            (user_id, "="),
+            name="ex_payment_method_default_per_user",
+            using="btree",
+            where=is_default,
+            deferrable=True,
+            initially="DEFERRED",
+        ).ddl_if(dialect="postgresql"),
+        db.Index(
+            "uq_payment_method_default_per_user",
+            user_id,
+            unique=True,
+            sqlite_where=is_default,
+        ).ddl_if(dialect="sqlite"),
+    )
 
     # https://docs.sqlalchemy.org/en/20/orm/inheritance.html
     #
@@ -59,6 +146,7 @@ class PaymentMethod(db.Model):
     __mapper_args__ = {
         "polymorphic_identity": PaymentMethodType.UNKNOWN,
         "polymorphic_on": type,
+        "version_id_col": version,
     }
 
     def __repr__(self):
@@ -87,6 +175,74 @@ class PaymentMethod(db.Model):
             logger.error("Error creating PaymentMethod record: %s", self)
             raise DataValidationError(e) from e
 
+    @classmethod
+    def create_batch(cls, payment_methods: list) -> None:
+        """
+        Creates many PaymentMethods in a single transaction
+
+        Each subclass is written with multi-row INSERT ... RETURNING statements
+        and the generated ids are assigned back to the given objects.
+        """
+        logger.info("Creating a batch of %d PaymentMethods", len(payment_methods))
+        by_class = {}
+        for payment_method in payment_methods:
+            by_class.setdefault(type(payment_method), []).append(payment_method)
+        try:
+            for subclass, methods in by_class.items():
+                for method in methods:
+                    method.is_default = bool(method.is_default)
+                rows = [method.to_row() for method in methods]
+                statement = insert(subclass).returning(
+                    subclass.id, subclass.version, sort_by_parameter_order=True
+                )
+                created = db.session.execute(statement, rows).all()
+                for method, (new_id, version) in zip(methods, created):
+                    method.id = new_id
+                    method.version = version
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error creating a batch of PaymentMethod records: %s", e)
+            raise DataValidationError(e) from e
+
+    @classmethod
+    def import_batch(cls, bodies: list, use_copy=None) -> None:
+        """
+        Creates PaymentMethods from valid bodies in a single transaction
+
+        No objects are built, so the bodies must have passed body_errors() first.
+        On PostgreSQL the ids are drawn from the id sequence in one statement and
+        the rows are streamed into payment_method and the subclass tables with
+        COPY, other databases get multi-row INSERTs.
+        """
+        logger.info("Importing a batch of %d PaymentMethods", len(bodies))
+        by_class = {}
+        for body in bodies:
+            subclass = cls.__mapper__.polymorphic_map[PaymentMethodType(body["type"])].class_
+            by_class.setdefault(subclass, []).append(body)
+        try:
+            if use_copy is None:
+                use_copy = db.session.get_bind().dialect.name == "postgresql"
+            if use_copy:
+                copy_rows(by_class, len(bodies))
+            else:
+                for subclass, rows in by_class.items():
+                    db.session.execute(insert(subclass), [import_row(subclass, body) for body in rows])
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error importing a batch of PaymentMethod records: %s", e)
+            raise DataValidationError(e) from e
+
+    def to_row(self) -> dict:
+        """Returns the column values that are set, keyed by attribute name"""
+        row = {}
+        for attr in inspect(type(self)).column_attrs:
+            value = getattr(self, attr.key)
+            if value is not None and attr.key != "id":
+                row[attr.key] = value
+        return row
+
     def update(self) -> None:
         """
         Updates a PaymentMethod to the database
@@ -100,6 +256,7 @@ class PaymentMethod(db.Model):
             db.session.rollback()
             logger.error("Error updating record: %s", self)
             raise DataValidationError(e) from e
+        get_cache().delete(cache_key(self.id))
 
     def delete(self) -> None:
         """Removes a PaymentMethod from the data store"""
@@ -111,17 +268,102 @@ class PaymentMethod(db.Model):
             db.session.rollback()
             logger.error("Error deleting PaymentMethod: %s", self)
             raise DataValidationError(e) from e
+        get_cache().delete(cache_key(self.id))
+
+    @classmethod
+    def delete_matching(cls, q) -> int:
+        """
+        Removes every PaymentMethod matched by a query with one DELETE statement
+
+        No objects are loaded; the credit_card and pay_pal rows are removed by
+        their ON DELETE CASCADE foreign keys. SQLite leaves foreign keys off,
+        so there they are deleted first. Returns the number of rows deleted.
+        """
+        logger.info("Deleting PaymentMethods matching %s", q.whereclause)
+        statement = delete(cls).where(q.whereclause).returning(cls.id)
+        try:
+            if db.session.get_bind().dialect.name != "postgresql":
+                matching = select(cls.id).where(q.whereclause)
+                for mapper in cls.__mapper__.self_and_descendants:
+                    table = mapper.local_table
+                    if table is not cls.__table__:
+                        db.session.execute(delete(table).where(table.c.id.in_(matching)))
+            ids = db.session.scalars(
+                statement, execution_options={"synchronize_session": False}
+            ).all()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error deleting PaymentMethods: %s", e)
+            raise DataValidationError(e) from e
+        for deleted_id in ids:
+            get_cache().delete(cache_key(deleted_id))
+        return len(ids)
 
     def set_default_for_user(self):
         """
         Set a payment method as default for the user and unset others.
-        """
-        PaymentMethod.query.filter(
-            PaymentMethod.user_id == self.user_id, PaymentMethod.id != self.id
-        ).update({"is_default": False})
 
-        self.is_default = True
-        self.update()
+        The PaymentMethods of the user are locked in id order before one UPDATE
+        flips is_default on the rows where it changes, so concurrent calls for
+        the same user wait for each other instead of deadlocking, and the last
+        one wins. Only those rows get a new version and leave the cache. A
+        transaction the database still aborts as a deadlock or serialization
+        failure is retried, and DataConflictError is raised if it never succeeds.
+        """
+        logger.info("Setting %s as the default of user %s", self, self.user_id)
+        payment_method_id, user_id = self.id, self.user_id
+        for attempt in range(1, SET_DEFAULT_ATTEMPTS + 1):
+            try:
+                ids = self._set_default(payment_method_id, user_id)
+                db.session.commit()
+                break
+            except DBAPIError as e:
+                db.session.rollback()
+                if getattr(e.orig, "sqlstate", None) not in RETRIED_SQLSTATES:
+                    logger.error("Error setting the default PaymentMethod: %s", payment_method_id)
+                    raise DataValidationError(e) from e
+                if attempt == SET_DEFAULT_ATTEMPTS:
+                    logger.error("Gave up setting the default PaymentMethod: %s", payment_method_id)
+                    raise DataConflictError(
+                        f"PaymentMethod {payment_method_id} conflicted with concurrent changes, try again"
+                    ) from e
+                logger.warning("Retrying the default PaymentMethod %s: %s", payment_method_id, e.orig)
+                time.sleep(random.uniform(0, 0.01 * attempt))
+            except Exception as e:
+                db.session.rollback()
+                logger.error("Error setting the default PaymentMethod: %s", payment_method_id)
+                raise DataValidationError(e) from e
+        for changed_id in ids:
+            get_cache().delete(cache_key(changed_id))
+
+    @staticmethod
+    def _set_default(payment_method_id, user_id):
+        """Makes one PaymentMethod the default of a user, returns the ids of the rows whose is_default changed"""
+        db.session.execute(
+            select(PaymentMethod.id)
+            .where(PaymentMethod.user_id == user_id)
+            .order_by(PaymentMethod.id)
+            .with_for_update()
+        )
+        is_target = PaymentMethod.id == payment_method_id
+        user_methods = update(PaymentMethod).where(PaymentMethod.user_id == user_id)
+        options = {"synchronize_session": False}
+        changed = []
+        if db.session.get_bind().dialect.name != "postgresql":
+            # the unique index is checked row by row, clear the old default first
+            changed = db.session.scalars(
+                user_methods.where(PaymentMethod.is_default, ~is_target)
+                .values(is_default=False, version=PaymentMethod.version + 1)
+                .returning(PaymentMethod.id),
+                execution_options=options,
+            ).all()
+        statement = (
+            user_methods.where(PaymentMethod.is_default != is_target)
+            .values(is_default=is_target, version=PaymentMethod.version + 1)
+            .returning(PaymentMethod.id)
+        )
+        return changed + db.session.scalars(statement, execution_options=options).all()
 
     ##################################################
     # CLASS METHODS
@@ -135,11 +377,90 @@ class PaymentMethod(db.Model):
         return cls.query.all()
 
     @classmethod
-    def find(cls, by_id):
-        """Finds PaymentMethod by its ID"""
+    def find(cls, by_id, cached=True):
+        """Finds PaymentMethod by its ID, reading through the cache
+
+        A cached PaymentMethod may be behind changes made outside this service
+        for up to CACHE_TTL seconds, so one that is about to be changed or
+        deleted is found with cached=False, which reads the row itself.
+        """
         logger.info("Processing lookup for id %s ...", by_id)
+        try:
+            key = cache_key(by_id)
+        except ValueError:
+            return None
+        cached = get_cache().get(key) if cached else None
+        if cached is not None:
+            payment_method = cls.from_cache(cached)
+            if payment_method is not None:
+                return payment_method
         # pylint: disable=no-member
-        return cls.query.session.get(cls, by_id)
+        payment_method = cls.query.session.get(cls, by_id)
+        if payment_method is not None:
+            get_cache().set(key, payment_method.to_cache())
+        return payment_method
+
+    @classmethod
+    def find_default_for_user(cls, user_id):
+        """Returns the default PaymentMethod of a user, or None
+
+        The one default per user constraint indexes user_id where is_default,
+        so the row is found with one index probe however many PaymentMethods the
+        user has. It is read with the columns of every type by flat_select(), in
+        the same single SELECT, and built like a PaymentMethod from the cache.
+        """
+        logger.info("Processing default lookup for user %s ...", user_id)
+        statement = (
+            cls.flat_select()
+            .add_columns(cls.__table__.c.version)
+            .where(cls.user_id == user_id, cls.is_default)
+        )
+        row = db.session.execute(statement).mappings().first()
+        if row is None:
+            return None
+        subclass = cls.__mapper__.polymorphic_map[PaymentMethodType(row["type"])].class_
+        data = {attr.key: row[attr.key] for attr in inspect(subclass).column_attrs}
+        payment_method = cls.from_cache(data)
+        get_cache().set(cache_key(payment_method.id), payment_method.to_cache())
+        return payment_method
+
+    def to_cache(self) -> dict:
+        """Returns the column values of a PaymentMethod as plain JSON types"""
+        data = self.to_row()
+        data["id"] = self.id
+        data["type"] = self.type.value
+        return data
+
+    @classmethod
+    def from_cache(cls, data: dict):
+        """Attaches a PaymentMethod built from cached values to the session
+
+        The object is merged without loading, so no SELECT is issued and later
+        changes to it are flushed to the database as usual.
+        """
+        payment_method = cls.detached_from_cache(data)
+        if payment_method is None:
+            return None
+        # an object already in the session may hold changes, keep it as it is
+        key = db.session.identity_key(type(payment_method), data["id"])
+        loaded = db.session.identity_map.get(key)
+        if loaded is not None:
+            return loaded
+        return db.session.merge(payment_method, load=False)
+
+    @classmethod
+    def detached_from_cache(cls, data: dict):
+        """Builds a detached PaymentMethod from cached values
+
+        Returns None if the cached PaymentMethod is not an instance of cls.
+        """
+        payment_type = PaymentMethodType(data["type"])
+        subclass = cls.__mapper__.polymorphic_map[payment_type].class_
+        if not issubclass(subclass, cls):
+            return None
+        payment_method = subclass(**{**data, "type": payment_type})
+        make_transient_to_detached(payment_method)
+        return payment_method
 
     @classmethod
     def find_by_name(cls, name, q=None):
@@ -176,3 +497,135 @@ class PaymentMethod(db.Model):
         if q is None:
             q = cls.query
         return q.filter(cls.user_id == user_id)
+
+    @classmethod
+    def find_page(cls, limit, after_id=None, q=None):
+        """Returns at most `limit` PaymentMethods ordered by id (keyset pagination)
+
+        Args:
+            limit (int): the maximum number of PaymentMethods to return
+            after_id (int): only return PaymentMethods with an id greater than this one
+        """
+        logger.info("Processing page query of %s after id %s ...", limit, after_id)
+        if q is None:
+            q = cls.query
+        if after_id is not None:
+            q = q.filter(cls.id > after_id)
+        return q.order_by(cls.id).limit(limit)
+
+    @classmethod
+    def stats(cls, q, top_users=10) -> dict:
+        """Returns counts of the PaymentMethods matched by a query, computed in SQL
+
+        The counts by type and by default status come from one GROUP BY type,
+        is_default; the users with the most PaymentMethods from a GROUP BY user_id
+        and the credit cards by expiry from a GROUP BY expiry_year, expiry_month.
+
+        Args:
+            q (Query): the filtered query of the PaymentMethods to count
+            top_users (int): the number of users with the most PaymentMethods to return
+        """
+        logger.info("Processing stats query of the top %s users ...", top_users)
+        credit_card = cls.__mapper__.polymorphic_map[PaymentMethodType.CREDIT_CARD].class_
+        criteria = [] if q.whereclause is None else [q.whereclause]
+        count = func.count().label("count")  # pylint: disable=not-callable
+        by_type = {payment_type.value: 0 for payment_type in PaymentMethodType}
+        del by_type[PaymentMethodType.UNKNOWN.value]
+        by_default = {"default": 0, "not_default": 0}
+        grouped = select(cls.type, cls.is_default, count).where(*criteria).group_by(cls.type, cls.is_default)
+        for payment_type, is_default, number in db.session.execute(grouped):
+            by_type[payment_type.value] = by_type.get(payment_type.value, 0) + number
+            by_default["default" if is_default else "not_default"] += number
+
+        top = (
+            select(cls.user_id, count)
+            .where(*criteria)
+            .group_by(cls.user_id)
+            .order_by(count.desc(), cls.user_id)
+            .limit(top_users)
+        )
+        # without filters the credit_card table is counted on its own, from its index
+        cards = credit_card if criteria else credit_card.__table__
+        expiry = (
+            select(credit_card.expiry_year, credit_card.expiry_month, count)
+            .select_from(cards)
+            .where(*criteria)
+            .group_by(credit_card.expiry_year, credit_card.expiry_month)
+            .order_by(credit_card.expiry_year, credit_card.expiry_month)
+        )
+        return {
+            "total": sum(by_default.values()),
+            "by_type": by_type,
+            "by_default": by_default,
+            "top_users": [row._asdict() for row in db.session.execute(top)],
+            "credit_card_expiry": [row._asdict() for row in db.session.execute(expiry)],
+        }
+
+    @classmethod
+    def flat_select(cls) -> Select:
+        """Returns a SELECT of every PaymentMethod as one row of plain columns
+
+        The table of each subclass is outer joined by id, so every row has the
+        columns of all the PaymentMethodTypes, NULL in those of the other types.
+        The version is left out, as in serialize(), and the type is read as its name.
+        """
+        table = cls.__table__
+        columns = [
+            type_coerce(column, db.String).label("type") if column.key == "type" else column
+            for column in table.columns
+            if column.key != "version"
+        ]
+        joined = table
+        for mapper in cls.__mapper__.self_and_descendants:
+            if mapper.local_table is not table:
+                subclass_table = mapper.local_table
+                joined = joined.outerjoin(subclass_table, subclass_table.c.id == table.c.id)
+                columns += [column for column in subclass_table.columns if column.key != "id"]
+        return select(*columns).select_from(joined)
+
+    @classmethod
+    def load_fields(cls, q, names):
+        """Returns the query q loading only the named attributes of the PaymentMethods
+
+        The id, type and version are always loaded, for the cursor, the subclass
+        and the ETag of each row. When every name is a column of payment_method the
+        query returns rows of those columns, without reading the credit_card and
+        pay_pal tables at all. Otherwise it returns PaymentMethods with the other
+        columns of every table deferred.
+
+        Args:
+            q (Query or Select): the query of the PaymentMethods
+            names (iterable): the attribute names to load
+        """
+        names = set(names) | {"id", "type", "version"}
+        mapper = inspect(cls)
+        base = [getattr(cls, attr.key) for attr in mapper.column_attrs if attr.key in names]
+        if len(base) == len(names):
+            logger.info("Processing query of the columns %s ...", sorted(names))
+            if isinstance(q, Select):
+                return q.with_only_columns(*base)
+            return q.with_entities(*base)
+
+        deferred = [
+            defer(getattr(subclass.class_, attr.key))
+            for subclass in mapper.self_and_descendants
+            if subclass is not mapper
+            for attr in subclass.column_attrs
+            if attr.key not in names and attr.columns[0].table is subclass.local_table
+        ]
+        return q.options(load_only(*base), *deferred)
+
+    @classmethod
+    def stream(cls, batch_size, limit=None, after_id=None, q=None):
+        """Returns an iterator over PaymentMethods ordered by id (keyset pagination)
+
+        Rows are fetched `batch_size` at a time from a server-side cursor, so only
+        one batch is held in memory however many PaymentMethods match.
+
+        Args:
+            batch_size (int): the number of rows to fetch at a time
+            limit (int): the maximum number of PaymentMethods to return, or None for all
+            after_id (int): only return PaymentMethods with an id greater than this one
+        """
+        logger.info("Processing streamed query in batches of %s ...", batch_size)
+        return cls.find_page(limit, after_id, q).yield_per(batch_size)
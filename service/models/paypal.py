@@ -2,7 +2,6 @@
 Model for PayPal
 """
 
-import re
 from sqlalchemy.orm import validates
 from .payment_method import (
     PaymentMethod,
@@ -11,6 +10,7 @@ from .payment_method import (
     convert_str_to_payment_method_type_enum,
     db,
 )
+from .validation import PAYPAL
 
 
 class PayPal(PaymentMethod):
@@ -29,7 +29,9 @@ class PayPal(PaymentMethod):
     )
     email = db.Column(db.String, nullable=False)
 
-    __mapper_args__ = {"polymorphic_identity": PaymentMethodType.PAYPAL}
+    # Load the subclass columns for a whole result set with one extra
+    # SELECT ... WHERE id IN (...) instead of one lazy SELECT per row
+    __mapper_args__ = {"polymorphic_identity": PaymentMethodType.PAYPAL, "polymorphic_load": "selectin"}
 
     def serialize(self):
         """Serializes a PayPal into a dictionary"""
@@ -71,16 +73,6 @@ class PayPal(PaymentMethod):
     ##################################################
 
     @validates("email")
-    def validate_email(self, _key, email):
+    def validate_email(self, key, email):
         """Validates `email` field"""
-        if not is_valid_email(email):
-            raise DataValidationError("Email field is invalid")
-        return email
-
-
-def is_valid_email(email):
-    """Checks whether its valid email"""
-    return (
-        re.match(r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b", email)
-        is not None
-    )
+        return PAYPAL.check(key, email)
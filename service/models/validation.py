@@ -0,0 +1,160 @@
+"""
+Validation of PaymentMethod bodies
+
+The rules of each PaymentMethodType are compiled once into a Schema, a tuple
+of (field, check) pairs. A check returns the error of a value or None.
+validate() runs every check of a body in one pass and reports all of its field
+errors at once, body_errors() does the same without raising for the bodies of
+a batch. The @validates hooks of the models run the same checks one field at a
+time, so a PaymentMethod built in code is held to the same rules.
+"""
+
+import re
+from .payment_method import DataValidationError, PaymentMethodType
+
+EMAIL_PATTERN = re.compile(r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b")
+
+
+class ValidationErrors(DataValidationError):
+    """The errors of every invalid field of a body, keyed by field name"""
+
+    def __init__(self, errors):
+        super().__init__(error_message(errors))
+        self.errors = errors
+
+
+def error_message(errors):
+    """Returns the errors of a body as one message"""
+    return "; ".join(errors.values())
+
+
+######################################################################
+# Checks
+######################################################################
+def is_int(value):
+    """Returns whether value is an int, bools are not"""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def text(max_length, message):
+    """Checks for a string of at most max_length characters, of any length for None"""
+    if max_length is None:
+        return lambda value: None if isinstance(value, str) else message
+    return lambda value: None if isinstance(value, str) and len(value) <= max_length else message
+
+
+def letters(max_length, message):
+    """Checks for a string of 1 to max_length letters"""
+    return lambda value: (
+        None if isinstance(value, str) and value.isalpha() and len(value) <= max_length else message
+    )
+
+
+def digits(length, label):
+    """Checks for a string of exactly length digits"""
+
+    def check(value):
+        if not isinstance(value, str) or not value.isdigit():
+            return f"{label} field must be numeric"
+        if len(value) != length:
+            return f"{label} field must be {length} digits"
+        return None
+
+    return check
+
+
+def integer(low, high, message):
+    """Checks for an int from low to high"""
+    return lambda value: None if is_int(value) and low <= value <= high else message
+
+
+def matches(pattern, message):
+    """Checks for a string the compiled pattern matches"""
+    return lambda value: None if isinstance(value, str) and pattern.match(value) else message
+
+
+######################################################################
+# Schemas
+######################################################################
+class Schema:
+    """The compiled checks of the body of one PaymentMethodType"""
+
+    def __init__(self, payment_method_type, checks):
+        self.type = payment_method_type
+        self.checks = tuple(checks.items())
+        self.by_field = checks
+
+    def errors(self, body):
+        """Returns the error of every missing or invalid field of a body"""
+        errors = {}
+        for field, check in self.checks:
+            if field not in body:
+                errors[field] = f"{field} is required"
+                continue
+            message = check(body[field])
+            if message is not None:
+                errors[field] = message
+        return errors
+
+    def check(self, field, value):
+        """Returns a value of one field, raises DataValidationError if it is invalid"""
+        message = self.by_field[field](value)
+        if message is not None:
+            raise DataValidationError(message)
+        return value
+
+
+PAYMENT_METHOD_CHECKS = {
+    "name": text(63, "Name field must be a string of at most 63 characters"),
+    "type": lambda value: None,  # chooses the schema, so it is known to be valid
+    "user_id": integer(-(2**31), 2**31 - 1, "User id field must be an integer"),
+}
+
+CREDIT_CARD = Schema(
+    PaymentMethodType.CREDIT_CARD,
+    {
+        **PAYMENT_METHOD_CHECKS,
+        "first_name": letters(32, "First name field must contain letters only"),
+        "last_name": letters(32, "Last name field must contain letters only"),
+        "card_number": digits(16, "Card number"),
+        "expiry_month": integer(1, 12, "Expiry month field is invalid"),
+        "expiry_year": integer(2024, 2050, "Expiry year field is invalid"),
+        "security_code": digits(3, "Security code"),
+        "billing_address": text(None, "Billing address field must be a string"),
+        "zip_code": digits(5, "ZIP code"),
+    },
+)
+
+PAYPAL = Schema(
+    PaymentMethodType.PAYPAL,
+    {
+        **PAYMENT_METHOD_CHECKS,
+        "email": matches(EMAIL_PATTERN, "Email field is invalid"),
+    },
+)
+
+SCHEMAS = {schema.type.value: schema for schema in (CREDIT_CARD, PAYPAL)}
+
+
+def body_errors(body, payment_method_type=None):
+    """Returns the errors of a PaymentMethod body, an empty dict if it is valid
+
+    An update passes the type of the stored PaymentMethod, which cannot change.
+    """
+    if not isinstance(body, dict):
+        return {"body": "Body must be a JSON object"}
+    if payment_method_type is not None and body.get("type") != payment_method_type.value:
+        return {"type": f"Type field must be {payment_method_type.value}"}
+    type_name = body.get("type")
+    schema = SCHEMAS.get(type_name) if isinstance(type_name, str) else None
+    if schema is None:
+        return {"type": "PaymentMethod must have a type"}
+    return schema.errors(body)
+
+
+def validate(body, payment_method_type=None):
+    """Returns a valid PaymentMethod body, raises ValidationErrors with all of its errors"""
+    errors = body_errors(body, payment_method_type)
+    if errors:
+        raise ValidationErrors(errors)
+    return body
@@ -22,12 +22,29 @@ and Delete Payments from the inventory of payments in the PaymentShop
 
 """
 # pylint: disable=redefined-builtin, cyclic-import
+import base64
+import binascii
+import functools
+import hashlib
 import secrets
-from flask import jsonify, request, abort
+from flask import jsonify, request, abort, stream_with_context
 from flask import current_app as app  # Import Flask application
 from flask_restx import Resource, fields, reqparse
-from service.common import status  # HTTP Status Codes
-from service.models import PaymentMethod, PaymentMethodType, CreditCard, PayPal
+from flask_restx.utils import unpack
+from werkzeug.http import quote_etag
+from service.common import metrics, status  # HTTP Status Codes
+from service.common.cache import get_cache, get_stats_cache
+from service.common.pool import get_pool_stats
+from service.common.serializer import ModelSerializer
+from service.models import (
+    PaymentMethod,
+    PaymentMethodType,
+    CreditCard,
+    PayPal,
+    body_errors,
+    error_message,
+    validate,
+)
 from . import api
 
 
@@ -88,20 +105,128 @@ payment_method_model = api.inherit(
     },
 )
 
+batch_result_model = api.model(
+    "BatchResultModel",
+    {
+        "index": fields.Integer(
+            description="The position of the PaymentMethod in the posted list"
+        ),
+        "status": fields.Integer(
+            description="The HTTP status code for this PaymentMethod (201 or 400)"
+        ),
+        "data": fields.Nested(
+            payment_method_model,
+            skip_none=True,
+            allow_null=True,
+            description="The created PaymentMethod",
+        ),
+        "error": fields.String(
+            description="Why this PaymentMethod was not created"
+        ),
+        "errors": fields.Raw(
+            description="The error of each invalid field, keyed by field name"
+        ),
+    },
+)
+
+delete_result_model = api.model(
+    "DeleteResultModel",
+    {
+        "deleted": fields.Integer(
+            description="The number of PaymentMethods that were deleted"
+        ),
+    },
+)
+
+top_user_model = api.model(
+    "TopUserModel",
+    {
+        "user_id": fields.Integer(description="The id of the user"),
+        "count": fields.Integer(description="The number of PaymentMethods of the user"),
+    },
+)
+
+expiry_count_model = api.model(
+    "ExpiryCountModel",
+    {
+        "expiry_year": fields.Integer(description="The year the credit cards expire"),
+        "expiry_month": fields.Integer(description="The month the credit cards expire"),
+        "count": fields.Integer(description="The number of credit cards expiring then"),
+    },
+)
+
+stats_model = api.model(
+    "PaymentStatsModel",
+    {
+        "total": fields.Integer(description="The number of matching PaymentMethods"),
+        "by_type": fields.Raw(description="The number of PaymentMethods of each type"),
+        "by_default": fields.Raw(
+            description="The number of default and not default PaymentMethods"
+        ),
+        "top_users": fields.List(
+            fields.Nested(top_user_model),
+            description="The users with the most PaymentMethods, most first",
+        ),
+        "credit_card_expiry": fields.List(
+            fields.Nested(expiry_count_model),
+            description="The number of credit cards by expiry year and month",
+        ),
+    },
+)
+
+# Writes PaymentMethods straight to JSON in the format of payment_method_model
+payment_method_json = ModelSerializer(payment_method_model)
+
+# Media type of the streamed list of PaymentMethods
+NDJSON = "application/x-ndjson"
+# Largest LIMIT the database takes, a bigint
+MAX_SQL_LIMIT = 2**63 - 1
+
 # query string arguments
-payment_args = reqparse.RequestParser()
+filter_args = reqparse.RequestParser()
+filter_args.add_argument(
+    "name", type=str, location="args", required=False, help="Filter Payments by name"
+)
+filter_args.add_argument(
+    "type", type=str, location="args", required=False, help="Filter Payments by type"
+)
+filter_args.add_argument(
+    "user_id",
+    type=str,
+    location="args",
+    required=False,
+    help="Filter Payments by user_id",
+)
+payment_args = filter_args.copy()
 payment_args.add_argument(
-    "name", type=str, location="args", required=False, help="List Payments by name"
+    "limit",
+    type=int,
+    location="args",
+    required=False,
+    help="Maximum number of Payments to return in one page",
 )
 payment_args.add_argument(
-    "type", type=str, location="args", required=False, help="List Payments by type"
+    "cursor",
+    type=str,
+    location="args",
+    required=False,
+    help="Opaque cursor of the next page, as returned by a previous list call",
 )
 payment_args.add_argument(
-    "user_id",
+    "fields",
     type=str,
     location="args",
     required=False,
-    help="List Payments by user_id",
+    help="Comma separated fields to return, e.g. id,name,type,is_default",
+)
+
+stats_args = filter_args.copy()
+stats_args.add_argument(
+    "top",
+    type=int,
+    location="args",
+    required=False,
+    help="Number of users with the most Payments to return",
 )
 
 
@@ -122,6 +247,63 @@ def get_health():
     return jsonify(status="OK"), status.HTTP_200_OK
 
 
+######################################################################
+# GET CACHE STATISTICS
+######################################################################
+@app.route("/cache/stats")
+def get_cache_stats():
+    """Returns the counters of the PaymentMethod cache"""
+    return jsonify(get_cache().stats()), status.HTTP_200_OK
+
+
+######################################################################
+# GET CONNECTION POOL STATISTICS
+######################################################################
+@app.route("/db/pool/stats")
+def get_pool_statistics():
+    """Returns the state and counters of the database connection pools"""
+    return jsonify(get_pool_stats(app)), status.HTTP_200_OK
+
+
+######################################################################
+# GET PROMETHEUS METRICS
+######################################################################
+@app.route("/metrics")
+def get_metrics():
+    """Returns the service metrics in the Prometheus text format"""
+    data, content_type = metrics.latest()
+    return data, status.HTTP_200_OK, {"Content-Type": content_type}
+
+
+######################################################################
+# Serialize a response like marshal_with
+######################################################################
+def serialize_with(serializer, code=status.HTTP_200_OK):
+    """Documents a response as marshal_with does, but writes it with a ModelSerializer
+
+    The handler returns the ORM object itself, which is written to JSON without
+    building a dictionary for it. An X-Fields mask is honoured like marshal_with.
+    """
+
+    def decorator(func):
+        # marshal_with documents the response and the X-Fields header on func
+        api.marshal_with(serializer.model, skip_none=True, code=code)(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            data, code_, headers = unpack(func(*args, **kwargs), code)
+            if code_ == status.HTTP_304_NOT_MODIFIED:
+                return app.response_class(status=code_, headers=headers)
+            mask = request.headers.get(app.config["RESTX_MASK_HEADER"])
+            if mask:
+                data = serializer.masked(data, mask)
+            return serializer.response(data, code_, headers)
+
+        return wrapper
+
+    return decorator
+
+
 ######################################################################
 #  R E S T   A P I   E N D P O I N T S
 ######################################################################
@@ -146,8 +328,9 @@ class PaymentResource(Resource):
     # GET A PAYMENT METHOD
     ######################################################################
     @api.doc("get_payments")
+    @api.response(304, "PaymentMethod not modified since the If-None-Match ETag")
     @api.response(404, "PaymentMethod not found")
-    @api.marshal_with(payment_method_model, skip_none=True)
+    @serialize_with(payment_method_json)
     def get(self, payment_method_id):
         """
         Retrieve a single PaymentMethod
@@ -162,8 +345,13 @@ class PaymentResource(Resource):
                 status.HTTP_404_NOT_FOUND,
                 f"PaymentMethod with id '{payment_method_id}' was not found.",
             )
+        etag = payment_method_etag(payment_method)
+        headers = {"ETag": quote_etag(etag)}
+        if request.if_none_match.contains_weak(etag):
+            app.logger.info("PaymentMethod %s not modified", payment_method_id)
+            return None, status.HTTP_304_NOT_MODIFIED, headers
         app.logger.info("Returning PaymentMethod: %s", payment_method.name)
-        return payment_method.serialize(), status.HTTP_200_OK
+        return payment_method, status.HTTP_200_OK, headers
 
     ######################################################################
     # UPDATE AN EXISTING PAYMENT METHOD
@@ -172,7 +360,7 @@ class PaymentResource(Resource):
     @api.response(404, "PaymentMethod not found")
     @api.response(400, "The posted PaymentMethod data was not valid")
     @api.expect(payment_method_model)
-    @api.marshal_with(payment_method_model, skip_none=True)
+    @serialize_with(payment_method_json)
     def put(self, payment_method_id):
         """
         Update a PaymentMethod
@@ -184,19 +372,20 @@ class PaymentResource(Resource):
         )
         check_content_type("application/json")
 
-        payment = PaymentMethod.find(payment_method_id)
+        payment = PaymentMethod.find(payment_method_id, cached=False)
         if not payment:
             error(
                 status.HTTP_404_NOT_FOUND,
                 f"PaymentMethod with id: '{payment_method_id}' was not found.",
             )
 
-        payment.deserialize(request.get_json())
+        payment.deserialize(validate(request.get_json(), payment.type))
         payment.id = payment_method_id
         payment.update()
 
         app.logger.info("PaymentMethod with ID: %d updated.", payment.id)
-        return payment.serialize(), status.HTTP_200_OK
+        headers = {"ETag": quote_etag(payment_method_etag(payment))}
+        return payment, status.HTTP_200_OK, headers
 
     ######################################################################
     # DELETE A PAYMENT METHOD
@@ -211,7 +400,7 @@ class PaymentResource(Resource):
         """
         app.logger.info(f"Request to delete payment with id: {payment_method_id}")
 
-        payment_method = PaymentMethod.find(payment_method_id)
+        payment_method = PaymentMethod.find(payment_method_id, cached=False)
         if payment_method:
             payment_method.delete()
 
@@ -229,29 +418,87 @@ class PaymentCollection(Resource):
     ######################################################################
     # LIST PAYMENT METHODS
     ######################################################################
-    @api.doc("list_payments")
+    @api.doc(
+        "list_payments",
+        produces=["application/json", NDJSON],
+        params={"X-Fields": {"in": "header", "type": "string", "format": "mask", "description": "An optional fields mask"}},
+    )
+    @api.response(200, "Success", [payment_method_model])
+    @api.response(304, "PaymentMethods not modified since the If-None-Match ETag")
     @api.expect(payment_args, validate=True)
-    @api.marshal_list_with(payment_method_model, skip_none=True)
     def get(self):
-        """Returns all of the PaymentMethods"""
+        """
+        Returns all of the PaymentMethods
+
+        With `Accept: application/x-ndjson` every matching PaymentMethod is streamed,
+        one JSON object per line, instead of returning a single page.
+        With `fields=id,name,type,is_default` only those fields are read and returned.
+        """
         app.logger.info("Request for payment method list")
 
         # See if any query filters were passed in
         args = payment_args.parse_args()
-        name = args["name"]
-        payment_type = args["type"]
-        user_id = args["user_id"]
-        q = PaymentMethod.query
-        if name:
-            q = PaymentMethod.find_by_name(name, q)
-        if payment_type:
-            q = PaymentMethod.find_by_type(payment_type.upper(), q)
-        if user_id:
-            q = PaymentMethod.find_by_user_id(int(user_id), q)
-
-        results = [payment_method.serialize() for payment_method in q.all()]
-        app.logger.info("Returning %d payment methods", len(results))
-        return results, status.HTTP_200_OK
+        field_names = parse_fields(args["fields"])
+        q, serializer = select_fields(filter_payment_methods(args), field_names)
+        after_id = decode_cursor(args["cursor"]) if args["cursor"] else None
+        mask = request.headers.get(app.config["RESTX_MASK_HEADER"])
+
+        if request.accept_mimetypes.best_match(["application/json", NDJSON]) == NDJSON:
+            limit = get_page_limit(args["limit"], streamed=True)
+            rows = PaymentMethod.stream(app.config["STREAM_BATCH_SIZE"], limit, after_id, q)
+            app.logger.info("Streaming payment methods")
+            return app.response_class(
+                stream_with_context(ndjson_lines(rows, serializer, mask)), mimetype=NDJSON
+            )
+
+        # Fetch one extra row to learn whether there is a next page
+        limit = get_page_limit(args["limit"])
+        rows = PaymentMethod.find_page(limit + 1, after_id, q).all()
+
+        headers = {}
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1].id)
+            query = {key: value for key, value in args.items() if value is not None}
+            query.update(limit=limit, cursor=next_cursor)
+            next_url = api.url_for(PaymentCollection, _external=True, **query)
+            headers = {"Link": f'<{next_url}>; rel="next"', "X-Next-Cursor": next_cursor}
+
+        # The page is unchanged if the same rows are at the same versions
+        etag = list_etag(rows, headers.get("X-Next-Cursor"), field_names)
+        headers["ETag"] = quote_etag(etag)
+        if request.if_none_match.contains_weak(etag):
+            app.logger.info("Payment method list not modified")
+            return [], status.HTTP_304_NOT_MODIFIED, headers
+
+        app.logger.info("Returning %d payment methods", len(rows))
+        # an X-Fields mask is honoured like marshal_list_with
+        data = serializer.masked(rows, mask) if mask else rows
+        return serializer.response(data, status.HTTP_200_OK, headers)
+
+    ######################################################################
+    # DELETE ALL PAYMENT METHODS MATCHING A FILTER
+    ######################################################################
+    @api.doc("delete_payments_by_filter", security="apikey")
+    @api.expect(filter_args, validate=True)
+    @api.response(400, "No filter was given")
+    @api.marshal_with(delete_result_model)
+    def delete(self):
+        """
+        Delete all Payment Methods matching a filter
+
+        This endpoint will delete every PaymentMethod matching the query filters
+        with a single DELETE statement, e.g. all of them for a closed user account
+        """
+        app.logger.info("Request to delete payment methods by filter")
+        args = filter_args.parse_args()
+        if not any(args.values()):
+            error(status.HTTP_400_BAD_REQUEST, "At least one filter is required")
+
+        deleted = PaymentMethod.delete_matching(filter_payment_methods(args))
+
+        app.logger.info("Deleted %d payment methods", deleted)
+        return {"deleted": deleted}, status.HTTP_200_OK
 
     ######################################################################
     #  CREATE A PAYMENT METHOD
@@ -259,7 +506,7 @@ class PaymentCollection(Resource):
     @api.doc("create_payments", security="apikey")
     @api.response(400, "The posted data was not valid")
     @api.expect(create_model)
-    @api.marshal_with(payment_method_model, skip_none=True, code=201)
+    @serialize_with(payment_method_json, code=status.HTTP_201_CREATED)
     def post(self):
         """
         Creates Payment Method
@@ -267,27 +514,114 @@ class PaymentCollection(Resource):
         """
         app.logger.info("Request to create a PaymentMethod")
         check_content_type("application/json")
-        body = request.get_json()
-        payment_method = None
-        method_type = body.get("type")
-
-        if method_type == PaymentMethodType.CREDIT_CARD.value:
-            payment_method = CreditCard()
-
-        if method_type == PaymentMethodType.PAYPAL.value:
-            payment_method = PayPal()
-        # Abort if no type was provided
-        if payment_method is None:
-            abort(status.HTTP_400_BAD_REQUEST, "PaymentMethod must have a type")
-
+        body = validate(request.get_json())
+        payment_method = new_payment_method(body)
         payment_method.deserialize(body)
         payment_method.create()
-        message = payment_method.serialize()
-        print(message)
         location_url = api.url_for(
             PaymentResource, payment_method_id=payment_method.id, _external=True
         )
-        return message, status.HTTP_201_CREATED, {"Location": location_url}
+        return payment_method, status.HTTP_201_CREATED, {"Location": location_url}
+
+
+######################################################################
+#  PATH: /payments/stats
+######################################################################
+@api.route("/payments/stats")
+class PaymentStats(Resource):
+    """Handles the statistics of PaymentMethods"""
+
+    ######################################################################
+    # COUNT PAYMENT METHODS
+    ######################################################################
+    @api.doc("payment_stats")
+    @api.expect(stats_args, validate=True)
+    @api.response(400, "The top argument was not a positive integer or a filter was not valid")
+    @api.marshal_with(stats_model)
+    def get(self):
+        """
+        Returns counts of the PaymentMethods matching the filters
+
+        The counts by type, by default status, of the users with the most
+        PaymentMethods and of the credit cards by expiry month are computed
+        by the database
+        """
+        app.logger.info("Request for payment method stats")
+        args = stats_args.parse_args()
+        top = app.config["STATS_TOP_USERS"] if args["top"] is None else args["top"]
+        if top < 1:
+            error(status.HTTP_400_BAD_REQUEST, "top must be a positive integer")
+        top = min(top, app.config["MAX_PAGE_SIZE"])
+
+        # Each combination of valid filters is cached for STATS_CACHE_TTL seconds, if set
+        name, payment_type, user_id = parse_filters(args)
+        key = f"payment_stats:name={name},type={payment_type and payment_type.name},user_id={user_id},top={top}"
+        stats = get_stats_cache().get(key)
+        if stats is None:
+            stats = PaymentMethod.stats(filter_payment_methods(args), top)
+            get_stats_cache().set(key, stats)
+
+        app.logger.info("Returning the stats of %d payment methods", stats["total"])
+        return stats, status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /payments:batch
+######################################################################
+@api.route("/payments:batch")
+class PaymentBatchCollection(Resource):
+    """Handles bulk creation of PaymentMethods"""
+
+    ######################################################################
+    #  CREATE A BATCH OF PAYMENT METHODS
+    ######################################################################
+    @api.doc("create_payments_batch", security="apikey")
+    @api.response(400, "The posted data was not a list")
+    @api.response(413, "The posted list has too many PaymentMethods")
+    @api.expect([create_model])
+    @api.marshal_list_with(batch_result_model, skip_none=True)
+    def post(self):
+        """
+        Creates a batch of Payment Methods
+        This endpoint will create every valid PaymentMethod in the posted list in a
+        single transaction and report a result or an error for each list item
+        """
+        app.logger.info("Request to create a batch of PaymentMethods")
+        check_content_type("application/json")
+        bodies = request.get_json()
+        if not isinstance(bodies, list):
+            error(status.HTTP_400_BAD_REQUEST, "Body must be a list of PaymentMethods")
+        if len(bodies) > app.config["BATCH_MAX_SIZE"]:
+            error(
+                status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                f"A batch can have at most {app.config['BATCH_MAX_SIZE']} PaymentMethods",
+            )
+
+        results = []
+        created = []
+        for position, body in enumerate(bodies):
+            errors = body_errors(body)
+            if errors:
+                results.append(
+                    {
+                        "index": position,
+                        "status": status.HTTP_400_BAD_REQUEST,
+                        "error": error_message(errors),
+                        "errors": errors,
+                    }
+                )
+                continue
+            payment_method = new_payment_method(body)
+            payment_method.deserialize(body)
+            results.append({"index": position, "status": status.HTTP_201_CREATED})
+            created.append((results[-1], payment_method))
+
+        PaymentMethod.create_batch([payment_method for _, payment_method in created])
+        for result, payment_method in created:
+            result["data"] = payment_method.serialize()
+
+        app.logger.info("Created %d of %d PaymentMethods", len(created), len(bodies))
+        return results, status.HTTP_200_OK
 
 
 ######################################################
@@ -310,7 +644,7 @@ class SetDefaultResource(Resource):
         """
         app.logger.info(f"Setting payment method {payment_method_id} as default")
 
-        payment_method = PaymentMethod.find(payment_method_id)
+        payment_method = PaymentMethod.find(payment_method_id, cached=False)
         if not payment_method:
             abort(
                 status.HTTP_404_NOT_FOUND,
@@ -320,7 +654,46 @@ class SetDefaultResource(Resource):
         payment_method.set_default_for_user()
 
         app.logger.info(f"Payment method {payment_method_id} set as default")
-        return payment_method.serialize(), status.HTTP_200_OK
+        headers = {"ETag": quote_etag(payment_method_etag(payment_method))}
+        return payment_method_json.response(payment_method, status.HTTP_200_OK, headers)
+
+
+######################################################################
+#  PATH: /users/{user_id}/default-payment
+######################################################################
+@api.route("/users/<int(signed=True):user_id>/default-payment")
+@api.param("user_id", "The identifier of the user")
+class UserDefaultPaymentResource(Resource):
+    """The default PaymentMethod of a user"""
+
+    @api.doc("get_default_payment")
+    @api.response(304, "PaymentMethod not modified since the If-None-Match ETag")
+    @api.response(400, "The user_id was out of range")
+    @api.response(404, "The user has no default PaymentMethod")
+    @serialize_with(payment_method_json)
+    def get(self, user_id):
+        """
+        Retrieve the default PaymentMethod of a user
+
+        This endpoint will return the PaymentMethod the user has set as default
+        """
+        app.logger.info("Request for the default payment of user %s", user_id)
+        if not is_sql_integer(user_id):
+            error(status.HTTP_400_BAD_REQUEST, f"Invalid user_id '{user_id}', it must be an integer")
+
+        payment_method = PaymentMethod.find_default_for_user(user_id)
+        if not payment_method:
+            abort(
+                status.HTTP_404_NOT_FOUND,
+                f"User '{user_id}' has no default PaymentMethod.",
+            )
+        etag = payment_method_etag(payment_method)
+        headers = {"ETag": quote_etag(etag)}
+        if request.if_none_match.contains_weak(etag):
+            app.logger.info("PaymentMethod %s not modified", payment_method.id)
+            return None, status.HTTP_304_NOT_MODIFIED, headers
+        app.logger.info("Returning PaymentMethod: %s", payment_method.name)
+        return payment_method, status.HTTP_200_OK, headers
 
 
 ######################################################################
@@ -344,6 +717,144 @@ def check_content_type(content_type):
     )
 
 
+def new_payment_method(body):
+    """Returns an empty PaymentMethod of the type named in the body, or None"""
+    method_type = body.get("type") if isinstance(body, dict) else None
+    if method_type == PaymentMethodType.CREDIT_CARD.value:
+        return CreditCard()
+    if method_type == PaymentMethodType.PAYPAL.value:
+        return PayPal()
+    return None
+
+
+def is_sql_integer(value):
+    """Returns whether a number fits the Integer columns of PaymentMethods, such as id and user_id"""
+    return -(2**31) <= value < 2**31
+
+
+def parse_filters(args):
+    """Returns the name, type and user_id filters of a request, None for those not given
+
+    Aborts with 400 if the type is not a PaymentMethodType or the user_id is not an integer
+    """
+    name = args["name"] or None
+    payment_type = None
+    if args["type"]:
+        try:
+            payment_type = PaymentMethodType[args["type"].upper()]
+        except KeyError:
+            error(
+                status.HTTP_400_BAD_REQUEST,
+                f"Invalid type '{args['type']}', the types are {', '.join(PaymentMethodType.__members__)}",
+            )
+    user_id = None
+    if args["user_id"]:
+        try:
+            user_id = int(args["user_id"])
+        except ValueError:
+            user_id = None
+        if user_id is None or not is_sql_integer(user_id):
+            error(status.HTTP_400_BAD_REQUEST, f"Invalid user_id '{args['user_id']}', it must be an integer")
+    return name, payment_type, user_id
+
+
+def filter_payment_methods(args, q=None):
+    """Returns a PaymentMethod query narrowed by the name, type and user_id filters"""
+    name, payment_type, user_id = parse_filters(args)
+    if q is None:
+        q = PaymentMethod.query
+    if name:
+        q = PaymentMethod.find_by_name(name, q)
+    if payment_type:
+        q = PaymentMethod.find_by_type(payment_type, q)
+    if user_id is not None:
+        q = PaymentMethod.find_by_user_id(user_id, q)
+    return q
+
+
+def parse_fields(fields_arg):
+    """Returns the fields named by the fields argument of a list request, None for all of them"""
+    if not fields_arg:
+        return None
+    field_names = {key.strip() for key in fields_arg.split(",")} - {""}
+    known = [key for key, _ in payment_method_json.fields]
+    unknown = field_names.difference(known)
+    if unknown:
+        error(
+            status.HTTP_400_BAD_REQUEST,
+            f"Unknown fields {', '.join(sorted(unknown))}, the fields are {', '.join(known)}",
+        )
+    return field_names or None
+
+
+def select_fields(q, field_names):
+    """Returns the query and the serializer of the fields of a list request
+
+    Only the columns of the fields are loaded, see PaymentMethod.load_fields()
+    """
+    if field_names is None:
+        return q, payment_method_json
+    serializer = payment_method_json.only(field_names)
+    return PaymentMethod.load_fields(q, [attribute for _, attribute in serializer.fields]), serializer
+
+
+def ndjson_lines(payment_methods, serializer=payment_method_json, mask=None):
+    """Yields each PaymentMethod as one line of newline delimited JSON, only the fields of a mask if given"""
+    for payment_method in payment_methods:
+        yield serializer.dumps(serializer.masked(payment_method, mask) if mask else payment_method)
+
+
+def payment_method_etag(payment_method):
+    """Returns the strong ETag of a PaymentMethod, derived from its row version"""
+    return f"{payment_method.id}.{payment_method.version}"
+
+
+def list_etag(payment_methods, next_cursor=None, field_names=None):
+    """Returns the strong ETag of a page of PaymentMethods, or of some of their fields"""
+    digest = hashlib.blake2b(digest_size=16)
+    for payment_method in payment_methods:
+        digest.update(f"{payment_method_etag(payment_method)},".encode())
+    digest.update(f"next={next_cursor}".encode())
+    if field_names is not None:
+        digest.update(f"fields={','.join(sorted(field_names))}".encode())
+    return digest.hexdigest()
+
+
+def get_page_limit(limit, streamed=False):
+    """Returns the page size to use for a list request
+
+    A streamed list is not held in memory, so it has no default or maximum size
+    """
+    if limit is not None and limit < 1:
+        error(status.HTTP_400_BAD_REQUEST, "limit must be a positive integer")
+    # checked here, as a stream only runs its query once the 200 has been sent
+    if limit is not None and limit > MAX_SQL_LIMIT:
+        error(status.HTTP_400_BAD_REQUEST, f"limit must be at most {MAX_SQL_LIMIT}")
+    if streamed:
+        return limit
+    if limit is None:
+        return app.config["DEFAULT_PAGE_SIZE"]
+    return min(limit, app.config["MAX_PAGE_SIZE"])
+
+
+def encode_cursor(last_id):
+    """Encodes the id of the last row of a page into an opaque cursor"""
+    return base64.urlsafe_b64encode(f"id:{last_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Decodes an opaque cursor back into the id of the last row seen"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        prefix, last_id = base64.urlsafe_b64decode(padded).decode().split(":")
+        if prefix != "id" or not is_sql_integer(int(last_id)):
+            raise ValueError(prefix)
+        return int(last_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        error(status.HTTP_400_BAD_REQUEST, f"Invalid cursor '{cursor}'")
+    return None
+
+
 def error(status_code, reason):
     """Logs the error and then aborts"""
     app.logger.error(reason)
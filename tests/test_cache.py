@@ -0,0 +1,128 @@
+"""
+Test cases for the PaymentMethod cache
+"""
+
+from unittest import TestCase
+from wsgi import app
+from service.common.cache import (
+    CacheBackend,
+    MemoryCache,
+    NullCache,
+    init_cache,
+    get_cache,
+    get_stats_cache,
+)
+
+
+class FakeTimer:  # pylint: disable=too-few-public-methods
+    """A clock that only moves when told to"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+######################################################################
+#  C A C H E   T E S T   C A S E S
+######################################################################
+class TestMemoryCache(TestCase):
+    """In-process LRU cache tests"""
+
+    def setUp(self):
+        self.timer = FakeTimer()
+        self.cache = MemoryCache(max_size=2, ttl=10, timer=self.timer)
+
+    def test_get_and_set(self):
+        """It should return cached values and count hits and misses"""
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.set("a", {"id": 1})
+        self.assertEqual(self.cache.get("a"), {"id": 1})
+        stats = self.cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["size"], 1)
+        self.assertEqual(stats["max_size"], 2)
+
+    def test_least_recently_used_is_evicted(self):
+        """It should evict the least recently used entry when full"""
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.get("a")
+        self.cache.set("c", 3)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertEqual(self.cache.get("c"), 3)
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_entries_expire(self):
+        """It should not return entries older than the TTL"""
+        self.cache.set("a", 1)
+        self.timer.now = 9.9
+        self.assertEqual(self.cache.get("a"), 1)
+        self.timer.now = 10
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.stats()["size"], 0)
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_delete_and_clear(self):
+        """It should remove one or all entries"""
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.delete("a")
+        self.cache.delete("missing")
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.get("b"), 2)
+        self.cache.clear()
+        self.assertIsNone(self.cache.get("b"))
+
+
+class TestCacheBackends(TestCase):
+    """Cache backend selection tests"""
+
+    def setUp(self):
+        self.backend = app.config["CACHE_BACKEND"]
+
+    def tearDown(self):
+        app.config["CACHE_BACKEND"] = self.backend
+        init_cache(app)
+
+    def test_null_cache(self):
+        """It should never cache anything with the none backend"""
+        cache = NullCache()
+        cache.set("a", 1)
+        self.assertIsNone(cache.get("a"))
+        cache.delete("a")
+        cache.clear()
+        self.assertEqual(cache.stats(), {"hits": 0, "misses": 1})
+
+    def test_init_cache(self):
+        """It should create the backend named in the configuration"""
+        for name, backend in [("memory", MemoryCache), ("none", NullCache)]:
+            app.config["CACHE_BACKEND"] = name
+            self.assertIsInstance(init_cache(app), backend)
+            with app.app_context():
+                self.assertIs(get_cache(), app.extensions["cache"])
+
+    def test_init_stats_cache(self):
+        """It should cache the stats only when STATS_CACHE_TTL is set"""
+        ttl = app.config["STATS_CACHE_TTL"]
+        try:
+            app.config["STATS_CACHE_TTL"] = 5
+            init_cache(app)
+            with app.app_context():
+                self.assertIsInstance(get_stats_cache(), MemoryCache)
+                self.assertEqual(get_stats_cache().ttl, 5)
+            app.config["STATS_CACHE_TTL"] = 0
+            init_cache(app)
+            self.assertIsInstance(app.extensions["stats_cache"], NullCache)
+        finally:
+            app.config["STATS_CACHE_TTL"] = ttl
+
+    def test_init_custom_cache(self):
+        """It should load a custom backend from a module:Class path"""
+        app.config["CACHE_BACKEND"] = "service.common.cache:NullCache"
+        cache = init_cache(app)
+        self.assertIsInstance(cache, NullCache)
+        self.assertIsInstance(cache, CacheBackend)
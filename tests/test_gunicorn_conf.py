@@ -0,0 +1,103 @@
+"""
+Test cases for the gunicorn configuration
+"""
+
+import os
+import runpy
+import tempfile
+from types import SimpleNamespace
+from unittest import TestCase
+from unittest.mock import patch
+from wsgi import app
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "gunicorn.conf.py")
+
+
+def load_config(**environ):
+    """Returns the settings of the config file under the given environment"""
+    with patch.dict(os.environ, environ):
+        return runpy.run_path(CONFIG_FILE)
+
+
+######################################################################
+#  G U N I C O R N   C O N F I G   T E S T   C A S E S
+######################################################################
+class TestGunicornConfig(TestCase):
+    """Gunicorn configuration tests"""
+
+    def write_cgroup(self, root, files):
+        """Writes fake cgroup files under root"""
+        for name, content in files.items():
+            path = os.path.join(root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as cgroup_file:
+                cgroup_file.write(content)
+
+    def test_cgroup_cpu_limit(self):
+        """It should read the CPU quota of cgroup v2 and v1"""
+        config = load_config()
+        with tempfile.TemporaryDirectory() as root:
+            self.assertIsNone(config["cgroup_cpu_limit"](root))
+            self.write_cgroup(root, {"cpu/cpu.cfs_quota_us": "-1", "cpu/cpu.cfs_period_us": "100000"})
+            self.assertIsNone(config["cgroup_cpu_limit"](root))
+            self.write_cgroup(root, {"cpu/cpu.cfs_quota_us": "150000"})
+            self.assertEqual(config["cgroup_cpu_limit"](root), 1.5)
+            self.write_cgroup(root, {"cpu.max": "max 100000"})
+            self.assertIsNone(config["cgroup_cpu_limit"](root))
+            self.write_cgroup(root, {"cpu.max": "50000 100000"})
+            self.assertEqual(config["cgroup_cpu_limit"](root), 0.5)
+
+    def test_available_cpus(self):
+        """It should round the CPU quota up and never exceed the CPU affinity"""
+        config = load_config()
+        with tempfile.TemporaryDirectory() as root:
+            with patch("os.sched_getaffinity", return_value={0, 1, 2, 3}):
+                self.assertEqual(config["available_cpus"](root), 4)
+                self.write_cgroup(root, {"cpu.max": "250000 100000"})
+                self.assertEqual(config["available_cpus"](root), 3)
+                self.write_cgroup(root, {"cpu.max": "800000 100000"})
+                self.assertEqual(config["available_cpus"](root), 4)
+                self.write_cgroup(root, {"cpu.max": "20000 100000"})
+                self.assertEqual(config["available_cpus"](root), 1)
+
+    def test_default_workers(self):
+        """It should derive the workers from the CPUs and the worker class"""
+        default_workers = load_config()["default_workers"]
+        self.assertEqual(default_workers("sync", 2), 5)
+        self.assertEqual(default_workers("gthread", 2), 3)
+        self.assertEqual(default_workers("gevent", 2), 2)
+
+    def test_settings_from_environment(self):
+        """It should take the settings from the environment"""
+        config = load_config(
+            GUNICORN_WORKER_CLASS="gthread",
+            GUNICORN_WORKERS="3",
+            GUNICORN_THREADS="8",
+            GUNICORN_MAX_REQUESTS="500",
+            GUNICORN_PRELOAD="false",
+            GUNICORN_BIND="127.0.0.1:9000",
+        )
+        self.assertEqual(config["worker_class"], "gthread")
+        self.assertEqual(config["workers"], 3)
+        self.assertEqual(config["threads"], 8)
+        self.assertEqual(config["max_requests"], 500)
+        self.assertEqual(config["max_requests_jitter"], 50)
+        self.assertFalse(config["preload_app"])
+        self.assertEqual(config["bind"], "127.0.0.1:9000")
+
+        config = load_config(GUNICORN_WORKER_CLASS="sync")
+        self.assertEqual(config["threads"], 1)
+        self.assertTrue(config["preload_app"])
+        with self.assertRaises(RuntimeError):
+            load_config(GUNICORN_WORKER_CLASS="eventlet")
+
+    def test_post_fork_resets_pools(self):
+        """It should give a forked worker its own database connections"""
+        config = load_config()
+        with app.app_context():
+            engine = app.extensions["engines"]["sync"]
+            pool = engine.pool
+            config["post_fork"](None, SimpleNamespace(app=SimpleNamespace(callable=app)))
+            self.assertIsNot(engine.pool, pool)
+            # a worker that loads the app itself has nothing to reset
+            config["post_fork"](None, SimpleNamespace(app=SimpleNamespace(callable=None)))
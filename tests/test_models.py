@@ -4,7 +4,13 @@ Test cases for PaymentMethod Model
 
 import os
 import logging
+import threading
 from unittest import TestCase
+from unittest.mock import patch
+from flask_migrate import upgrade
+from psycopg.errors import DeadlockDetected
+from sqlalchemy import event, inspect, text, update
+from sqlalchemy.exc import OperationalError
 from wsgi import app
 from service.models import (
     PaymentMethod,
@@ -12,9 +18,11 @@ from service.models import (
     CreditCard,
     PayPal,
     DataValidationError,
+    DataConflictError,
     db,
 )
-from service.models.payment_method import convert_str_to_payment_method_type_enum
+from service.models.payment_method import cache_key, convert_str_to_payment_method_type_enum
+from service.common.cache import get_cache
 
 from tests.factories import (
     CreditCardFactory,
@@ -43,6 +51,7 @@ class TestCaseBase(TestCase):
         app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URI
         app.logger.setLevel(logging.CRITICAL)
         app.app_context().push()
+        upgrade()  # the schema is managed by migrations, not at boot
 
     @classmethod
     def tearDownClass(cls):
@@ -53,6 +62,7 @@ class TestCaseBase(TestCase):
         """This runs before each test"""
         db.session.query(PaymentMethod).delete()  # clean up the last tests
         db.session.commit()
+        get_cache().clear()
 
     def tearDown(self):
         """This runs after each test"""
@@ -112,6 +122,36 @@ class TestPaymentMethodModel(TestCaseBase):
         found_alt_uid = PaymentMethod.find_by_user_id(uid + 1)
         self.assertEqual(len(found_alt_uid.all()), 0)
 
+    def test_find_page_of_payment_methods(self):
+        """It should return PaymentMethods in id order, one page at a time"""
+        for payment_method in generate_random_payment_methods(5):
+            payment_method.create()
+
+        first_page = PaymentMethod.find_page(3).all()
+        self.assertEqual(len(first_page), 3)
+        second_page = PaymentMethod.find_page(3, first_page[-1].id).all()
+        self.assertEqual(len(second_page), 2)
+        ids = [payment_method.id for payment_method in first_page + second_page]
+        self.assertEqual(ids, sorted(ids))
+
+    def test_create_batch_of_payment_methods(self):
+        """It should create a batch of PaymentMethods in one transaction"""
+        payment_methods = generate_random_payment_methods(6)
+        PaymentMethod.create_batch(payment_methods)
+        for payment_method in payment_methods:
+            self.assertIsNotNone(payment_method.id)
+            found = PaymentMethod.find(payment_method.id)
+            self.assertEqual(found.serialize(), payment_method.serialize())
+        self.assertEqual(len(PaymentMethod.all()), 6)
+
+    def test_create_batch_rolls_back_on_error(self):
+        """It should not create any PaymentMethod of a batch that fails"""
+        payment_methods = generate_random_payment_methods(3)
+        payment_methods[-1].name = "x" * 100  # longer than the name column
+        with self.assertRaises(DataValidationError):
+            PaymentMethod.create_batch(payment_methods)
+        self.assertEqual(len(PaymentMethod.all()), 0)
+
     def test_create_invalid_payment_method(self):
         """It should not create a PaymentMethod with invalid data"""
         payment_method = PaymentMethod(name="")
@@ -146,6 +186,123 @@ class TestPaymentMethodModel(TestCaseBase):
         self.assertTrue(updated_method1.is_default)
         self.assertFalse(updated_method2.is_default)
 
+    def test_only_one_default_per_user(self):
+        """It should not allow two default payment methods for the same user"""
+        CreditCardFactory(user_id=5, is_default=True).create()
+        PayPalFactory(user_id=6, is_default=True).create()
+        with self.assertRaises(DataValidationError):
+            PayPalFactory(user_id=5, is_default=True).create()
+
+    def test_payment_method_indexes(self):
+        """It should index the columns used by the find_by_* queries"""
+        indexes = {
+            index["name"]: index
+            for index in inspect(db.engine).get_indexes("payment_method")
+        }
+        self.assertEqual(
+            indexes["ix_payment_method_user_id_type"]["column_names"],
+            ["user_id", "type"],
+        )
+        self.assertEqual(
+            indexes["ix_payment_method_user_id_is_default"]["column_names"],
+            ["user_id", "is_default"],
+        )
+        self.assertEqual(indexes["ix_payment_method_name"]["column_names"], ["name"])
+        # the one default per user rule is checked at commit
+        constraint = db.session.execute(
+            text(
+                "SELECT contype, condeferred FROM pg_constraint "
+                "WHERE conname = 'ex_payment_method_default_per_user'"
+            )
+        ).one()
+        self.assertEqual(tuple(constraint), ("x", True))
+
+    def test_set_default_is_one_update(self):
+        """It should lock the PaymentMethods of the user in id order and move the default with a single UPDATE"""
+        methods = [PayPalFactory(user_id=8) for _ in range(5)]
+        PaymentMethod.create_batch(methods)
+        methods[0].set_default_for_user()
+        versions = db.session.query(PaymentMethod.id, PaymentMethod.version).filter_by(user_id=8)
+        before = dict(versions.all())
+
+        statements = []
+
+        def record_statement(_conn, _cursor, statement, *_args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", record_statement)
+        try:
+            methods[3].set_default_for_user()
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record_statement)
+        self.assertEqual(len(statements), 2)
+        self.assertTrue(statements[0].startswith("SELECT payment_method.id"))
+        self.assertTrue(statements[0].endswith("ORDER BY payment_method.id FOR UPDATE"))
+        self.assertTrue(statements[1].startswith("UPDATE payment_method"))
+
+        defaults = PaymentMethod.query.filter_by(user_id=8, is_default=True).all()
+        self.assertEqual([method.id for method in defaults], [methods[3].id])
+        # only the old and the new default get a new version
+        for payment_method_id, version in versions.all():
+            changed = payment_method_id in (methods[0].id, methods[3].id)
+            self.assertEqual(version, before[payment_method_id] + changed)
+
+    def test_concurrent_set_default(self):
+        """It should leave exactly one default when many threads set defaults at once"""
+        methods = [CreditCardFactory(user_id=9) for _ in range(4)]
+        PaymentMethod.create_batch(methods)
+        ids = [method.id for method in methods]
+        errors = []
+
+        def set_defaults(order):
+            with app.app_context():
+                try:
+                    for payment_method_id in order:
+                        PaymentMethod.find(payment_method_id).set_default_for_user()
+                except DataValidationError as error:  # pragma: no cover
+                    errors.append(error)
+                db.session.remove()
+
+        threads = [
+            threading.Thread(target=set_defaults, args=(ids[i % 4:] + ids[:i % 4],))
+            for i in range(16)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        defaults = PaymentMethod.query.filter_by(user_id=9, is_default=True).count()
+        self.assertEqual(defaults, 1)
+
+    def test_set_default_retries_deadlocks(self):
+        """It should retry setting a default that lost a deadlock, and give up with a conflict"""
+        methods = [PayPalFactory(user_id=9) for _ in range(2)]
+        PaymentMethod.create_batch(methods)
+        deadlock = OperationalError("UPDATE", {}, DeadlockDetected("deadlock detected"))
+        set_default = PaymentMethod._set_default  # pylint: disable=protected-access
+        calls = []
+
+        def deadlock_once(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                raise deadlock
+            return set_default(*args)
+
+        with patch.object(PaymentMethod, "_set_default", side_effect=deadlock_once):
+            methods[1].set_default_for_user()
+        self.assertEqual(len(calls), 2)
+        defaults = PaymentMethod.query.filter_by(user_id=9, is_default=True).all()
+        self.assertEqual([method.id for method in defaults], [methods[1].id])
+
+        with patch.object(PaymentMethod, "_set_default", side_effect=deadlock) as always:
+            self.assertRaises(DataConflictError, methods[0].set_default_for_user)
+        self.assertEqual(always.call_count, 3)
+        with patch.object(PaymentMethod, "_set_default", side_effect=OperationalError("UPDATE", {}, Exception())):
+            self.assertRaises(DataValidationError, methods[0].set_default_for_user)
+        self.assertTrue(PaymentMethod.find(methods[1].id, cached=False).is_default)
+
     def test_default_status_persists_across_updates(self):
         """It should maintain the default status across updates"""
         payment_method = CreditCardFactory(is_default=True)
@@ -160,6 +317,155 @@ class TestPaymentMethodModel(TestCaseBase):
         self.assertTrue(updated_payment_method.is_default)
 
 
+class TestPaymentMethodCache(TestCaseBase):
+    """PaymentMethod read-through cache tests"""
+
+    def count_statements(self, function, *args):
+        """Returns the result of a call and the number of SQL statements it ran"""
+        statements = []
+
+        def count_statement(*_args):
+            statements.append(1)
+
+        event.listen(db.engine, "before_cursor_execute", count_statement)
+        try:
+            result = function(*args)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count_statement)
+        return result, len(statements)
+
+    def test_find_reads_through_the_cache(self):
+        """It should only query the database the first time a PaymentMethod is found"""
+        credit_card = CreditCardFactory()
+        credit_card.create()
+        expected = credit_card.serialize()
+        db.session.expunge_all()
+
+        found, statements = self.count_statements(PaymentMethod.find, credit_card.id)
+        self.assertGreater(statements, 0)
+        self.assertEqual(found.serialize(), expected)
+        db.session.expunge_all()
+
+        hits = get_cache().stats()["hits"]
+        found, statements = self.count_statements(PaymentMethod.find, str(expected["id"]))
+        self.assertEqual(statements, 0)
+        self.assertIsInstance(found, CreditCard)
+        self.assertEqual(found.serialize(), expected)
+        self.assertEqual(get_cache().stats()["hits"], hits + 1)
+
+    def test_cached_payment_method_can_be_changed(self):
+        """It should update and delete a PaymentMethod that came from the cache"""
+        paypal = PayPalFactory()
+        paypal.create()
+        PaymentMethod.find(paypal.id)
+        db.session.expunge_all()
+
+        cached = PaymentMethod.find(paypal.id)
+        cached.email = "new@example.com"
+        cached.update()
+        db.session.expunge_all()
+        self.assertEqual(PaymentMethod.find(paypal.id).email, "new@example.com")
+        db.session.expunge_all()
+        self.assertEqual(
+            db.session.get(PayPal, paypal.id).email, "new@example.com"
+        )
+
+        PaymentMethod.find(paypal.id).delete()
+        self.assertIsNone(PaymentMethod.find(paypal.id))
+
+    def test_cache_keeps_changes_in_session(self):
+        """It should return the object of the session rather than the cached copy"""
+        paypal = PayPalFactory()
+        paypal.create()
+        PaymentMethod.find(paypal.id)
+        paypal.name = "pending"
+        self.assertIs(PaymentMethod.find(paypal.id), paypal)
+        self.assertEqual(paypal.name, "pending")
+        self.assertIsNone(CreditCard.find(paypal.id))
+
+    def test_set_default_invalidates_the_cache(self):
+        """It should not return a stale default after another one is set"""
+        first = CreditCardFactory(user_id=3)
+        second = PayPalFactory(user_id=3)
+        first.create()
+        second.create()
+        first_id, second_id = first.id, second.id
+        first.set_default_for_user()
+        db.session.expunge_all()
+        self.assertTrue(PaymentMethod.find(first_id).is_default)
+        db.session.expunge_all()
+
+        PaymentMethod.find(second_id).set_default_for_user()
+        db.session.expunge_all()
+        self.assertFalse(PaymentMethod.find(first_id).is_default)
+        self.assertTrue(PaymentMethod.find(second_id).is_default)
+
+    def test_set_default_keeps_unchanged_rows_cached(self):
+        """It should only invalidate the PaymentMethods whose is_default changed"""
+        methods = [PayPalFactory(user_id=6) for _ in range(3)]
+        PaymentMethod.create_batch(methods)
+        ids = [method.id for method in methods]
+        methods[0].set_default_for_user()
+        db.session.expunge_all()
+        for payment_method_id in ids:
+            PaymentMethod.find(payment_method_id)
+
+        PaymentMethod.find(ids[1]).set_default_for_user()
+        self.assertIsNone(get_cache().get(cache_key(ids[0])))
+        self.assertIsNone(get_cache().get(cache_key(ids[1])))
+        self.assertIsNotNone(get_cache().get(cache_key(ids[2])))
+        # setting the same default again changes nothing
+        PaymentMethod.find(ids[1]).set_default_for_user()
+        self.assertIsNotNone(get_cache().get(cache_key(ids[1])))
+
+    def test_find_default_for_user(self):
+        """It should find the default of a user with one SELECT"""
+        methods = [CreditCardFactory(user_id=8) for _ in range(3)] + [PayPalFactory(user_id=8)]
+        PaymentMethod.create_batch(methods)
+        self.assertIsNone(PaymentMethod.find_default_for_user(8))
+        methods[1].set_default_for_user()
+        default_id = methods[1].id
+        db.session.expunge_all()
+
+        get_cache().clear()
+        default, statements = self.count_statements(PaymentMethod.find_default_for_user, 8)
+        self.assertIsInstance(default, CreditCard)
+        self.assertEqual(statements, 1)
+        self.assertEqual(default.serialize(), {**methods[1].serialize(), "is_default": True})
+        self.assertEqual(default.version, PaymentMethod.find(default_id, cached=False).version)
+        # the row is cached for the GET of the PaymentMethod itself
+        db.session.expunge_all()
+        self.assertEqual(self.count_statements(PaymentMethod.find, default_id)[1], 0)
+
+        PaymentMethod.find(methods[3].id).set_default_for_user()
+        db.session.expunge_all()
+        self.assertIsInstance(PaymentMethod.find_default_for_user(8), PayPal)
+        self.assertIsNone(PaymentMethod.find_default_for_user(9))
+
+    def test_delete_matching_invalidates_the_cache(self):
+        """It should not return PaymentMethods removed by a bulk delete"""
+        paypal = PayPalFactory(user_id=4)
+        paypal.create()
+        paypal_id = paypal.id
+        PaymentMethod.find(paypal_id)
+        PaymentMethod.delete_matching(PaymentMethod.find_by_user_id(4))
+        db.session.expunge_all()
+        self.assertIsNone(PaymentMethod.find(paypal_id))
+
+    def test_delete_matching_without_cascade(self):
+        """It should delete the subclass rows itself where foreign keys do not cascade"""
+        PaymentMethod.create_batch([CreditCardFactory(user_id=4), PayPalFactory(user_id=4), PayPalFactory(user_id=5)])
+        with patch.object(db.session.get_bind().dialect, "name", "sqlite"):
+            self.assertEqual(PaymentMethod.delete_matching(PaymentMethod.find_by_user_id(4)), 2)
+        self.assertEqual(db.session.query(CreditCard.__table__).count(), 0)
+        self.assertEqual(db.session.query(PayPal.__table__).count(), 1)
+        self.assertEqual(PaymentMethod.query.count(), 1)
+
+    def test_find_with_bad_id(self):
+        """It should not find a PaymentMethod with an id that is not a number"""
+        self.assertIsNone(PaymentMethod.find("abc"))
+
+
 class TestPayPalModel(TestCaseBase):
     """PayPal Model CRUD Tests"""
 
@@ -435,6 +741,31 @@ class TestCreditCardModel(TestCaseBase):
         self.assertEqual(credit_cards[0].id, original_id)
         self.assertEqual(credit_cards[0].name, new_name)
 
+    def test_update_bumps_version(self):
+        """It should bump the version of a PaymentMethod on every update"""
+        credit_card = CreditCardFactory()
+        credit_card.create()
+        self.assertEqual(credit_card.version, 1)
+        credit_card.name = "Renamed"
+        credit_card.update()
+        self.assertEqual(credit_card.version, 2)
+        credit_card.zip_code = "10003"  # a credit_card column only
+        credit_card.update()
+        self.assertEqual(credit_card.version, 3)
+
+    def test_update_a_stale_credit_card(self):
+        """It should not Update a CreditCard that was changed since it was read"""
+        credit_card = CreditCardFactory()
+        credit_card.create()
+        db.session.execute(
+            update(PaymentMethod)
+            .where(PaymentMethod.id == credit_card.id)
+            .values(version=PaymentMethod.version + 1),
+            execution_options={"synchronize_session": False},
+        )
+        credit_card.name = "Lost update"
+        self.assertRaises(DataValidationError, credit_card.update)
+
     def test_update_a_credit_card_in_db_with_no_id(self):
         """It should not Update a CreditCard with no id"""
         credit_card = CreditCardFactory()
@@ -3,12 +3,19 @@ TestYourResourceModel API Service Test Suite
 """
 
 import os
+import json
 import logging
 from unittest import TestCase
+from unittest.mock import patch
+from flask_migrate import upgrade
+from psycopg.errors import DeadlockDetected
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
 from wsgi import app
 from tests.factories import CreditCardFactory, PayPalFactory
 from service.common import status
-from service.models import db, PaymentMethod
+from service.common.cache import MemoryCache, get_cache
+from service.models import db, PaymentMethod, CreditCard, PayPal
 from service.routes import generate_apikey
 
 DATABASE_URI = os.getenv(
@@ -35,6 +42,7 @@ class TestPaymentsService(TestCase):
         app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URI
         app.logger.setLevel(logging.CRITICAL)
         app.app_context().push()
+        upgrade()  # the schema is managed by migrations, not at boot
 
     @classmethod
     def tearDownClass(cls):
@@ -47,6 +55,7 @@ class TestPaymentsService(TestCase):
         self.headers = {}
         db.session.query(PaymentMethod).delete()  # clean up the last tests
         db.session.commit()
+        get_cache().clear()
 
     def tearDown(self):
         """This runs after each test"""
@@ -64,6 +73,29 @@ class TestPaymentsService(TestCase):
         self.assertEqual(response.get_json(), {"status": "OK"})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_cache_stats(self):
+        """It should count cache hits and misses of PaymentMethod lookups"""
+        paypal = PayPalFactory()
+        paypal.create()
+        before = self.client.get("/cache/stats").get_json()
+        self.client.get(f"{BASE_URL}/{paypal.id}")
+        self.client.get(f"{BASE_URL}/{paypal.id}")
+        response = self.client.get("/cache/stats")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        after = response.get_json()
+        self.assertEqual(after["misses"] - before["misses"], 1)
+        self.assertEqual(after["hits"] - before["hits"], 1)
+
+    def test_pool_stats(self):
+        """It should report the state of the database connection pool"""
+        self.client.get(BASE_URL)
+        response = self.client.get("/db/pool/stats")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        stats = response.get_json()["sync"]
+        self.assertEqual(stats["pool"], "TimedQueuePool")
+        self.assertEqual(stats["size"], app.config["DB_POOL_SIZE"])
+        self.assertGreater(stats["checkouts"], 0)
+
     def test_create_credit_card_payment_method(self):
         """It should create a new CreditCard"""
         credit_card = CreditCardFactory()
@@ -170,6 +202,75 @@ class TestPaymentsService(TestCase):
         resp = self.client.trace(BASE_URL)
         self.assertEqual(resp.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
 
+    def test_create_payment_methods_batch(self):
+        """It should create a batch of CreditCards and PayPals"""
+        bodies = [
+            CreditCardFactory().serialize(),
+            PayPalFactory().serialize(),
+            CreditCardFactory().serialize(),
+        ]
+        resp = self.client.post(f"{BASE_URL}:batch", json=bodies, headers=self.headers)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        results = resp.get_json()
+        self.assertEqual(len(results), 3)
+        for index, result in enumerate(results):
+            self.assertEqual(result["index"], index)
+            self.assertEqual(result["status"], status.HTTP_201_CREATED)
+            self.assertNotIn("error", result)
+            created = result["data"]
+            self.assertEqual(created["type"], bodies[index]["type"])
+            self.assertEqual(created["name"], bodies[index]["name"])
+            self.assertFalse(created["is_default"])
+
+            # the created PaymentMethod can be read back
+            response = self.client.get(f"{BASE_URL}/{created['id']}")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.get_json(), created)
+
+    def test_create_payment_methods_batch_with_errors(self):
+        """It should create the valid PaymentMethods of a batch and report the invalid ones"""
+        bad_card = CreditCardFactory().serialize()
+        bad_card["card_number"] = "1234"
+        bodies = [
+            PayPalFactory().serialize(),
+            bad_card,
+            {"name": "no type", "user_id": 1},
+            "not a payment method",
+        ]
+        resp = self.client.post(f"{BASE_URL}:batch", json=bodies, headers=self.headers)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        results = resp.get_json()
+        self.assertEqual(
+            [result["status"] for result in results],
+            [status.HTTP_201_CREATED] + [status.HTTP_400_BAD_REQUEST] * 3,
+        )
+        self.assertIn("Card number", results[1]["error"])
+        self.assertEqual(results[1]["errors"], {"card_number": "Card number field must be 16 digits"})
+        self.assertIn("type", results[2]["error"])
+        self.assertEqual(len(PaymentMethod.all()), 1)
+
+    def test_create_payment_methods_batch_bad_requests(self):
+        """It should reject a batch that is not a list, too large or not JSON"""
+        resp = self.client.post(
+            f"{BASE_URL}:batch", json=PayPalFactory().serialize(), headers=self.headers
+        )
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+        max_size = app.config["BATCH_MAX_SIZE"]
+        app.config["BATCH_MAX_SIZE"] = 1
+        try:
+            bodies = [PayPalFactory().serialize(), PayPalFactory().serialize()]
+            resp = self.client.post(f"{BASE_URL}:batch", json=bodies, headers=self.headers)
+        finally:
+            app.config["BATCH_MAX_SIZE"] = max_size
+        self.assertEqual(resp.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        resp = self.client.post(
+            f"{BASE_URL}:batch", content_type="text/html", headers=self.headers
+        )
+        self.assertEqual(resp.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        self.assertEqual(len(PaymentMethod.all()), 0)
+
     def test_update_payment_method(self):
         """It should Update an existing Payment Method"""
         # create a payment method to update
@@ -193,6 +294,31 @@ class TestPaymentsService(TestCase):
         updated_payment = response.get_json()
         self.assertEqual(updated_payment["name"], "unknown")
 
+    def test_create_payment_method_reports_all_errors(self):
+        """It should report every invalid field of a posted PaymentMethod"""
+        body = CreditCardFactory().serialize()
+        body.update(card_number="abc", security_code="12")
+        response = self.client.post(BASE_URL, json=body, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        data = response.get_json()
+        self.assertEqual(
+            data["errors"],
+            {
+                "card_number": "Card number field must be numeric",
+                "security_code": "Security code field must be 3 digits",
+            },
+        )
+        self.assertIn("Card number field must be numeric", data["message"])
+
+    def test_update_payment_method_type(self):
+        """It should not change the type of a Payment Method"""
+        paypal = PayPalFactory()
+        paypal.create()
+        body = {**CreditCardFactory().serialize(), "id": paypal.id}
+        response = self.client.put(f"{BASE_URL}/{paypal.id}", json=body, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.get_json()["errors"], {"type": "Type field must be PAYPAL"})
+
     def test_update_payment_method_not_exist(self):
         """It should not Update a Payment Method that does not exist"""
 
@@ -218,6 +344,108 @@ class TestPaymentsService(TestCase):
         response = self.client.get(f"{BASE_URL}/{test_payment_method.id}")
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_delete_payment_methods_by_filter(self):
+        """It should Delete all Payment Methods matching the filters"""
+        for _ in range(3):
+            CreditCardFactory(user_id=42).create()
+        PayPalFactory(user_id=42).create()
+        other = PayPalFactory(user_id=43)
+        other.create()
+
+        response = self.client.delete(f"{BASE_URL}?user_id=42&type=CREDIT_CARD")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json(), {"deleted": 3})
+        self.assertEqual(len(self.client.get(f"{BASE_URL}?user_id=42").get_json()), 1)
+
+        response = self.client.delete(f"{BASE_URL}?user_id=42")
+        self.assertEqual(response.get_json(), {"deleted": 1})
+        response = self.client.delete(f"{BASE_URL}?user_id=42")
+        self.assertEqual(response.get_json(), {"deleted": 0})
+
+        # the subclass rows went with them and other users are untouched
+        self.assertEqual(db.session.query(CreditCard).count(), 0)
+        self.assertEqual(db.session.query(PayPal).count(), 1)
+        response = self.client.get(f"{BASE_URL}/{other.id}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_delete_payment_methods_by_filter_bad_request(self):
+        """It should not Delete Payment Methods without a valid filter"""
+        PayPalFactory().create()
+        response = self.client.delete(BASE_URL)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.delete(f"{BASE_URL}?type=CASH")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("the types are", response.get_json()["message"])
+        response = self.client.delete(f"{BASE_URL}?user_id=abc")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Invalid user_id 'abc'", response.get_json()["message"])
+        response = self.client.delete(f"{BASE_URL}?user_id={2**31}")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(PaymentMethod.all()), 1)
+
+    def test_payment_stats(self):
+        """It should count the PaymentMethods by type, default, user and card expiry"""
+        for _ in range(3):
+            CreditCardFactory(user_id=1, expiry_year=2030, expiry_month=1).create()
+        CreditCardFactory(user_id=2, expiry_year=2029, expiry_month=12).create()
+        PayPalFactory(user_id=2).create()
+        PayPalFactory(user_id=3).create()
+        PaymentMethod.find_by_user_id(2).first().set_default_for_user()
+
+        response = self.client.get(f"{BASE_URL}/stats")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.get_json(),
+            {
+                "total": 6,
+                "by_type": {"CREDIT_CARD": 4, "PAYPAL": 2},
+                "by_default": {"default": 1, "not_default": 5},
+                "top_users": [
+                    {"user_id": 1, "count": 3},
+                    {"user_id": 2, "count": 2},
+                    {"user_id": 3, "count": 1},
+                ],
+                "credit_card_expiry": [
+                    {"expiry_year": 2029, "expiry_month": 12, "count": 1},
+                    {"expiry_year": 2030, "expiry_month": 1, "count": 3},
+                ],
+            },
+        )
+
+        data = self.client.get(f"{BASE_URL}/stats?user_id=2&top=1").get_json()
+        self.assertEqual(data["total"], 2)
+        self.assertEqual(data["by_type"], {"CREDIT_CARD": 1, "PAYPAL": 1})
+        self.assertEqual(data["top_users"], [{"user_id": 2, "count": 2}])
+        self.assertEqual(data["credit_card_expiry"], [{"expiry_year": 2029, "expiry_month": 12, "count": 1}])
+        data = self.client.get(f"{BASE_URL}/stats?type=PAYPAL&top=1").get_json()
+        self.assertEqual(data["total"], 2)
+        self.assertEqual(len(data["top_users"]), 1)
+        self.assertEqual(data["credit_card_expiry"], [])
+
+    def test_payment_stats_bad_request(self):
+        """It should not count PaymentMethods with a bad top argument or filter"""
+        for query in ("top=0", "top=x", "user_id=abc", "user_id=99999999999", "type=CASH"):
+            response = self.client.get(f"{BASE_URL}/stats?{query}")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+
+    def test_payment_stats_cache(self):
+        """It should reuse the stats of the same filters while they are cached"""
+        stats_cache = app.extensions["stats_cache"]
+        app.extensions["stats_cache"] = MemoryCache(ttl=60)
+        try:
+            PayPalFactory(user_id=1).create()
+            self.assertEqual(self.client.get(f"{BASE_URL}/stats?user_id=1").get_json()["total"], 1)
+            PayPalFactory(user_id=1).create()
+            self.assertEqual(self.client.get(f"{BASE_URL}/stats?user_id=1").get_json()["total"], 1)
+            self.assertEqual(self.client.get(f"{BASE_URL}/stats?user_id=1&top=5").get_json()["total"], 2)
+            self.assertEqual(app.extensions["stats_cache"].stats()["hits"], 1)
+            # the same filters spelled differently share an entry
+            self.assertEqual(self.client.get(f"{BASE_URL}/stats?user_id=01&type=paypal").get_json()["total"], 2)
+            self.assertEqual(self.client.get(f"{BASE_URL}/stats?user_id=1&type=PAYPAL").get_json()["total"], 2)
+            self.assertEqual(app.extensions["stats_cache"].stats()["hits"], 2)
+        finally:
+            app.extensions["stats_cache"] = stats_cache
+
     def test_list_payment_methods(self):
         """It should List all PaymentMethods"""
         first_payment_method = CreditCardFactory()
@@ -247,6 +475,16 @@ class TestPaymentsService(TestCase):
         self.assertEqual(len(data), 1)
         self.assertEqual(data[0], second_payment_method.serialize())
 
+    def test_list_payment_methods_with_bad_filters(self):
+        """It should not List PaymentMethods with an invalid user_id or type"""
+        CreditCardFactory().create()
+        for query in ("user_id=abc", "user_id=1.5", "type=CASH"):
+            response = self.client.get(f"{BASE_URL}?{query}")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+        response = self.client.get(f"{BASE_URL}?type=paypal")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json(), [])
+
     def test_list_payment_methods_with_type(self):
         """It should List all PaymentMethods matching type query"""
         first_payment_method = CreditCardFactory()
@@ -285,6 +523,203 @@ class TestPaymentsService(TestCase):
         self.assertEqual(len(data), 1)
         self.assertEqual(data[0], third_payment_method.serialize())
 
+    def test_list_payment_methods_paginated(self):
+        """It should List PaymentMethods one page at a time using a cursor"""
+        for _ in range(5):
+            CreditCardFactory(user_id=7).create()
+        PayPalFactory(user_id=8).create()
+
+        seen = []
+        url = f"{BASE_URL}?user_id=7&limit=2"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            data = response.get_json()
+            self.assertLessEqual(len(data), 2)
+            seen.extend(item["id"] for item in data)
+            url = None
+            if "Link" in response.headers:
+                self.assertIn('rel="next"', response.headers["Link"])
+                url = f"{BASE_URL}?user_id=7&limit=2&cursor={response.headers['X-Next-Cursor']}"
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(seen, sorted(seen))
+
+    def test_list_payment_methods_page_limit_is_capped(self):
+        """It should never return more than MAX_PAGE_SIZE PaymentMethods"""
+        for _ in range(3):
+            PayPalFactory().create()
+        max_page_size = app.config["MAX_PAGE_SIZE"]
+        app.config["MAX_PAGE_SIZE"] = 2
+        try:
+            response = self.client.get(f"{BASE_URL}?limit=50")
+        finally:
+            app.config["MAX_PAGE_SIZE"] = max_page_size
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.get_json()), 2)
+        self.assertIn("X-Next-Cursor", response.headers)
+
+    def test_list_payment_methods_bad_pagination_args(self):
+        """It should respond with 400 BAD REQUEST for a bad limit or cursor"""
+        response = self.client.get(f"{BASE_URL}?limit=0")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(f"{BASE_URL}?limit=abc")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(f"{BASE_URL}?cursor=not-a-cursor")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(f"{BASE_URL}?cursor=eDox")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        # id:9999999999999999, outside the range of an id
+        response = self.client.get(f"{BASE_URL}?cursor=aWQ6OTk5OTk5OTk5OTk5OTk5OQ")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Invalid cursor", response.get_json()["message"])
+
+    def test_list_payment_methods_constant_queries(self):
+        """It should List PaymentMethods with the same number of SQL statements for any result size"""
+        statements = []
+
+        def count_statement(*_args):
+            statements.append(1)
+
+        def count_list_statements():
+            db.session.expunge_all()  # make sure nothing is served from the identity map
+            statements.clear()
+            event.listen(db.engine, "before_cursor_execute", count_statement)
+            try:
+                response = self.client.get(BASE_URL)
+            finally:
+                event.remove(db.engine, "before_cursor_execute", count_statement)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return len(statements)
+
+        CreditCardFactory().create()
+        PayPalFactory().create()
+        small = count_list_statements()
+        for _ in range(10):
+            CreditCardFactory().create()
+            PayPalFactory().create()
+        large = count_list_statements()
+        self.assertEqual(small, large)
+        # one query for payment_method plus one per subclass table
+        self.assertLessEqual(large, 3)
+
+    def test_list_payment_methods_with_fields(self):
+        """It should List only the requested fields, without reading the subclass tables"""
+        for _ in range(2):
+            CreditCardFactory(user_id=5).create()
+            PayPalFactory(user_id=5).create()
+        full = self.client.get(f"{BASE_URL}?user_id=5").get_json()
+
+        statements = []
+
+        def record_statement(_conn, _cursor, statement, *_args):
+            statements.append(statement)
+
+        db.session.expunge_all()
+        event.listen(db.engine, "before_cursor_execute", record_statement)
+        try:
+            response = self.client.get(f"{BASE_URL}?user_id=5&fields=id,name,type,is_default")
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record_statement)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        keys = ("id", "name", "type", "is_default")
+        self.assertEqual(response.get_json(), [{key: item[key] for key in keys} for item in full])
+        self.assertEqual(len(statements), 1)
+        self.assertNotIn("credit_card", statements[0])
+        self.assertNotIn("billing_address", statements[0])
+
+        response = self.client.get(f"{BASE_URL}?user_id=5&fields=id,email,card_number&limit=3")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for item, expected in zip(response.get_json(), full):
+            fields = {"id", "email"} if expected["type"] == "PAYPAL" else {"id", "card_number"}
+            self.assertEqual(item, {key: expected[key] for key in fields})
+        self.assertIn("fields=id,email,card_number", response.headers["Link"])
+
+        # a field of only one type leaves the PaymentMethods of the other empty
+        for field in ("email", "card_number"):
+            response = self.client.get(f"{BASE_URL}?user_id=5&fields={field}")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.get_json(), [{field: item[field]} if field in item else {} for item in full])
+
+    def test_list_payment_methods_fields_etag(self):
+        """It should give each set of fields of a page its own ETag"""
+        CreditCardFactory().create()
+        etag = self.client.get(BASE_URL).headers["ETag"]
+        sparse = self.client.get(f"{BASE_URL}?fields=id,name")
+        self.assertNotEqual(sparse.headers["ETag"], etag)
+        response = self.client.get(f"{BASE_URL}?fields=name,id", headers={"If-None-Match": sparse.headers["ETag"]})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_list_payment_methods_bad_fields(self):
+        """It should not List PaymentMethods with an unknown field"""
+        response = self.client.get(f"{BASE_URL}?fields=id,version")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Unknown fields version", response.get_json()["message"])
+        response = self.client.get(f"{BASE_URL}?fields=,")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_stream_payment_methods_with_fields(self):
+        """It should stream only the requested fields"""
+        CreditCardFactory(user_id=5).create()
+        PayPalFactory(user_id=5).create()
+        response = self.client.get(
+            f"{BASE_URL}?user_id=5&fields=name,user_id", headers={"Accept": "application/x-ndjson"}
+        )
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([set(line) for line in lines], [{"name", "user_id"}] * 2)
+
+    def test_stream_payment_methods(self):
+        """It should stream all PaymentMethods as NDJSON from a server-side cursor"""
+        for _ in range(3):
+            CreditCardFactory(user_id=5).create()
+            PayPalFactory(user_id=5).create()
+        PayPalFactory(user_id=6).create()
+        expected = self.client.get(f"{BASE_URL}?user_id=5").get_json()
+
+        options = []
+
+        def record_options(_conn, _cursor, _statement, _parameters, context, _many):
+            options.append(context.execution_options)
+
+        batch_size = app.config["STREAM_BATCH_SIZE"]
+        app.config["STREAM_BATCH_SIZE"] = 2
+        event.listen(db.engine, "before_cursor_execute", record_options)
+        try:
+            response = self.client.get(
+                f"{BASE_URL}?user_id=5", headers={"Accept": "application/x-ndjson"}
+            )
+            self.assertTrue(response.is_streamed)
+            lines = response.get_data(as_text=True).splitlines()
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record_options)
+            app.config["STREAM_BATCH_SIZE"] = batch_size
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        self.assertEqual([json.loads(line) for line in lines], expected)
+        self.assertTrue(options[0].get("stream_results"))
+        self.assertEqual(options[0].get("yield_per"), 2)
+
+    def test_stream_payment_methods_with_limit_and_cursor(self):
+        """It should stream PaymentMethods after a cursor, up to the limit"""
+        for _ in range(4):
+            PayPalFactory().create()
+        headers = {"Accept": "application/x-ndjson"}
+        page = self.client.get(f"{BASE_URL}?limit=1")
+        cursor = page.headers["X-Next-Cursor"]
+        response = self.client.get(f"{BASE_URL}?cursor={cursor}&limit=2", headers=headers)
+        ids = [json.loads(line)["id"] for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual(len(ids), 2)
+        self.assertGreater(ids[0], page.get_json()[0]["id"])
+        self.assertEqual(ids, sorted(ids))
+        response = self.client.get(f"{BASE_URL}?limit=0", headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        # a limit the database cannot take is refused before the stream starts
+        response = self.client.get(f"{BASE_URL}?limit=99999999999999999999", headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("limit must be at most", response.get_json()["message"])
+        response = self.client.get(f"{BASE_URL}?limit={2**63 - 1}", headers=headers)
+        self.assertEqual(len(response.get_data(as_text=True).splitlines()), 4)
+
     def test_get_payment_method(self):
         """It should Get a single PaymentMethod"""
         test_payment_method = CreditCardFactory()
@@ -294,6 +729,71 @@ class TestPaymentsService(TestCase):
         data = response.get_json()
         self.assertEqual(data["name"], test_payment_method.name)
 
+    def test_get_payment_method_not_modified(self):
+        """It should return 304 Not Modified for a matching If-None-Match ETag"""
+        payment_method = CreditCardFactory()
+        payment_method.create()
+        response = self.client.get(f"{BASE_URL}/{payment_method.id}")
+        etag = response.headers["ETag"]
+        self.assertEqual(etag, f'"{payment_method.id}.1"')
+
+        statements = []
+
+        def count_statement(*_args):
+            statements.append(1)
+
+        db.session.expunge_all()
+        event.listen(db.engine, "before_cursor_execute", count_statement)
+        try:
+            response = self.client.get(
+                f"{BASE_URL}/{payment_method.id}", headers={"If-None-Match": etag}
+            )
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count_statement)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.data, b"")
+        self.assertEqual(response.headers["ETag"], etag)
+        # the version comes from the cache, the database is not touched
+        self.assertEqual(len(statements), 0)
+
+        response = self.client.put(
+            f"{BASE_URL}/{payment_method.id}",
+            json={**payment_method.serialize(), "name": "Renamed"},
+        )
+        self.assertNotEqual(response.headers["ETag"], etag)
+        response = self.client.get(
+            f"{BASE_URL}/{payment_method.id}", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json()["name"], "Renamed")
+
+    def test_list_payment_methods_not_modified(self):
+        """It should return 304 Not Modified for an unchanged page of PaymentMethods"""
+        user_id = 7
+        first = CreditCardFactory(user_id=user_id)
+        first.create()
+        PayPalFactory(user_id=user_id).create()
+        response = self.client.get(f"{BASE_URL}?user_id={user_id}")
+        etag = response.headers["ETag"]
+        response = self.client.get(
+            f"{BASE_URL}?user_id={user_id}", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.data, b"")
+        # other pages of the same rows have their own ETag
+        response = self.client.get(
+            f"{BASE_URL}?user_id={user_id}&limit=1", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # setting a default changes the version of every row of the user
+        self.client.put(f"{BASE_URL}/{first.id}/set-default", json={"user_id": user_id})
+        response = self.client.get(
+            f"{BASE_URL}?user_id={user_id}", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
     def test_set_payment_method_as_default(self):
         """It should set a payment method as the default"""
         payment_method = CreditCardFactory()
@@ -318,6 +818,55 @@ class TestPaymentsService(TestCase):
         updated_method = response.get_json()
         self.assertTrue(updated_method["is_default"])
 
+    def test_change_payment_method_behind_the_cache(self):
+        """It should Update, set as default and Delete the row, not the cached PaymentMethod"""
+        first, second = PayPalFactory(user_id=7), PayPalFactory(user_id=7)
+        PaymentMethod.create_batch([first, second])
+        body = self.client.get(f"{BASE_URL}/{first.id}").get_json()
+
+        # another service moves the row to another user behind the cache
+        db.session.execute(
+            PaymentMethod.__table__.update()
+            .where(PaymentMethod.id == first.id)
+            .values(user_id=8, version=PaymentMethod.version + 1)
+        )
+        db.session.commit()
+        self.assertEqual(self.client.get(f"{BASE_URL}/{first.id}").get_json()["user_id"], 7)
+
+        self.client.put(f"{BASE_URL}/{second.id}/set-default", headers=self.headers)
+        response = self.client.put(f"{BASE_URL}/{first.id}/set-default", headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json()["user_id"], 8)
+        # the default of the user it was moved from is kept
+        self.assertTrue(self.client.get(f"{BASE_URL}/{second.id}").get_json()["is_default"])
+
+        response = self.client.put(
+            f"{BASE_URL}/{first.id}", json={**body, "user_id": 8, "name": "moved"}, headers=self.headers
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json()["name"], "moved")
+
+        # and another deletes it
+        self.client.get(f"{BASE_URL}/{first.id}")
+        db.session.execute(PaymentMethod.__table__.delete().where(PaymentMethod.id == first.id))
+        db.session.commit()
+        response = self.client.put(f"{BASE_URL}/{first.id}/set-default", headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.put(f"{BASE_URL}/{first.id}", json=body, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.delete(f"{BASE_URL}/{first.id}", headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_set_payment_method_as_default_conflict(self):
+        """It should return 409 Conflict when setting a default keeps deadlocking"""
+        payment_method = PayPalFactory()
+        payment_method.create()
+        deadlock = OperationalError("UPDATE", {}, DeadlockDetected("deadlock detected"))
+        with patch.object(PaymentMethod, "_set_default", side_effect=deadlock):
+            response = self.client.put(f"{BASE_URL}/{payment_method.id}/set-default", headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertIn("try again", response.get_json()["message"])
+
     def test_set_payment_method_as_default_no_exist(self):
         """It should set a payment method as the default"""
         response = self.client.put(
@@ -327,6 +876,37 @@ class TestPaymentsService(TestCase):
         )
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_get_default_payment_method(self):
+        """It should get the default PaymentMethod of a user"""
+        methods = [CreditCardFactory(user_id=42), PayPalFactory(user_id=42)]
+        PaymentMethod.create_batch(methods)
+        response = self.client.get("/api/users/42/default-payment")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIn("no default", response.get_json()["message"])
+
+        self.client.put(f"{BASE_URL}/{methods[1].id}/set-default", headers=self.headers)
+        response = self.client.get("/api/users/42/default-payment")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual(data["id"], methods[1].id)
+        self.assertEqual(data["type"], "PAYPAL")
+        self.assertTrue(data["is_default"])
+        etag = response.headers["ETag"]
+        self.assertEqual(etag, self.client.get(f"{BASE_URL}/{methods[1].id}").headers["ETag"])
+        response = self.client.get("/api/users/42/default-payment", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.put(f"{BASE_URL}/{methods[0].id}/set-default", headers=self.headers)
+        response = self.client.get("/api/users/42/default-payment", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json()["id"], methods[0].id)
+
+        # negative user ids are valid, those outside the range of user_id are not
+        PayPalFactory(user_id=-5, is_default=True).create()
+        self.assertEqual(self.client.get("/api/users/-5/default-payment").get_json()["user_id"], -5)
+        response = self.client.get("/api/users/99999999999/default-payment")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_set_new_default_unset_previous_default(self):
         """It should unset the previous default when a new default is set"""
         user_id = 123
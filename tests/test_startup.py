@@ -0,0 +1,76 @@
+"""
+Test cases for the startup timing and the fast startup mode
+"""
+
+import json
+import os
+import subprocess
+import sys
+from unittest import TestCase
+import click
+from wsgi import app
+from service.common.startup import PHASES, StartupTimer, running_cli
+
+
+######################################################################
+#  S T A R T U P   T E S T   C A S E S
+######################################################################
+class TestStartupTimer(TestCase):
+    """Startup timer tests"""
+
+    def test_mark_phases(self):
+        """It should time each phase from the end of the last one"""
+        times = iter([1.5, 1.75, 2.0, 2.5])
+        timer = StartupTimer(1.0, timer=lambda: next(times))
+        timer.mark("imports")
+        timer.mark("app")
+        timer.mark("db")
+        timer.mark("app")
+        report = timer.report()
+        self.assertEqual(report["total_ms"], 1500.0)
+        self.assertEqual(report["phases_ms"]["imports"], 500.0)
+        self.assertEqual(report["phases_ms"]["app"], 750.0)
+        self.assertEqual(report["phases_ms"]["db"], 250.0)
+        self.assertEqual(report["phases_ms"]["routes"], 0.0)
+        self.assertEqual(list(report["phases_ms"]), list(PHASES))
+
+    def test_summary(self):
+        """It should write the report as one line"""
+        times = iter([0.0, 0.25])
+        timer = StartupTimer(timer=lambda: next(times))
+        timer.mark("imports")
+        self.assertEqual(
+            timer.summary(),
+            "Started in 250.0 ms: imports 250.0 ms, app 0.0 ms, db 0.0 ms, routes 0.0 ms, logging 0.0 ms",
+        )
+
+    def test_running_cli(self):
+        """It should tell whether the flask command is loading the app"""
+        self.assertFalse(running_cli())
+        with click.Context(click.Command("flask")):
+            self.assertTrue(running_cli())
+
+    def test_app_report(self):
+        """It should keep the startup report of the app"""
+        report = app.extensions["startup"]
+        self.assertEqual(set(report["phases_ms"]), set(PHASES))
+        self.assertGreater(report["total_ms"], 0)
+        self.assertIn("migrate", app.extensions)
+
+    def test_fast_startup(self):
+        """It should start without the migration commands and Alembic, and with everything else"""
+        code = (
+            "import json, sys, wsgi; "
+            "print(json.dumps(['alembic' in sys.modules, 'db' in wsgi.app.cli.commands, "
+            "'migrate' in wsgi.app.extensions, sorted(wsgi.app.extensions)]))"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            env={**os.environ, "FAST_STARTUP": "true"},
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        alembic, db_command, migrate, extensions = json.loads(result.stdout.strip().splitlines()[-1])
+        self.assertEqual([alembic, db_command, migrate], [False, False, False])
+        self.assertLessEqual({"cache", "compression", "engines", "startup"}, set(extensions))
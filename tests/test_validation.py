@@ -0,0 +1,63 @@
+"""
+Test cases for the validation of PaymentMethod bodies
+"""
+
+from unittest import TestCase
+from service.models import PaymentMethodType, DataValidationError, ValidationErrors, body_errors, validate
+from tests.factories import CreditCardFactory, PayPalFactory
+
+
+######################################################################
+#  V A L I D A T I O N   T E S T   C A S E S
+######################################################################
+class TestValidation(TestCase):
+    """Whole body validation tests"""
+
+    def test_valid_bodies(self):
+        """It should accept the bodies of every PaymentMethod type"""
+        for factory in (CreditCardFactory, PayPalFactory):
+            body = factory().serialize()
+            self.assertEqual(body_errors(body), {})
+            self.assertIs(validate(body), body)
+
+    def test_all_errors_of_a_body(self):
+        """It should report every invalid and missing field at once"""
+        body = CreditCardFactory().serialize()
+        body.update(first_name="R2D2", card_number="1234", expiry_month=13, user_id=True)
+        del body["zip_code"]
+        with self.assertRaises(ValidationErrors) as context:
+            validate(body)
+        self.assertEqual(
+            context.exception.errors,
+            {
+                "user_id": "User id field must be an integer",
+                "first_name": "First name field must contain letters only",
+                "card_number": "Card number field must be 16 digits",
+                "expiry_month": "Expiry month field is invalid",
+                "zip_code": "zip_code is required",
+            },
+        )
+        self.assertIsInstance(context.exception, DataValidationError)
+        self.assertIn("Card number field must be 16 digits; ", str(context.exception))
+
+    def test_bodies_without_a_type(self):
+        """It should refuse bodies that are not objects or have no known type"""
+        self.assertEqual(body_errors(["a", "list"]), {"body": "Body must be a JSON object"})
+        for name in (None, "CASH", ["PAYPAL"]):
+            self.assertEqual(body_errors({"type": name}), {"type": "PaymentMethod must have a type"})
+
+    def test_type_of_an_update(self):
+        """It should refuse to change the type of a stored PaymentMethod"""
+        body = PayPalFactory().serialize()
+        self.assertEqual(body_errors(body, PaymentMethodType.PAYPAL), {})
+        self.assertEqual(
+            body_errors(body, PaymentMethodType.CREDIT_CARD),
+            {"type": "Type field must be CREDIT_CARD"},
+        )
+
+    def test_email(self):
+        """It should check emails with the compiled pattern"""
+        body = PayPalFactory().serialize()
+        for email in ("nobody", "a@b", 42):
+            body["email"] = email
+            self.assertEqual(body_errors(body), {"email": "Email field is invalid"})